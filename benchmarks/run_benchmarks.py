@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""Benchmarks of the pseyepy acquisition and recording pipeline.
+
+Runs on simulated cameras (see Camera(simulate=...)), whose USB data goes through the
+real driver code, so no camera or GPU is needed and results are comparable across machines
+and commits. Measures:
+  debayer : frames/s and ns/pixel of the driver's frame decoding, per colour mode and resolution
+  read : per-call overhead of Camera.read (excluding the wait for the camera), and the latency from frame arrival to its return, also with frames cropped or binned in the driver, and per frame of Camera.read_batch
+  ctrl : per-call overhead of setting camera parameters (CtrlList.__setitem__, Camera.set_params); simulated registers, so no USB round trips
+  policy : latency from USB arrival to the return of Camera.read under each acquisition policy ('fifo', 'latest'), with a consumer that keeps up and one that does not
+  latency : end-to-end latency from Camera.read in the CamDump thread to the moment a Writer hands the frame to its file writer
+  writers : sustained throughput of each available writer class (RawWriter, HDF5Writer, FFMpegWriter presets, OpencvWriter)
+  processing : time per frame of each built-in frame-processing kernel (pseyepy.processing), and of a Processor running them all
+
+Results are written as JSON, along with the commit and machine they were measured on; --compare prints the change against an earlier run:
+  python benchmarks/run_benchmarks.py -o before.json
+  python benchmarks/run_benchmarks.py -o after.json --compare before.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import pseyepy
+from pseyepy import Camera
+from pseyepy.cameras import debayer
+from pseyepy.demosaic import demosaic
+from pseyepy import io
+from pseyepy import processing
+from pseyepy.asynchronous import FrameRing
+
+RESOLUTIONS = {'320x240': Camera.RES_SMALL, '640x480': Camera.RES_LARGE}
+
+
+def _best(fn, n, repeat=5):
+    # seconds per call: best and median over `repeat` runs of n calls
+    per_call = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            fn()
+        per_call.append((time.perf_counter() - t0) / n)
+    return min(per_call), float(np.median(per_call))
+
+
+def _frames(shape, n=8, seed=0):
+    # camera-like content: a gradient with noise, so encoders have neither a trivial nor an impossible job
+    rng = np.random.default_rng(seed)
+    h, w = shape[:2]
+    base = (np.add.outer(np.arange(h), np.arange(w)) // 4 % 256).astype(np.uint8)
+    if len(shape) == 3:
+        base = np.repeat(base[..., None], shape[2], axis=2)
+    return [np.clip(base + rng.integers(-3, 4, shape), 0, 255).astype(np.uint8) for _ in range(n)]
+
+
+def bench_debayer(quick):
+    results = {}
+    n = 20 if quick else 100
+    for res, (w, h) in [(r, Camera._RESOLUTION[v]) for r, v in RESOLUTIONS.items()]:
+        raw = _frames((h, w))[0]
+        for colour in ['rgb', 'gray', 'rgb_half', 'green', 'bayer']:
+            best, median = _best(lambda: debayer(raw, colour), n)
+            results['{}_{}'.format(colour, res)] = dict(frames_per_s=1 / best, ns_per_pixel=1e9 * best / (w * h), median_ms=1e3 * median)
+        # the NumPy reference implementation, for bulk conversion of recorded raw frames
+        best, median = _best(lambda: demosaic(raw), max(n // 10, 3))
+        results['numpy_rgb_{}'.format(res)] = dict(frames_per_s=1 / best, ns_per_pixel=1e9 * best / (w * h), median_ms=1e3 * median)
+    return results
+
+
+def bench_read(quick):
+    results = {}
+    n = 60 if quick else 300
+    cases = [('{}_{}'.format(colour, res), res, fps, dict(colour=colour)) for res, fps in [('320x240', 150), ('640x480', 60)] for colour in ['rgb', 'gray', 'bayer']]
+    # frames reduced in the driver: a quarter of the sensor, and the whole sensor binned 2x2
+    cases += [('rgb_roi_640x480', '640x480', 60, dict(colour='rgb', roi=(160, 120, 320, 240))), ('rgb_bin2_640x480', '640x480', 60, dict(colour='rgb', binning=2))]
+    for case, res, fps, kwargs in cases:
+        cam = Camera(0, resolution=RESOLUTIONS[res], fps=fps, simulate=True, **kwargs)
+        try:
+            for _ in range(10):
+                cam.read()
+
+            # the time spent blocked waiting for the camera is known from the driver's counters, and is not overhead
+            before = cam.stats(0)
+            t0 = time.perf_counter()
+            for _ in range(n):
+                cam.read()
+            elapsed = time.perf_counter() - t0
+            waited = cam.stats(0, since=before)['dequeue_wait']
+
+            latency = []
+            for _ in range(n // 2):
+                _, ts, info = cam.read(info=True)
+                latency.append(ts - info['arrival'])
+
+            # the same number of frames in a single Camera.read_batch
+            before = cam.stats(0)
+            t0 = time.perf_counter()
+            cam.read_batch(n)
+            batch_elapsed = time.perf_counter() - t0
+            batch_waited = cam.stats(0, since=before)['dequeue_wait']
+        finally:
+            cam.end()
+        results[case] = dict(overhead_us=1e6 * (elapsed - waited) / n, latency_ms_median=1e3 * float(np.median(latency)),
+                             latency_ms_p99=1e3 * float(np.percentile(latency, 99)), batch_overhead_us=1e6 * (batch_elapsed - batch_waited) / n)
+    return results
+
+
+def bench_ctrl(quick):
+    n = 200 if quick else 2000
+    cam = Camera([0, 1], simulate=True)
+    try:
+        values = iter(np.tile([100, 101], n * 10))
+        item, _ = _best(lambda: cam.exposure.__setitem__(0, int(next(values))), n)
+        broadcast, _ = _best(lambda: setattr(cam, 'gain', int(next(values)) % 64), n)
+        batch, _ = _best(lambda: cam.set_params(dict(gain=int(next(values)) % 64, exposure=int(next(values)))), n)
+        unchanged, _ = _best(lambda: cam.set_params(dict(gain=10, exposure=10)), n)
+    finally:
+        cam.end()
+    return dict(setitem=dict(per_call_us=1e6 * item), set_all_cameras=dict(per_call_us=1e6 * broadcast, n_cams=2),
+                set_params=dict(per_call_us=1e6 * batch, n_cams=2, n_params=2), set_params_unchanged=dict(per_call_us=1e6 * unchanged, n_cams=2, n_params=2))
+
+
+def bench_policy(quick):
+    results = {}
+    n = 60 if quick else 300
+    cam = Camera(0, fps=100, colour='bayer', simulate=True, queue_depth=4)
+    try:
+        # a consumer spending half a frame interval on each frame, and one spending 1.2 intervals
+        for load, work in [('light', 0.005), ('heavy', 0.012)]:
+            for policy, res in cam.measure_latency(n_frames=n, work=work, policy=['fifo', 'latest']).items():
+                results['{}_{}'.format(policy, load)] = dict(ms_median=1e3 * res['median'], ms_p99=1e3 * res['p99'], skipped=res['skipped'], overwritten=res['overwritten'])
+    finally:
+        cam.end()
+    return results
+
+
+class _LatencyWriter():
+    # a file writer that only records how long after its read each frame arrives
+    latencies = []
+
+    def __init__(self, file_name, **kwargs):
+        pass
+
+    def write(self, frame, timestamp=None, seq=None):
+        _LatencyWriter.latencies.append(time.time() - timestamp)
+
+    def end(self):
+        pass
+
+
+def bench_latency(quick):
+    results = {}
+    duration = 2 if quick else 6
+    for res, fps in [('320x240', 150), ('640x480', 60)]:
+        cam = Camera(0, resolution=RESOLUTIONS[res], fps=fps, colour=True, simulate=True)
+        _LatencyWriter.latencies = []
+        try:
+            stream = io.Stream(cam, file_name=os.path.join(tempfile.gettempdir(), 'pseyepy_bench'), writer_class=_LatencyWriter)
+            time.sleep(duration)
+            stream.end()
+            stats = stream.stats()['file_0']
+        finally:
+            cam.end()
+        lat = np.array(_LatencyWriter.latencies[fps // 10:]) # leave out the start-up
+        results['rgb_{}'.format(res)] = dict(frames=len(lat), dropped=stats['dropped'], ms_median=1e3 * float(np.median(lat)),
+                                             ms_p90=1e3 * float(np.percentile(lat, 90)), ms_p99=1e3 * float(np.percentile(lat, 99)), ms_max=1e3 * float(lat.max()))
+    return results
+
+
+def _writer_classes(ffmpeg):
+    # (name, class, kwargs) of each writer available here
+    classes = [('raw', io.RawWriter, {})]
+    try:
+        import h5py
+        classes += [('hdf5', io.HDF5Writer, {}), ('hdf5_lzf', io.HDF5Writer, dict(compression='lzf'))]
+    except ImportError:
+        pass
+    if ffmpeg or os.environ.get('PSEYEPY_FFMPEG') or shutil.which('ffmpeg'):
+        for preset in ['lossless', 'fast', 'mjpeg']:
+            classes.append(('ffmpeg_' + preset, io.FFMpegWriter, dict(preset=preset, ffmpeg=ffmpeg)))
+    if io.cv2 is not None:
+        classes.append(('opencv', io.OpencvWriter, {}))
+    return classes
+
+
+def bench_writers(quick, ffmpeg=None):
+    results = {}
+    n = 60 if quick else 300
+    frames = _frames((480, 640, 3))
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, klass, kwargs in _writer_classes(ffmpeg):
+            file_name = os.path.join(tmp, name)
+            writer = klass(file_name, shape=(640, 480), colour=True, fps=60, **kwargs)
+            t0 = time.perf_counter()
+            for i in range(n):
+                writer.write(frames[i % len(frames)], timestamp=time.time(), seq=i)
+            writer.end()
+            elapsed = time.perf_counter() - t0
+            written = sum([os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp) if f.startswith(name)])
+            nbytes = n * frames[0].nbytes
+            results[name] = dict(frames_per_s=n / elapsed, mbytes_per_s=1e-6 * nbytes / elapsed, compression=nbytes / written if written else None)
+            for f in os.listdir(tmp):
+                os.remove(os.path.join(tmp, f))
+    return results
+
+
+def bench_processing(quick):
+    results = {}
+    n = 60 if quick else 300
+    kernels = dict(frame_diff=processing.FrameDiff, background=processing.BackgroundSubtraction, blob=processing.BlobCentroid)
+    for res in RESOLUTIONS:
+        w, h = map(int, res.split('x'))
+        frames = _frames((h, w, 3))
+        for name, klass in kernels.items():
+            kernel = klass()
+            it = iter(range(10**9))
+            best, median = _best(lambda: kernel(frames[next(it) % len(frames)]), n)
+            results['{}_rgb_{}'.format(name, res)] = dict(ms_best=1e3 * best, ms_median=1e3 * median)
+
+        # all three kernels on two cameras, including the Processor's bookkeeping and thread pool
+        src = FrameRing([(h, w, 3)] * 2, capacity=n, policy='block', seq=True)
+        proc = processing.Processor(src, [klass() for klass in kernels.values()], history=n)
+        t0 = time.perf_counter()
+        for i in range(n):
+            src.put(([frames[i % len(frames)], frames[(i + 1) % len(frames)]], np.array([i, i]) / 60, np.array([i, i])))
+        proc.end()
+        results['processor_2cams_rgb_{}'.format(res)] = dict(ms_per_frame_set=1e3 * (time.perf_counter() - t0) / n, process_ms=proc.stats()['process_ms'])
+    return results
+
+
+BENCHMARKS = dict(debayer=bench_debayer, read=bench_read, ctrl=bench_ctrl, policy=bench_policy, latency=bench_latency, writers=bench_writers, processing=bench_processing)
+
+
+def _git(*args):
+    try:
+        return subprocess.run(['git'] + list(args), cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def _meta():
+    cpu = platform.processor()
+    if os.path.exists('/proc/cpuinfo'):
+        with open('/proc/cpuinfo') as f:
+            names = [l.split(':', 1)[1].strip() for l in f if l.startswith('model name')]
+        cpu = names[0] if names else cpu
+    return dict(commit=_git('rev-parse', 'HEAD'), dirty=bool(_git('status', '--porcelain', '--untracked-files=no')),
+                date=datetime.datetime.now().isoformat(timespec='seconds'), platform=platform.platform(), cpu=cpu, cpu_count=os.cpu_count(),
+                python=platform.python_version(), numpy=np.__version__, pseyepy=os.path.dirname(pseyepy.__file__))
+
+
+def compare(old, new):
+    """Print the relative change of every numeric result present in both runs"""
+    print('\nChange against {} ({}):'.format(old['meta'].get('commit'), old['meta'].get('date')))
+    for bench, cases in new['results'].items():
+        for case, metrics in cases.items():
+            before = old['results'].get(bench, {}).get(case, {})
+            for metric, val in metrics.items():
+                ref = before.get(metric)
+                if isinstance(val, (int, float)) and isinstance(ref, (int, float)) and ref:
+                    print('  {:<34} {:<20} {:>12.4g} -> {:>12.4g} ({:+.1f}%)'.format(bench + '.' + case, metric, ref, val, 100 * (val / ref - 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', default=None, help='JSON file to write (default: benchmark_<commit>.json)')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS), help='benchmarks to run')
+    parser.add_argument('--quick', action='store_true', help='fewer iterations, for a smoke test')
+    parser.add_argument('--ffmpeg', default=None, help='ffmpeg executable for the writer benchmark')
+    parser.add_argument('--compare', default=None, help='earlier JSON result to compare against')
+    args = parser.parse_args()
+
+    out = dict(meta=_meta(), results={})
+    for name in args.only:
+        kwargs = dict(ffmpeg=args.ffmpeg) if name == 'writers' else {}
+        print('{}...'.format(name), flush=True)
+        out['results'][name] = BENCHMARKS[name](args.quick, **kwargs)
+        for case, metrics in out['results'][name].items():
+            print('  {:<22} {}'.format(case, ', '.join(['{}={:.4g}'.format(k, v) if isinstance(v, float) else '{}={}'.format(k, v) for k, v in metrics.items()])))
+
+    output = args.output or 'benchmark_{}.json'.format((out['meta']['commit'] or 'unknown')[:10])
+    with open(output, 'w') as f:
+        json.dump(out, f, indent=2)
+    print('Results written to {}'.format(output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), out)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
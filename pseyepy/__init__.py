@@ -28,6 +28,8 @@ if sys.platform == 'win32':
 		# Don't fail import just because DLL path setup failed
 		pass
 
-from .cameras import Camera, cam_count
+from .cameras import Camera, cam_count, cam_identifiers
+from .demosaic import demosaic
 from .ui import Display
 from .io import Stream
+from .shared import CaptureProcess, SharedFrameReader
@@ -1,39 +1,416 @@
 import threading
 import queue
-import time
+import collections
+import numpy as np
+
+class FrameRing():
+    """Bounded queue of camera frames, stored in preallocated slots
+
+    A drop-in replacement for queue.Queue as a destination of CamDump: items are (frames, timestamps) tuples, where frames is a list of arrays, one per camera.
+    With seq=True, items are (frames, timestamps, seqs) instead, seqs being the driver's frame sequence numbers (see Camera.read(info=True)).
+    Frames are copied into the slots on put, so no memory is allocated while streaming, and memory use is fixed regardless of how far a consumer falls behind.
+
+    The arrays returned by get are views into a slot, which remains valid until the next call to get (or release) by the consumer. Copy them if they are needed for longer.
+    get_many retrieves several items at once, e.g. to hand them to the operating system in a single call; these slots are held together, and count towards the capacity until released.
+
+    When the ring is full, the overflow policy decides what happens to an incoming item:
+        'drop_oldest' : the oldest unread item is discarded to make room (a consumer always sees the freshest frames, e.g. for display)
+        'drop_newest' : the incoming item is discarded
+        'block' : put waits until the consumer frees a slot
+    """
+    POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+    def __init__(self, shapes, capacity=32, policy='drop_oldest', dtype=np.uint8, seq=False, cams=None):
+        """
+        Parameters
+        ----------
+        shapes : list-like
+            shape of the frames from each camera, e.g. Camera.shape
+        capacity : int
+            maximum number of unread items
+        policy : str
+            overflow policy, one of FrameRing.POLICIES
+        dtype : np.dtype
+            dtype of the frames
+        seq : True / False
+            carry frame sequence numbers along with the timestamps
+        cams : list-like
+            indices of the cameras to keep from each item put, e.g. [1] for a ring dedicated to the second camera
+            default: all cameras
+        """
+        if policy not in self.POLICIES:
+            raise Exception('Overflow policy not understood, should be one of {}.'.format(self.POLICIES))
+        if capacity < 1:
+            raise Exception('capacity must be at least 1.')
+
+        self.cams = list(range(len(shapes))) if cams is None else list(cams)
+        self.shapes = [tuple(shapes[c]) for c in self.cams]
+        self.capacity = capacity
+        self.policy = policy
+        self.seq = seq
+
+        # one extra slot, so the slot held by the consumer does not reduce capacity
+        n_slots = capacity + 1
+        self._frames = [[np.empty(s, dtype=dtype) for s in self.shapes] for i in range(n_slots)]
+        self._ts = np.zeros((n_slots, len(self.shapes)))
+        self._seq = np.zeros((n_slots, len(self.shapes)), dtype=np.int64)
+
+        self._free = collections.deque(range(n_slots))
+        self._ready = collections.deque()
+        self._held = []
+        self._filling = 0
+
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+        self.n_put = 0
+        self.n_dropped = 0
+        self.high_water = 0
+
+    def put(self, item, block=True, timeout=None):
+        """Copy an item into the ring
+
+        Parameters
+        ----------
+        item : tuple
+            (frames, timestamps), as returned by Camera.read(timestamp=True, squeeze=False), or (frames, timestamps, seqs) if seq is True
+        block, timeout :
+            apply to the 'block' policy only, as in queue.Queue.put
+
+        Returns
+        -------
+        True if the item was stored, False if it was dropped (under the 'drop_newest' policy, or 'drop_oldest' when all other items are still being stored)
+        """
+        frames,ts = item[:2]
+
+        with self._lock:
+            if self._full():
+                if self.policy == 'drop_oldest' and self._ready:
+                    self._free.append(self._ready.popleft())
+                    self.n_dropped += 1
+                elif self.policy != 'block':
+                    self.n_dropped += 1
+                    return False
+                elif not block or not self._not_full.wait_for(lambda: not self._full(), timeout=timeout):
+                    raise queue.Full
+            slot = self._free.popleft()
+            self._filling += 1
+
+        # the slot belongs to no one else now, so the copy can happen without the lock
+        for j,c in enumerate(self.cams):
+            np.copyto(self._frames[slot][j], frames[c])
+            self._ts[slot,j] = ts[c]
+            if self.seq:
+                self._seq[slot,j] = item[2][c]
+
+        with self._lock:
+            self._ready.append(slot)
+            self._filling -= 1
+            self.n_put += 1
+            self.high_water = max(self.high_water, len(self._ready))
+            self._not_empty.notify()
+        return True
+
+    def get(self, block=True, timeout=None):
+        """Retrieve the oldest unread item
+
+        Also releases the slot returned by the previous call.
+
+        Parameters
+        ----------
+        block, timeout :
+            as in queue.Queue.get; raises queue.Empty if no item is available
+
+        Returns
+        -------
+        (frames, timestamps) : list of arrays (views into the ring) and array of timestamps, one per camera
+        (frames, timestamps, seqs) if seq is True
+        """
+        return self.get_many(1, block=block, timeout=timeout)[0]
+
+    def get_many(self, max_items, block=True, timeout=None):
+        """Retrieve up to max_items of the oldest unread items at once
+
+        Waits only for the first item. Also releases the slots returned by the previous call to get / get_many.
+
+        Returns
+        -------
+        list of items, as returned by get
+        """
+        with self._lock:
+            self._release()
+            if not self._ready:
+                if not block or not self._not_empty.wait_for(lambda: self._ready, timeout=timeout):
+                    raise queue.Empty
+            while self._ready and len(self._held) < max_items:
+                self._held.append(self._ready.popleft())
+            slots = list(self._held)
+            self._not_full.notify()
+        if self.seq:
+            return [(self._frames[s], self._ts[s], self._seq[s]) for s in slots]
+        return [(self._frames[s], self._ts[s]) for s in slots]
+
+    def release(self):
+        """Return the slots of the last items retrieved to the ring, without retrieving more
+        """
+        with self._lock:
+            self._release()
+
+    def _release(self):
+        if self._held:
+            self._free.extend(self._held)
+            self._held = []
+            self._not_full.notify()
+
+    def _full(self):
+        # slots being filled by put count as occupied, so concurrent producers cannot overrun the capacity; slots held by the consumer leave no free slot
+        return len(self._ready) + self._filling >= self.capacity or not self._free
+
+    def qsize(self):
+        return len(self._ready)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        return self.qsize() == self.capacity
+
+    def stats(self):
+        """Occupancy and drop statistics
+
+        Returns
+        -------
+        dict with keys:
+            capacity : maximum number of unread items
+            occupancy : current number of unread items
+            high_water : maximum occupancy reached so far
+            put : number of items stored so far
+            dropped : number of items discarded by the overflow policy so far
+            policy : overflow policy
+        """
+        with self._lock:
+            return dict(capacity=self.capacity, occupancy=len(self._ready), high_water=self.high_water,
+                        put=self.n_put, dropped=self.n_dropped, policy=self.policy)
+
+class PooledFrames(list):
+    """A frame set taken from a FramePool: a list of arrays, one per camera, that belongs to the holder until released
+    """
+    def __init__(self, frames, pool, slot):
+        super().__init__(frames)
+        self.pool = pool
+        self.slot = slot
+        self.released = False
+
+    def release(self):
+        """Return the frame set to its pool; its arrays must not be used afterwards
+        """
+        self.pool.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+class FramePool():
+    """Recycled, preallocated frame sets, to read camera frames into without allocating memory
+
+    Each frame set is a list of arrays, one per camera. get takes a free one, which belongs to the caller until it is released, e.g.
+        pool = cam.frame_pool(8)
+        frames, ts = cam.read(out=pool) # frames is taken from the pool, and filled in by the driver
+        ...
+        frames.release() # or pool.release(frames), once done with it, possibly in another thread
+
+    Unlike the frames returned by a plain Camera.read, which are overwritten by the next read, frames from a pool stay valid until released, so they can be queued or handed to other threads as they are.
+    Once every frame set is in use, get waits for one to be released, or, with grow=True, allocates another (counted in stats); a pool that keeps growing has a consumer that does not release its frames.
+    """
+    def __init__(self, shapes, size=8, dtype=np.uint8, grow=False):
+        """
+        Parameters
+        ----------
+        shapes : list-like
+            shape of the frames from each camera, e.g. Camera.shape
+        size : int
+            number of frame sets allocated up front
+        dtype : np.dtype
+            dtype of the frames
+        grow : True / False
+            allocate a new frame set when none is free, instead of waiting
+        """
+        if size < 1:
+            raise Exception('size must be at least 1.')
+
+        self.shapes = [tuple(s) for s in shapes]
+        self.dtype = dtype
+        self.grow = grow
+
+        self._sets = []
+        self._free = collections.deque()
+        self._owner = {} # id of each array -> its frame set, so that any of them identifies the set on release
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+        self.n_waits = 0
+        for i in range(size):
+            self._free.append(self._allocate())
+
+    def _allocate(self):
+        slot = len(self._sets)
+        frames = PooledFrames([np.empty(s, dtype=self.dtype) for s in self.shapes], self, slot)
+        frames.released = True
+        self._sets.append(frames)
+        for f in frames:
+            self._owner[id(f)] = frames
+        return slot
+
+    def get(self, block=True, timeout=None):
+        """Take a free frame set
+
+        Parameters
+        ----------
+        block, timeout :
+            as in queue.Queue.get; raises queue.Empty if no frame set is free (and the pool may not grow)
+
+        Returns
+        -------
+        PooledFrames : list of arrays, one per camera, to be released once done with
+        """
+        with self._lock:
+            if not self._free:
+                if self.grow:
+                    self._free.append(self._allocate())
+                else:
+                    self.n_waits += 1
+                    if not block or not self._available.wait_for(lambda: self._free, timeout=timeout):
+                        raise queue.Empty
+            frames = self._sets[self._free.popleft()]
+            frames.released = False
+        return frames
+
+    def release(self, frames):
+        """Return a frame set to the pool
+
+        Parameters
+        ----------
+        frames : PooledFrames, or any of its arrays
+        """
+        with self._lock:
+            if not isinstance(frames, PooledFrames):
+                frames = self._owner.get(id(frames))
+            if frames is None or frames.pool is not self:
+                raise Exception('Frames do not belong to this pool.')
+            if frames.released:
+                raise Exception('Frames have already been released.')
+            frames.released = True
+            self._free.append(frames.slot)
+            self._available.notify()
+
+    def stats(self):
+        """Usage statistics
+
+        Returns
+        -------
+        dict with keys:
+            size : number of frame sets allocated
+            free : number of frame sets not in use
+            waits : number of times get found no free frame set (and the pool could not grow)
+        """
+        with self._lock:
+            return dict(size=len(self._sets), free=len(self._free), waits=self.n_waits)
 
 class CamDump(threading.Thread):
     """Continually reads from a camera and dumps into queue/s
     Is implemented as thread currently b/c camera class only runs in main process and cannot be forked
-    This is a hard problem
+    This is a hard problem; to capture in a separate process instead, see pseyepy.shared.CaptureProcess
+
+    Reads block (without the GIL) until the cameras deliver, so the thread runs exactly at the camera frame rate.
+    Destinations may be FrameRings (preferred) or queue.Queues; the latter receive copies of the frames, and grow without bound if not consumed.
+    Given a FramePool (e.g. Camera.frame_pool()), frames are instead read straight into its frame sets, and queue.Queues receive PooledFrames that the consumer releases once done with them (as Writer does), so that nothing is allocated while streaming.
+    If the consumers hold on to all of the pool's frame sets, reading pauses and the driver drops frames (see Camera.drop_counts).
     """
-    def __init__(self, cam, ques):
+    def __init__(self, cam, ques, pool=None):
         super().__init__()
 
         self.cam = cam
         self.ques = ques
+        self.pool = pool
 
-        if isinstance(self.ques, queue.Queue):
+        if isinstance(self.ques, (queue.Queue, FrameRing)):
             self.ques = [self.ques]
 
         self.kill = threading.Event()
         self.done = threading.Event()
-        
+
         self.start()
 
     def run(self):
 
+        # sequence numbers are only collected if a destination wants them
+        want_seq = any([isinstance(que, FrameRing) and que.seq for que in self.ques])
+
         while not self.kill.is_set():
-            time.sleep(0.005) # wait 5ms, necessary for smooth operation, shouldn't affect framerates b/c this is a thread
-            frame,ts = self.cam.read(timestamp=True, squeeze=False)
+            out = None
+            if self.pool is not None:
+                out = self._get_pooled()
+                if out is None:
+                    break
+            if want_seq:
+                frame,ts,infos = self.cam.read(timestamp=True, squeeze=False, info=True, out=out)
+                seq = [i['seq'] for i in infos]
+            else:
+                frame,ts = self.cam.read(timestamp=True, squeeze=False, out=out)
 
+            # the frame set read into goes to the first queue.Queue, the others get copies
+            handed_over = False
             for que in self.ques:
-                que.put((frame,ts))
+                if isinstance(que, FrameRing):
+                    item = (frame, ts, seq) if que.seq else (frame, ts)
+                elif out is not None and not handed_over:
+                    item = (frame, ts)
+                    handed_over = True
+                elif out is not None:
+                    copy = self._get_pooled()
+                    if copy is None:
+                        break
+                    for dst,src in zip(copy, frame):
+                        np.copyto(dst, src)
+                    item = (copy, ts)
+                else:
+                    # frames returned by read are reused by the camera, so they must be copied before being queued
+                    item = ([f.copy() for f in frame], ts)
+                if not self._put(que, item) and not isinstance(que, FrameRing) and isinstance(item[0], PooledFrames):
+                    item[0].release()
+            if out is not None and not handed_over:
+                out.release()
 
         self.done.set()
 
+    def _put(self, que, item):
+        # a blocking destination must not keep the thread from ending
+        while not self.kill.is_set():
+            try:
+                que.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get_pooled(self):
+        # likewise, waiting for a frame set to be released; None if the thread is ending
+        while not self.kill.is_set():
+            try:
+                return self.pool.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def stats(self):
+        """Occupancy and drop statistics of each FrameRing destination (None for other queues)
+        """
+        return [que.stats() if isinstance(que, FrameRing) else None for que in self.ques]
+
     def end(self):
 
         self.kill.set()
-        while not self.done.is_set():
-            pass
+        self.join()
@@ -1,13 +1,20 @@
 # distutils: language=c++
 
 from libcpp cimport bool as cbool
+from libcpp.vector cimport vector
 import atexit
 import warnings
+import asyncio
+import concurrent.futures
+import functools
+import os
 import time
 import numpy as np
 import multiprocessing as mp
 import threading
 
+from .asynchronous import FramePool, PooledFrames
+
 # PS3EYE API definitions
 cdef extern from "ps3eye_capi.h":
 
@@ -16,6 +23,9 @@ cdef extern from "ps3eye_capi.h":
         PS3EYE_FORMAT_RGB
         PS3EYE_FORMAT_BGR
         PS3EYE_FORMAT_GRAY
+        PS3EYE_FORMAT_RGB_HALF
+        PS3EYE_FORMAT_BGR_HALF
+        PS3EYE_FORMAT_GREEN
     ctypedef enum ps3eye_parameter: 
         PS3EYE_AUTO_GAIN,           # [false, true]
         PS3EYE_GAIN,                # [0, 63]
@@ -33,33 +43,272 @@ cdef extern from "ps3eye_capi.h":
         PS3EYE_VFLIP                # [false, true]
 
     ctypedef unsigned long long uint64_t
+    ctypedef unsigned int uint32_t
+
+    ctypedef struct ps3eye_frame_info:
+        uint64_t timestamp
+        uint64_t arrival
+        uint32_t pts
+        uint64_t seq
+
+    enum: PS3EYE_INTERVAL_BINS
+    enum: PS3EYE_INTERVAL_BIN_US
+
+    ctypedef struct ps3eye_capture_stats:
+        uint64_t transfers
+        uint64_t transfer_errors
+        uint64_t bytes
+        uint64_t bad_headers
+        uint64_t payload_errors
+        uint64_t frames_completed
+        uint64_t frames_discarded
+        uint64_t frames_overwritten
+        uint64_t frames_skipped
+        uint64_t dequeues
+        uint64_t dequeue_wait_us
+        uint64_t dequeue_wait_max_us
+        uint64_t intervals
+        uint64_t interval_sum_us
+        uint64_t interval_sumsq_us
+        uint64_t interval_hist[PS3EYE_INTERVAL_BINS]
+
+    ctypedef struct ps3eye_sim_config:
+        double loss
+        double jitter
+        const unsigned char *frames
+        int n_frames
+        int width
+        int height
+        unsigned int seed
 
     void ps3eye_init()
+    void ps3eye_init_simulated(int count, const ps3eye_sim_config *config)
     void ps3eye_uninit()
+    int ps3eye_rescan()
     int ps3eye_count_connected()
     int ps3eye_get_unique_identifier(   int id,
                                         char *out_identifier,
                                         int max_identifier_length )
 
+    ctypedef enum ps3eye_frame_policy:
+        PS3EYE_POLICY_FIFO
+        PS3EYE_POLICY_LATEST
+
+    ctypedef enum ps3eye_event_thread:
+        PS3EYE_EVENTS_SHARED
+        PS3EYE_EVENTS_PER_BUS
+        PS3EYE_EVENTS_PER_CAMERA
+
+    ctypedef struct ps3eye_usb_config:
+        int num_transfers
+        int transfer_size
+        ps3eye_event_thread event_thread
+        int cpu
+
+    ctypedef struct ps3eye_reduction:
+        int x
+        int y
+        int width
+        int height
+        int binning
+        int decimation
+
     cbool ps3eye_open(   int id, 
                         int width, 
                         int height, 
                         int fps, 
-                        ps3eye_format outputFormat )
+                        ps3eye_format outputFormat,
+                        int queue_depth,
+                        const ps3eye_usb_config *usb_config,
+                        const ps3eye_reduction *reduction )
+    ctypedef struct ps3eye_open_config:
+        int id
+        int width
+        int height
+        int fps
+        ps3eye_format format
+        int queue_depth
+        ps3eye_usb_config usb_config
+        ps3eye_reduction reduction
+    int ps3eye_open_many(int count, const ps3eye_open_config *configs, int *opened) nogil
+    void ps3eye_interrupt(int id) nogil
     void ps3eye_close(int id)
 
-    uint64_t ps3eye_grab_frame(int id, unsigned char *frame)
+    uint64_t ps3eye_grab_frame(int id, unsigned char *frame) nogil
+    uint64_t ps3eye_grab_frame_info(int id, unsigned char *frame, ps3eye_frame_info *info) nogil
+    uint64_t ps3eye_try_grab_frame(int id, unsigned char* frame, ps3eye_frame_info *info) nogil
+    void ps3eye_grab_frames(int count, const int *ids, unsigned char **frames, ps3eye_frame_info *infos) nogil
+    void ps3eye_grab_batches(int cams, const int *ids, int count, unsigned char **frames, ps3eye_frame_info **infos, uint64_t timeout_us, int *grabbed) nogil
+    int ps3eye_grab_synced(int count, const int *ids, unsigned char **frames, ps3eye_frame_info *infos, uint64_t tolerance, int max_rounds, uint64_t *skipped) nogil
+    uint64_t ps3eye_acquire_frame(int id, const unsigned char **frame, ps3eye_frame_info *info) nogil
+    void ps3eye_release_frame(int id) nogil
+    int ps3eye_get_drop_counts(int id, uint64_t *overwritten, uint64_t *discarded)
+    int ps3eye_get_stats(int id, ps3eye_capture_stats *stats)
+    int ps3eye_frames_available(int id)
+    int ps3eye_get_notify_fd(int id)
+    int ps3eye_debayer(const unsigned char *bayer, int width, int height, unsigned char *out, ps3eye_format format) nogil
     int ps3eye_get_parameter(int id, ps3eye_parameter param)
     int ps3eye_set_parameter(int id, ps3eye_parameter param, int value)
+    int ps3eye_set_frame_policy(int id, ps3eye_frame_policy policy)
+    ctypedef struct ps3eye_parameter_update:
+        int id
+        ps3eye_parameter param
+        int value
+    int ps3eye_set_parameters(int count, const ps3eye_parameter_update *updates, uint32_t frame_timeout_ms) nogil
+    int ps3eye_check_parameter(int id, ps3eye_parameter param) nogil
+
+cdef dict _info_dict(ps3eye_frame_info info):
+    return dict(arrival=info.arrival*1e-6, pts=info.pts, seq=info.seq)
+
+# layout of ps3eye_frame_info, so that the metadata of a batch of frames is read as arrays
+_FRAME_INFO_DTYPE = np.dtype([('timestamp', np.uint64), ('arrival', np.uint64), ('pts', np.uint32), ('seq', np.uint64)], align=True)
+assert _FRAME_INFO_DTYPE.itemsize == sizeof(ps3eye_frame_info)
+
+def _simulation(simulate=None, count=1):
+    # settings of simulated cameras requested by `simulate` or, if it is None, by the PSEYEPY_SIMULATE environment variable; None for real cameras
+    if simulate is None:
+        env = os.environ.get('PSEYEPY_SIMULATE', '').strip()
+        if env in ('', '0'):
+            return None
+        # e.g. '2', or '2,loss=0.01,jitter=0.001,seed=3,replay=frames.npy'
+        simulate = {}
+        for tok in env.split(','):
+            if '=' in tok:
+                key,val = [t.strip() for t in tok.split('=', 1)]
+                if key == 'replay':
+                    simulate['frames'] = np.load(val)
+                else:
+                    simulate[key] = float(val) if key in ('loss','jitter') else int(val)
+            elif tok.strip():
+                simulate['count'] = int(tok)
+
+    if simulate is False:
+        return None
+    elif simulate is True:
+        simulate = {}
+    elif isinstance(simulate, (int, np.integer)):
+        simulate = dict(count=int(simulate))
+
+    sim = dict(count=count, loss=0., jitter=0., frames=None, seed=0)
+    unknown = set(simulate) - set(sim)
+    if unknown:
+        raise Exception('Simulation settings not understood: {}; should be among {}.'.format(sorted(unknown), list(sim)))
+    sim.update(simulate)
+    if sim['frames'] is not None:
+        frames = np.ascontiguousarray(sim['frames'], dtype=np.uint8)
+        sim['frames'] = frames[None] if frames.ndim == 2 else frames
+        if sim['frames'].ndim != 3 or len(sim['frames']) == 0:
+            raise Exception('Simulated frames should be raw Bayer frames, of shape (n_frames, height, width).')
+    return sim
+
+cdef _init_context(sim):
+    # ps3eye_init, or its simulated counterpart
+    cdef ps3eye_sim_config c_sim
+    cdef const unsigned char[:,:,::1] frames
 
-def cam_count():
+    if sim is None:
+        ps3eye_init()
+        return
+
+    c_sim.loss = sim['loss']
+    c_sim.jitter = sim['jitter']
+    c_sim.seed = sim['seed']
+    c_sim.frames = NULL
+    c_sim.n_frames = c_sim.width = c_sim.height = 0
+    if sim['frames'] is not None:
+        frames = sim['frames']
+        c_sim.frames = &frames[0,0,0]
+        c_sim.n_frames, c_sim.height, c_sim.width = frames.shape[0], frames.shape[1], frames.shape[2]
+    ps3eye_init_simulated(sim['count'], &c_sim)
+
+cdef _identifier(int i):
+    # stable identifier of the camera at index i, or None
+    cdef char ident[64]
+    if ps3eye_get_unique_identifier(i, ident, sizeof(ident)) != 0:
+        return None
+    return ident.decode()
+
+def cam_count(simulate=None, rescan=False):
     """Count number of available cameras
+
+    The cameras are enumerated once per process, on first use, and camera indices refer to that enumeration.
+
+    Parameters
+    ----------
+    simulate :
+        count simulated cameras instead, as requested with this argument or the PSEYEPY_SIMULATE environment variable (see Camera)
+    rescan : True / False
+        enumerate the cameras again, e.g. after plugging one in; not possible while a Camera object is open
     """
-    ps3eye_init()
+    sim = _simulation(simulate)
+    if rescan and sim is None and ps3eye_rescan() < 0:
+        warnings.warn('Cameras cannot be enumerated again while a Camera object is open.')
+    _init_context(sim)
     n = ps3eye_count_connected()
     ps3eye_uninit()
     return n
 
+def cam_identifiers(simulate=None):
+    """Stable identifiers of the available cameras
+
+    A camera's identifier is the USB port path it is plugged into, e.g. 'b1_p2.3' (bus 1, port 2 then port 3 of a hub), or 'sim<index>' for simulated cameras.
+    Unlike the camera indices, which follow the order of enumeration, it is the same every time as long as the cameras stay in their ports,
+    so a rig can be opened the same way every time with Camera(ids=[<identifiers>]).
+
+    Parameters
+    ----------
+    simulate :
+        list simulated cameras instead (see cam_count)
+
+    Returns
+    -------
+    list, where item i is the identifier of the camera at index i
+    """
+    _init_context(_simulation(simulate))
+    idents = [_identifier(i) for i in range(ps3eye_count_connected())]
+    ps3eye_uninit()
+    return idents
+
+def debayer(raw, colour='rgb'):
+    """Convert a raw frame captured with colour='bayer' using the driver's own decoder
+
+    Produces exactly what the camera would have returned had it been opened in the requested colour mode.
+    For converting many frames at once from numpy, see also pseyepy.demosaic
+
+    Parameters
+    ----------
+    raw : np.ndarray
+        2D uint8 frame of shape (h,w), as returned by Camera.read in 'bayer' mode
+    colour : True / False / str
+        output colour mode, any of the modes accepted by Camera except 'bayer'
+
+    Returns
+    -------
+    frame : np.ndarray
+    """
+    colour = Camera._COLOUR_ALIASES.get(colour, colour) if isinstance(colour, (bool, np.bool_)) else colour
+    if colour not in Camera._COLOUR_MODES:
+        raise Exception('Color mode not understood, should be True, False, or one of {}.'.format(list(Camera._COLOUR_MODES)))
+    fmt,depth,ds = Camera._COLOUR_MODES[colour]
+
+    raw = np.ascontiguousarray(raw, dtype=np.uint8)
+    if raw.ndim != 2:
+        raise Exception('Raw frame must be 2D, got shape {}.'.format(raw.shape))
+    cdef int h = raw.shape[0]
+    cdef int w = raw.shape[1]
+    shape = (h//ds, w//ds, depth) if depth>1 else (h//ds, w//ds)
+    out = np.empty(shape, dtype=np.uint8)
+
+    cdef const unsigned char[:,::1] src = raw
+    cdef unsigned char[::1] dst = out.reshape(-1)
+    cdef ps3eye_format c_fmt = fmt
+    cdef int res
+    with nogil:
+        res = ps3eye_debayer(&src[0,0], w, h, &dst[0], c_fmt)
+    if res != 0:
+        raise Exception('Frame shape {} not supported; dimensions must be even and at least 4.'.format(raw.shape))
+    return out
+
 class CtrlList(list):
     """A subclass of list used to control the parameters on board the cameras
 
@@ -72,10 +321,11 @@ class CtrlList(list):
         self.param_id = param_id
         self.ids = ids
         self.nm,self.valid = Camera._PARAMS[self.param_id]
+        self._valid = set(self.valid)
     def __setitem__(self, pos, val):
 
         # invalid parameter supplied
-        if val not in self.valid and int(val) not in self.valid:
+        if val not in self._valid and int(val) not in self._valid:
             warnings.warn('\nParameter adjustment for {name} aborted.\nAllowed values for {name}: {valid}\nRequested value: {req}'.format(name=self.nm, valid=self.valid, req=val))
             return
 
@@ -104,6 +354,77 @@ class CtrlList(list):
             # set the list items so they can be viewed, queried
             super().__setitem__(pos, val)
 
+cdef class RawFrame:
+    """A raw Bayer frame held in place in a camera's driver ring buffer
+
+    Returned by Camera.acquire. The frame exposes the buffer protocol, so np.asarray(frame) gives a (height, width) uint8 view of the driver's memory without copying.
+    `timestamp` is the time at which the frame was acquired, and `info` holds its capture-side metadata (see Camera.read).
+    The data remain valid until release() is called (or the with-block exits), after which the slot is handed back to the driver and any views of it must no longer be used.
+    """
+    cdef const unsigned char *data
+    cdef Py_ssize_t _shape[2]
+    cdef Py_ssize_t _strides[2]
+    cdef readonly int cam_id
+    cdef readonly double timestamp
+    cdef readonly dict info
+    cdef readonly bint released
+
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        if self.released:
+            raise BufferError('Frame has already been released.')
+        buffer.buf = <void*>self.data
+        buffer.obj = self
+        buffer.len = self._shape[0] * self._shape[1]
+        buffer.readonly = 1
+        buffer.itemsize = 1
+        buffer.format = 'B'
+        buffer.ndim = 2
+        buffer.shape = self._shape
+        buffer.strides = self._strides
+        buffer.suboffsets = NULL
+        buffer.internal = NULL
+
+    def __releasebuffer__(self, Py_buffer *buffer):
+        pass
+
+    @property
+    def shape(self):
+        return (self._shape[0], self._shape[1])
+
+    def release(self):
+        """Hand the slot back to the driver
+        """
+        if not self.released:
+            self.released = True
+            with nogil:
+                ps3eye_release_frame(self.cam_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+def _simulated_count(ids):
+    # number of simulated cameras needed to open ids, which may be indices or identifiers ('sim<index>')
+    if not ids:
+        return 1
+    count = len(ids)
+    for i in ids:
+        if isinstance(i, str):
+            if i.startswith('sim') and i[3:].isdigit():
+                count = max(count, int(i[3:])+1)
+        else:
+            count = max(count, int(i)+1)
+    return count
+
+def _per_camera(val, n):
+    # a setting given once for all cameras, or as one value per camera
+    if isinstance(val, (tuple, list, np.ndarray)):
+        assert len(val) == n
+        return list(val)
+    return [val] * n
+
 def _getattr_wrapper(name):
     def result(obj):
         return getattr(obj, name)
@@ -158,19 +479,46 @@ class Camera():
                 #PS3EYE_HUE:                 ('hue',            list(range(256))),
             }
 
+    # colour mode: (output format, channels, downsampling factor)
+    _COLOUR_MODES = {
+                'rgb':          (PS3EYE_FORMAT_RGB,         3, 1),
+                'gray':         (PS3EYE_FORMAT_GRAY,        1, 1),
+                'rgb_half':     (PS3EYE_FORMAT_RGB_HALF,    3, 2),
+                'green':        (PS3EYE_FORMAT_GREEN,       1, 1),
+                'bayer':        (PS3EYE_FORMAT_BAYER,       1, 1),
+            }
+    _COLOUR_ALIASES = {True: 'rgb', False: 'gray'}
+
+    # parameter name: (parameter, lowest value, highest value), for validation in constant time
+    _PARAM_RANGES = {pname:(pconst, min(valid), max(valid)) for pconst,(pname,valid) in _PARAMS.items()}
+
+    # event thread servicing a camera's USB transfers
+    _EVENT_THREADS = {
+                'shared':   PS3EYE_EVENTS_SHARED,
+                'bus':      PS3EYE_EVENTS_PER_BUS,
+                'camera':   PS3EYE_EVENTS_PER_CAMERA,
+            }
+    _POLICIES = {
+                'fifo':     PS3EYE_POLICY_FIFO,
+                'latest':   PS3EYE_POLICY_LATEST,
+            }
+    _PAYLOAD_SIZE = 2048
+    _MAX_TRANSFERS = 64
+
     RES_SMALL = 0
     RES_LARGE = 1
     _RESOLUTION = { RES_SMALL:(320,240),
                     RES_LARGE:(640,480) }
 
-    def __init__(self, ids=None, resolution=RES_SMALL, fps=60, colour=True, **kwargs):
+    def __init__(self, ids=None, resolution=RES_SMALL, fps=60, colour=True, queue_depth=2, num_transfers=5, transfer_size=65536, event_thread='shared', event_cpu=None, roi=None, binning=1, decimation=1, policy='fifo', simulate=None, **kwargs):
         """Initialize a new Camera object to control one or many PSEye cameras
 
         Parameters
         ----------
-        ids : int-like / list-like
+        ids : int-like / str / list-like
             ID number/s of cameras to be initialized. All cameras must be handled by a single Camera object
             Example: [0,1]
+            Cameras can also be given by their stable identifiers (see cam_identifiers), e.g. ['b1_p2', 'b1_p3'], to open the same physical cameras whatever order they are enumerated in
             Defaults to all connected cameras
         resolution : Camera.RES_SMALL / Camera.RES_LARGE
             RES_SMALL corresponds to (320x240) pixels, and RES_LARGE corresponds to (640x480) pixels
@@ -181,9 +529,66 @@ class Camera():
             Frame rates for RES_SMALL: 30, 40, 50, 60, 75, 100, 125 (although other rates may work)
             Frame rates for RES_LARGE: 15, 30, 40, 50, 60 (although other rates may work)
             Use the Camera.check_fps method to evaluate the empirical frame rate after initializing the object
-        colour : True / False
+        colour : True / False / str / list-like
             colour mode returns 3D frames with color in the last (3rd) dimension as RGB
             greyscale (colour=False) returns 2D frames
+            the following modes can also be requested by name:
+                'rgb' : same as True
+                'gray' : same as False
+                'rgb_half' : half-resolution RGB, one pixel per 2x2 cell of the sensor's Bayer mosaic; much cheaper to decode and 4x smaller
+                'green' : 2D frames of the interpolated green channel only; a cheaper alternative to 'gray'
+                'bayer' : 2D raw sensor frames (GRBG mosaic), no decoding in the driver; convert later with pseyepy.demosaic or pseyepy.cameras.debayer
+        queue_depth : int / list-like
+            number of frames held in the driver's ring buffer for each camera (minimum 2)
+            deeper queues tolerate longer consumer stalls without dropping frames; use at least 3 when holding frames with Camera.acquire
+            default: 2
+        num_transfers : int / list-like
+            number of USB bulk transfers kept in flight for each camera (1-64)
+            more transfers tolerate longer delays in servicing the USB bus before data is lost
+            default: 5
+        transfer_size : int / list-like
+            size in bytes of each USB transfer, a multiple of 2048
+            default: 65536
+        event_thread : 'shared' / 'bus' / 'camera' / list-like
+            thread handling each camera's USB transfers:
+                'shared' : a single thread for all cameras
+                'bus' : one thread per USB bus, shared by the cameras on that bus
+                'camera' : a thread for each camera
+            with many cameras across several USB host controllers, a single thread can fall behind, showing as discarded frames (see Camera.stats)
+            default: 'shared'
+        event_cpu : int / list-like / None
+            CPU to pin each camera's event thread to (Linux and Windows), or None to leave it unpinned
+            default: None
+        roi : None / (x, y, width, height) / list-like
+            region of interest, in sensor pixels, to which frames are cropped in the driver as they are decoded, so that only that region is converted and copied out
+            all four values must be even, and the size a multiple of 2 * binning; the region must lie inside the frame
+            in the half-resolution formats ('rgb_half'), the output is half the size of the region
+            a list of regions gives one per camera (None for the whole frame)
+            default: None, the whole frame
+        binning : 1 / 2 / 4 / list-like
+            average each binning x binning block of output pixels into one, dividing each frame dimension by binning; averaging reduces noise as well as size
+            in 'bayer' mode, pixels of the same colour are averaged, so that frames are still a GRBG mosaic
+            default: 1
+        decimation : int / list-like
+            keep only every decimation-th frame from the camera, i.e. those whose seq is a multiple of decimation; the others are never queued or decoded
+            the effective frame rate is fps / decimation
+            default: 1
+        policy : 'fifo' / 'latest' / list-like
+            which frame a read returns when several are waiting in the driver's ring buffer:
+                'fifo' : the oldest, so that every frame is seen as long as the reads keep up; when the ring is full, the newest frames are dropped
+                'latest' : the newest, skipping the others, and when the ring is full the oldest are dropped; for the lowest latency, e.g. in closed-loop control
+            skipped frames are counted in Camera.drop_counts; can be changed later with Camera.set_policy
+            default: 'fifo'
+        simulate : None / True / False / int / dict
+            use simulated cameras, which need no hardware: they generate the USB data of synthetic or replayed frames at the requested frame rate, and feed it through the same driver code as real cameras
+            True simulates as many cameras as ids requires (or 1), an int that number of cameras; a dict may also give
+                count : number of cameras
+                loss : probability that a USB payload is lost, making the driver discard its frame
+                jitter : standard deviation (s) of the frame timing
+                frames : raw Bayer frames (n_frames, height, width) to replay in a loop, e.g. recorded with colour='bayer'; the resolution must match them
+                seed : seed of the random loss and jitter
+            synthetic frames are a fixed gradient, with the frame number stamped into the first 8 bytes (little-endian) of the raw frame
+            default: None, which uses the PSEYEPY_SIMULATE environment variable if set, e.g. PSEYEPY_SIMULATE=2 or PSEYEPY_SIMULATE=2,loss=0.01,jitter=0.001,replay=frames.npy
         kwargs : any of the camera settings detailed below
 
         Available camera settings include:
@@ -200,13 +605,21 @@ class Camera():
         Note that some of these settings interact with each other in strange ways, and you may find it difficult to return to a particular parameter set without restarting the program.
         """
 
-        if isinstance(ids, (int, float)):
+        if isinstance(ids, (int, float, str)):
             ids = [ids]
         elif isinstance(ids, (tuple, np.ndarray)):
             ids = list(ids)
-        elif ids is None:
-            ids = list(range(cam_count()))
+        sim = _simulation(simulate, count=_simulated_count(ids))
+        if ids is None:
+            ids = list(range(cam_count(False if sim is None else sim['count'])))
+        elif any([isinstance(i, str) for i in ids]):
+            idents = cam_identifiers(False if sim is None else sim['count'])
+            for i in ids:
+                if isinstance(i, str) and i not in idents:
+                    raise Exception('No camera with identifier {}.\nAvailable cameras: {}'.format(i, idents))
+            ids = [idents.index(i) if isinstance(i, str) else i for i in ids]
         self._ids = ids
+        self._simulated = sim is not None
 
         if isinstance(resolution, (int, float)):
             resolution = [self._RESOLUTION[resolution]] * len(ids)
@@ -224,40 +637,115 @@ class Camera():
             assert all([isinstance(f, (int, float)) for f in fps])
         self._fps = fps
 
-        if isinstance(colour, bool):
+        if isinstance(queue_depth, (int, float)):
+            queue_depth = [int(queue_depth)] * len(ids)
+        elif isinstance(queue_depth, (tuple, list, np.ndarray)):
+            assert len(queue_depth) == len(ids)
+            assert all([isinstance(q, (int, float)) for q in queue_depth])
+            queue_depth = [int(q) for q in queue_depth]
+        if any([q < 2 for q in queue_depth]):
+            raise Exception('queue_depth must be at least 2.')
+        self._queue_depth = queue_depth
+
+        num_transfers = [int(n) for n in _per_camera(num_transfers, len(ids))]
+        if any([n < 1 or n > self._MAX_TRANSFERS for n in num_transfers]):
+            raise Exception('num_transfers must be between 1 and {}.'.format(self._MAX_TRANSFERS))
+        transfer_size = [int(n) for n in _per_camera(transfer_size, len(ids))]
+        if any([n < self._PAYLOAD_SIZE or n % self._PAYLOAD_SIZE for n in transfer_size]):
+            raise Exception('transfer_size must be a multiple of {}.'.format(self._PAYLOAD_SIZE))
+        event_thread = _per_camera(event_thread, len(ids))
+        if not all([e in self._EVENT_THREADS for e in event_thread]):
+            raise Exception('event_thread not understood, should be one of {}.'.format(list(self._EVENT_THREADS)))
+        event_cpu = _per_camera(event_cpu, len(ids))
+        self._num_transfers = num_transfers
+        self._transfer_size = transfer_size
+        self._event_thread = event_thread
+
+        if isinstance(colour, (bool, str)):
             colour = [colour] * len(ids)
         elif isinstance(colour, (tuple, list, np.ndarray)):
             assert len(colour) == len(ids)
-            assert all([isinstance(c, bool) for c in colour])
         else:
-            raise Exception('Color mode not understood, should be True or False.')
-        self._colour = colour
-        self._format = [PS3EYE_FORMAT_RGB if c else PS3EYE_FORMAT_GRAY for c in colour]
-        self._depth = [3 if c else 1 for c in colour] # 2nd 3 will be 1 when grey is implemented
+            raise Exception('Color mode not understood, should be True, False, or one of {}.'.format(list(self._COLOUR_MODES)))
+        colour = [self._COLOUR_ALIASES.get(c, c) if isinstance(c, (bool, np.bool_)) else c for c in colour]
+        if not all([c in self._COLOUR_MODES for c in colour]):
+            raise Exception('Color mode not understood, should be True, False, or one of {}.'.format(list(self._COLOUR_MODES)))
+        self._colour_mode = colour
+        self._format = [self._COLOUR_MODES[c][0] for c in colour]
+        self._depth = [self._COLOUR_MODES[c][1] for c in colour]
+        self._colour = [d==3 for d in self._depth]
+
+        # a single region of interest is itself a tuple, which would otherwise be read as one value per camera
+        if roi is None or (len(roi) == 4 and all([isinstance(r, (int, np.integer)) for r in roi])):
+            roi = [roi] * len(ids)
+        roi = [(0, 0, w, h) if r is None else tuple([int(v) for v in r]) for r,w,h in zip(_per_camera(roi, len(ids)), self._w, self._h)]
+        binning = [int(b) for b in _per_camera(binning, len(ids))]
+        decimation = [int(d) for d in _per_camera(decimation, len(ids))]
+        if not all([b in (1, 2, 4) for b in binning]):
+            raise Exception('binning must be 1, 2 or 4.')
+        if any([d < 1 for d in decimation]):
+            raise Exception('decimation must be at least 1.')
+        for (x,y,rw,rh),b,w,h in zip(roi, binning, self._w, self._h):
+            if x % 2 or y % 2 or rw <= 0 or rh <= 0 or rw % (2*b) or rh % (2*b):
+                raise Exception('roi {} not valid: position must be even, and size a multiple of {} (2 * binning).'.format((x,y,rw,rh), 2*b))
+            if x < 0 or y < 0 or x + rw > w or y + rh > h:
+                raise Exception('roi {} not inside the {}x{} frame.'.format((x,y,rw,rh), w, h))
+        self._roi = roi
+        self._binning = binning
+        self._decimation = decimation
+
+        policy = _per_camera(policy, len(ids))
+        if not all([p in self._POLICIES for p in policy]):
+            raise Exception('policy not understood, should be one of {}.'.format(list(self._POLICIES)))
+
+        ds = [self._COLOUR_MODES[c][2] * b for c,b in zip(colour, binning)]
+        self._shape = [(rh//s,rw//s,d) if d>1 else (rh//s,rw//s) for (_,_,rw,rh),d,s in zip(roi, self._depth, ds)]
 
-        self._shape = [(y,x,d) if d>1 else (y,x) for y,x,d in zip(self._h, self._w, self._depth)]
+        cdef vector[ps3eye_open_config] configs = vector[ps3eye_open_config](len(ids))
+        cdef vector[int] opened = vector[int](len(ids))
 
         # init context
-        print("about to init")
-        try:
-            ps3eye_init()
-        except Exception as exc:
-            print(exc)
+        if sim is not None and sim['frames'] is not None:
+            if any([sim['frames'].shape[1:] != s[:2] for s in zip(self._h, self._w)]):
+                raise Exception('Simulated frames of shape {} do not match the resolution.'.format(sim['frames'].shape[1:]))
+        _init_context(sim)
         # init all cameras
         count = ps3eye_count_connected()
-        print("pyc count: ")
-        print(count)
-        self.buffers = {}
         for idx,_id in enumerate(ids):
             if _id >= count:
                 ps3eye_uninit()
                 raise Exception('No camera available at index {}.\nAvailable cameras: {}'.format(_id, count))
-            else:
-                success = ps3eye_open(_id, self._w[idx], self._h[idx], fps[idx], self._format[idx])
-                if not success:
-                    raise Exception('Camera at index {} failed to initialize.'.format(_id))
-                self.buffers[_id] = np.bytes_(self._w[idx]*self._h[idx]*self._depth[idx])
+            configs[idx].id = _id
+            configs[idx].width = self._w[idx]
+            configs[idx].height = self._h[idx]
+            configs[idx].fps = fps[idx]
+            configs[idx].format = self._format[idx]
+            configs[idx].queue_depth = queue_depth[idx]
+            configs[idx].usb_config.num_transfers = num_transfers[idx]
+            configs[idx].usb_config.transfer_size = transfer_size[idx]
+            configs[idx].usb_config.event_thread = self._EVENT_THREADS[event_thread[idx]]
+            configs[idx].usb_config.cpu = -1 if event_cpu[idx] is None else event_cpu[idx]
+            configs[idx].reduction.x, configs[idx].reduction.y, configs[idx].reduction.width, configs[idx].reduction.height = roi[idx]
+            configs[idx].reduction.binning = binning[idx]
+            configs[idx].reduction.decimation = decimation[idx]
+
+        # the cameras are opened concurrently, as each takes a while to set up
+        with nogil:
+            ps3eye_open_many(<int>configs.size(), configs.data(), opened.data())
+        failed = [_id for idx,_id in enumerate(ids) if not opened[idx]]
+        if failed:
+            for idx,_id in enumerate(ids):
+                if opened[idx]:
+                    ps3eye_close(_id)
+            ps3eye_uninit()
+            raise Exception('Camera at index {} failed to initialize.'.format(failed[0]))
+        self._identifiers = [_identifier(_id) for _id in ids]
+        self.buffers = {_id:np.bytes_(int(np.prod(self._shape[idx]))) for idx,_id in enumerate(ids)}
         self._timestamps = {}
+        self._held = {}
+        self._unmatched = {_id:0 for _id in ids}
+        self._notifiers = {}
+        self._control = None # background thread of set_params, started on first use
 
         # params
         for pconst,(pname,valid) in self._PARAMS.items():
@@ -265,11 +753,17 @@ class Camera():
             setattr(self, '_'+pname, CtrlList([ps3eye_get_parameter(i, pconst) for i in ids], param_id=pconst, ids=ids))
 
         # protected attributes
-        protected = ['ids','resolution','w','h','fps','colour','format','depth','shape']
+        protected = ['ids','resolution','w','h','fps','colour','colour_mode','format','depth','shape','queue_depth','num_transfers','transfer_size','event_thread','roi','binning','decimation','policy','simulated','identifiers']
         for p in protected:
             setattr(Camera, p, property(fget=_getattr_wrapper('_'+p), fset=_noset(p)))
 
+        self._policy = [None] * len(ids)
+        self.set_policy(policy)
+
         self._ended = False
+        self._grabs = 0 # calls waiting on the driver without the GIL, which end waits for
+        self._grabs_lock = threading.Lock()
+        self._grabs_done = threading.Condition(self._grabs_lock)
 
         atexit.register(self.end)
 
@@ -281,9 +775,11 @@ class Camera():
             else:
                 warnings.warn('Parameter {} not recognized; ignored.'.format(k))
 
-    def read(self, idx=None, timestamp=True, squeeze=True):
+    def read(self, idx=None, timestamp=True, squeeze=True, info=False, out=None, block=True):
         """Read camera frame/s
 
+        By default, the frames returned are views of buffers that belong to the camera, and are overwritten by the next read; to keep them, use out.
+
         Parameters
         ----------
         idx : int / list-like / None
@@ -294,6 +790,20 @@ class Camera():
             if True, returns (frames, timestamps)
         squeeze : True / False
             if False, returns a list of frames/timestamps even when only one camera is controlled
+        info : True / False
+            return capture-side metadata along with frame
+            if True, returns (frames, timestamps, infos), or (frames, infos) when timestamp is False
+            each info is a dict with keys:
+                arrival : time (s) at which the last USB packet of the frame arrived, as opposed to the timestamp, which is the time the frame was read
+                pts : presentation timestamp reported by the camera
+                seq : per-camera frame sequence number; gaps indicate frames dropped by the driver (see Camera.drop_counts)
+        out : np.ndarray / list-like / FramePool / None
+            destination of the frames, which the driver decodes into directly: a C-contiguous uint8 array of shape Camera.shape[i] per camera read (a single array when reading one camera),
+            or a FramePool (see Camera.frame_pool) for the cameras read, from which a frame set is taken; it is returned as a PooledFrames list (or, squeezed, its only array, which FramePool.release also accepts), to be released once done with
+            default: None, the camera's own buffers
+        block : True / False
+            wait for a frame from each camera; if False, a camera with no new frame in the driver returns None (as frame, timestamp and info) at once
+            combined with policy='latest', this always returns the freshest frame, or None if it has already been read
 
         Returns
         -------
@@ -308,27 +818,678 @@ class Camera():
             idx = [idx]
             was_scalar = True
 
-        imgs,ts = [None for i in idx],[None for i in idx]
-        
+        for i in idx:
+            held = self._held.get(self.ids[i])
+            if held is not None and not held.released:
+                raise Exception('Camera at index {} has an acquired frame; release it before reading.'.format(i))
+
+        ts = [None for i in idx]
+        if not block and isinstance(out, FramePool):
+            raise Exception('Non-blocking reads cannot take a FramePool as out.')
+        if out is None:
+            imgs = [np.frombuffer(self.buffers[self.ids[i]], dtype=self.FRAME_DTYPE).reshape(self.shape[i]) for i in idx]
+        else:
+            imgs = self._destinations(idx, out)
+
+        # collect the destination buffers up front so that the grab itself can run without the GIL
+        cdef int n = len(idx)
+        cdef vector[int] c_ids
+        cdef vector[unsigned char*] c_frames
+        cdef vector[ps3eye_frame_info] c_info = vector[ps3eye_frame_info](n)
+        cdef unsigned char[::1] dst
         for j,i in enumerate(idx):
-            _id = self.ids[i]
-            tstmp = ps3eye_grab_frame(_id, self.buffers[_id])
-            img = np.frombuffer(self.buffers[_id], dtype=self.FRAME_DTYPE)
-            imgs[j] = img.reshape(self.shape[i])
-            ts[j] = tstmp*1e-6
+            c_ids.push_back(self.ids[i])
+            if out is None:
+                c_frames.push_back(<unsigned char*>self.buffers[self.ids[i]])
+            else:
+                dst = imgs[j].reshape(-1)
+                c_frames.push_back(&dst[0])
 
-        if was_scalar:
-            imgs = imgs[0]
-            ts = ts[0]
+        # all requested cameras are waited on concurrently
+        cdef cbool c_block = block
+        cdef int k
+        cdef vector[uint64_t] got = vector[uint64_t](n, 1)
+        self._begin_grab()
+        try:
+            with nogil:
+                if c_block:
+                    ps3eye_grab_frames(n, c_ids.data(), c_frames.data(), c_info.data())
+                else:
+                    for k in range(n):
+                        got[k] = ps3eye_try_grab_frame(c_ids[k], c_frames[k], &c_info[k])
+        finally:
+            self._end_grab()
 
-        if squeeze and len(imgs)==1:
+        infos = [None for i in idx]
+        for j,i in enumerate(idx):
+            if c_block and c_info[j].timestamp == 0:
+                # the driver hands out no frame while one is acquired, e.g. by another thread since the check above
+                raise Exception('Camera at index {} has an acquired frame; release it before reading.'.format(i))
+            if got[j] == 0:
+                imgs[j] = None
+                continue
+            ts[j] = c_info[j].timestamp*1e-6
+            infos[j] = _info_dict(c_info[j])
+
+        if was_scalar or (squeeze and len(imgs)==1):
             imgs = imgs[0]
             ts = ts[0]
+            infos = infos[0]
 
+        out = (imgs,)
         if timestamp:
-            return (imgs, ts)
+            out += (ts,)
+        if info:
+            out += (infos,)
+        return out if len(out) > 1 else imgs
+
+    def _destinations(self, idx, out):
+        # the arrays to read the frames of cameras idx into, checked against their shapes
+        shapes = [self.shape[i] for i in idx]
+        if isinstance(out, FramePool):
+            if out.shapes != shapes or out.dtype != self.FRAME_DTYPE:
+                raise Exception('FramePool of shapes {} does not match the frames read, of shapes {}.'.format(out.shapes, shapes))
+            return out.get()
+        if isinstance(out, np.ndarray):
+            if len(idx) != 1:
+                raise Exception('out must be a list of arrays, one per camera read.')
+            out = [out]
+        if len(out) != len(idx):
+            raise Exception('out must be a list of arrays, one per camera read.')
+        for o,shape in zip(out, shapes):
+            if not isinstance(o, np.ndarray) or o.shape != shape or o.dtype != self.FRAME_DTYPE or not o.flags.c_contiguous or not o.flags.writeable:
+                raise Exception('out must hold writeable, C-contiguous {} arrays of shapes {}.'.format(np.dtype(self.FRAME_DTYPE).name, shapes))
+        return out if isinstance(out, list) else list(out)
+
+    def frame_pool(self, size=8, idx=None, grow=False):
+        """Create a FramePool for the frames of this camera, to read into with Camera.read(out=pool)
+
+        Parameters
+        ----------
+        size : int
+            number of frame sets allocated up front; enough for all frames that are in use at once, e.g. queued for a consumer
+        idx : list-like / None
+            indices of the cameras that will be read into the pool
+            if None, all cameras controlled by this object
+        grow : True / False
+            allocate another frame set when none is free, instead of waiting for one to be released
+
+        Returns
+        -------
+        FramePool
+        """
+        if idx is None:
+            idx = list(range(len(self.ids)))
+        return FramePool([self.shape[i] for i in idx], size=size, dtype=self.FRAME_DTYPE, grow=grow)
+
+    def read_batch(self, n, idx=None, timeout=None, out=None, info=False, squeeze=True):
+        """Read n consecutive frames into a single array, in one call to the driver
+
+        A faster alternative to calling Camera.read n times, e.g. to record a short clip or a calibration stack: frames are decoded from the driver's queue straight into the array, with the GIL released throughout, and no per-frame work is done in Python.
+
+        Parameters
+        ----------
+        n : int
+            number of frames to read from each camera
+        idx : int / list-like / None
+            index/indices of camera/s from which to read; several cameras are read concurrently
+            if None, reads from all cameras controlled by this object
+        timeout : float / None
+            time (s) after which to stop waiting for frames, returning fewer than n
+            default: None, no timeout
+        out : np.ndarray / list-like / None
+            C-contiguous uint8 array/s of shape (n,)+Camera.shape[i] to read into, one per camera (a single array when reading one camera)
+        info : True / False
+            return per-frame metadata (as in Camera.read) along with the frames, as arrays
+        squeeze : True / False
+            if False, returns lists (one entry per camera) even when only one camera is read
+
+        Returns
+        -------
+        frames : np.ndarray of shape (k,)+Camera.shape[i], k being the number of frames read (n, unless the timeout expired), or a list of them, one per camera
+        timestamps : np.ndarray of shape (k,), the time (s) at which each frame was read
+        (infos : dict of arrays of shape (k,), with keys arrival, pts and seq, if info is True)
+        """
+        was_scalar = isinstance(idx, (int, np.integer))
+        if idx is None:
+            idx = list(range(len(self.ids)))
+        idx = [idx] if was_scalar else list(idx)
+        assert all([i<len(self.ids) for i in idx])
+        if n < 1:
+            raise Exception('n must be at least 1.')
+
+        for i in idx:
+            held = self._held.get(self.ids[i])
+            if held is not None and not held.released:
+                raise Exception('Camera at index {} has an acquired frame; release it before reading.'.format(i))
+
+        shapes = [(n,) + self.shape[i] for i in idx]
+        if out is None:
+            out = [np.empty(shape, dtype=self.FRAME_DTYPE) for shape in shapes]
         else:
-            return imgs
+            out = [out] if isinstance(out, np.ndarray) else list(out)
+            if len(out) != len(idx) or not all([isinstance(o, np.ndarray) and o.shape == shape and o.dtype == self.FRAME_DTYPE and o.flags.c_contiguous and o.flags.writeable for o,shape in zip(out, shapes)]):
+                raise Exception('out must hold writeable, C-contiguous {} arrays of shapes {}.'.format(np.dtype(self.FRAME_DTYPE).name, shapes))
+        records = [np.empty(n, dtype=_FRAME_INFO_DTYPE) for i in idx]
+
+        cdef int n_cams = len(idx)
+        cdef int count = n
+        cdef uint64_t c_timeout = 0 if timeout is None else int(max(timeout * 1e6, 1))
+        cdef vector[int] c_ids
+        cdef vector[unsigned char*] c_frames
+        cdef vector[ps3eye_frame_info*] c_infos
+        cdef vector[int] grabbed = vector[int](n_cams, 0)
+        cdef unsigned char[::1] dst
+        cdef unsigned char[::1] rec
+        for j,i in enumerate(idx):
+            c_ids.push_back(self.ids[i])
+            dst = out[j].reshape(-1)
+            c_frames.push_back(&dst[0])
+            rec = records[j].view(np.uint8)
+            c_infos.push_back(<ps3eye_frame_info*>&rec[0])
+
+        self._begin_grab()
+        try:
+            with nogil:
+                ps3eye_grab_batches(n_cams, c_ids.data(), count, c_frames.data(), c_infos.data(), c_timeout, grabbed.data())
+        finally:
+            self._end_grab()
+
+        for j,i in enumerate(idx):
+            if timeout is None and grabbed[j] < n:
+                # only an acquired frame stops a batch short without a timeout
+                raise Exception('Camera at index {} has an acquired frame; release it before reading.'.format(i))
+        frames = [o[:grabbed[j]] for j,o in enumerate(out)]
+        ts = [r['timestamp'][:grabbed[j]]*1e-6 for j,r in enumerate(records)]
+        infos = [dict(arrival=r['arrival'][:grabbed[j]]*1e-6, pts=r['pts'][:grabbed[j]], seq=r['seq'][:grabbed[j]]) for j,r in enumerate(records)]
+        if was_scalar or (squeeze and len(frames)==1):
+            frames, ts, infos = frames[0], ts[0], infos[0]
+        if info:
+            return frames, ts, infos
+        return frames, ts
+
+    def read_sync(self, idx=None, tolerance=None, max_rounds=None, out=None, info=False):
+        """Read one frame from each camera, such that all frames arrived at (nearly) the same moment
+
+        Frames are matched by arrival time: a camera whose frame is older than the newest one by more than `tolerance` is read again, and its stale frame is dropped (counted as 'unmatched' in Camera.drop_counts).
+        All matching happens in the driver with the GIL released, and the frames are written straight into a single array.
+
+        Parameters
+        ----------
+        idx : list-like / None
+            indices of cameras from which to read; all must produce frames of the same shape
+            if None, reads from all cameras controlled by this object
+        tolerance : float
+            maximum spread of arrival times (s) within a matched set
+            default: half the frame interval of the slowest camera
+        max_rounds : int
+            maximum number of extra reads per call spent trying to match; a warning is issued if the set still does not match
+            default: enough to flush the deepest driver queue twice
+        out : np.ndarray
+            optional writeable, C-contiguous uint8 array of shape (n_cams,)+shape to write into, e.g. to reuse one array across calls
+        info : True / False
+            return per-frame metadata (as in Camera.read) along with the frames
+
+        Returns
+        -------
+        frames : np.ndarray of shape (n_cams,h,w,3) for colour, (n_cams,h,w) otherwise
+        arrivals : np.ndarray of shape (n_cams,), arrival time (s) of each frame
+        (infos : list of dicts, if info is True)
+        """
+        if idx is None:
+            idx = list(range(len(self.ids)))
+        idx = list(idx)
+        assert all([i<len(self.ids) for i in idx])
+
+        shapes = set([self.shape[i] for i in idx])
+        if len(shapes) != 1:
+            raise Exception('Synchronized reads require all cameras to produce frames of the same shape; got {}.'.format(shapes))
+        shape = (len(idx),) + shapes.pop()
+
+        for i in idx:
+            held = self._held.get(self.ids[i])
+            if held is not None and not held.released:
+                raise Exception('Camera at index {} has an acquired frame; release it before reading.'.format(i))
+
+        if tolerance is None:
+            tolerance = 0.5 / min([self.fps[i] for i in idx])
+        if max_rounds is None:
+            max_rounds = 2 * max([self.queue_depth[i] for i in idx]) + 2
+
+        if out is None:
+            out = np.empty(shape, dtype=self.FRAME_DTYPE)
+        elif not isinstance(out, np.ndarray) or out.shape != shape or out.dtype != self.FRAME_DTYPE or not out.flags.c_contiguous or not out.flags.writeable:
+            raise Exception('out must be a writeable, C-contiguous {} array of shape {}.'.format(np.dtype(self.FRAME_DTYPE).name, shape))
+
+        cdef int n = len(idx)
+        cdef vector[int] c_ids
+        cdef vector[unsigned char*] c_frames
+        cdef vector[ps3eye_frame_info] c_info = vector[ps3eye_frame_info](n)
+        cdef vector[uint64_t] c_skipped = vector[uint64_t](n, 0)
+        cdef unsigned char[::1] dst = out.reshape(-1)
+        cdef Py_ssize_t frame_bytes = dst.shape[0] // n
+        cdef uint64_t c_tolerance = <uint64_t>(tolerance * 1e6)
+        cdef int c_max_rounds = max_rounds
+        cdef int res
+        for j,i in enumerate(idx):
+            c_ids.push_back(self.ids[i])
+            c_frames.push_back(&dst[j*frame_bytes])
+
+        self._begin_grab()
+        try:
+            with nogil:
+                res = ps3eye_grab_synced(n, c_ids.data(), c_frames.data(), c_info.data(), c_tolerance, c_max_rounds, c_skipped.data())
+        finally:
+            self._end_grab()
+
+        for j,i in enumerate(idx):
+            if c_info[j].timestamp == 0:
+                raise Exception('Camera at index {} has an acquired frame; release it before reading.'.format(i))
+            self._unmatched[self.ids[i]] += c_skipped[j]
+        if res != 0:
+            warnings.warn('Frames could not be matched within {:0.1f} ms after {} attempts; returning unmatched frames.'.format(tolerance*1e3, max_rounds))
+
+        arrivals = np.array([c_info[j].arrival*1e-6 for j in range(n)])
+        if info:
+            return out, arrivals, [_info_dict(c_info[j]) for j in range(n)]
+        return out, arrivals
+
+    async def read_async(self, idx=None, timestamp=True, squeeze=True, info=False):
+        """Read camera frame/s from a coroutine, without blocking the event loop
+
+        Waits until every requested camera has a frame ready, then reads as Camera.read does (accepting the same arguments), e.g.
+            frames, timestamps = await cam.read_async()
+        The wait is woken directly by the driver when a frame completes (through a file descriptor watched by the event loop), so no threads or polling are involved.
+        On Windows, where this is not supported, the read runs in the event loop's default executor instead.
+        """
+        if idx is None:
+            idxs = list(range(len(self.ids)))
+        elif isinstance(idx, (float,int)):
+            idxs = [idx]
+        else:
+            idxs = list(idx)
+
+        for i in idxs:
+            if not await self._wait_frame(i):
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(None, functools.partial(self.read, idx, timestamp=timestamp, squeeze=squeeze, info=info))
+        return self.read(idx, timestamp=timestamp, squeeze=squeeze, info=info)
+
+    async def stream(self, idx=None, timestamp=True, squeeze=True, info=False):
+        """Asynchronous iterator over camera frames, e.g.
+            async for frames, timestamps in cam.stream():
+                ...
+        Yields what Camera.read_async returns, until the camera is closed.
+        """
+        while not self._ended:
+            yield await self.read_async(idx, timestamp=timestamp, squeeze=squeeze, info=info)
+
+    async def _wait_frame(self, idx):
+        # wait until camera idx has a frame ready; returns False if waiting on the driver is not supported
+        _id = self.ids[idx]
+        while True:
+            if self._ended:
+                raise Exception('Camera has been closed.')
+            if ps3eye_frames_available(_id) > 0:
+                return True
+
+            loop = asyncio.get_running_loop()
+            notifier = self._notifiers.get(_id)
+            if notifier is None:
+                fd = ps3eye_get_notify_fd(_id)
+                if fd < 0:
+                    return False
+                notifier = self._notifiers[_id] = dict(fd=fd, loop=None, waiters=[])
+            if notifier['loop'] is None:
+                # the fd is watched only while someone waits on it; a frame that arrived since the check above has already made it readable
+                loop.add_reader(notifier['fd'], self._on_notify, _id)
+                notifier['loop'] = loop
+            elif notifier['loop'] is not loop:
+                raise Exception('Camera at index {} is already being awaited from another event loop.'.format(idx))
+
+            waiter = loop.create_future()
+            notifier['waiters'].append(waiter)
+            await waiter
+
+    def _on_notify(self, _id):
+        notifier = self._notifiers[_id]
+        try:
+            os.read(notifier['fd'], 4096)
+        except BlockingIOError:
+            pass
+        notifier['loop'].remove_reader(notifier['fd'])
+        notifier['loop'] = None
+        waiters, notifier['waiters'] = notifier['waiters'], []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def acquire(self, idx=0):
+        """Acquire the oldest raw (Bayer) frame in place, without copying it out of the driver
+
+        Parameters
+        ----------
+        idx : int
+            index of camera from which to acquire
+
+        Returns
+        -------
+        RawFrame, exposing the frame through the buffer protocol (use np.asarray(frame) for a (height, width) uint8 view)
+        The frame must be released (frame.release(), or use it as a context manager) before the next acquire or read from this camera.
+        The Bayer pattern is GRBG, regardless of the colour mode of the camera.
+        """
+        cdef int _id = self.ids[idx]
+        cdef const unsigned char *data = NULL
+        cdef ps3eye_frame_info c_info
+        cdef uint64_t tstmp
+
+        held = self._held.get(_id)
+        if held is not None and not held.released:
+            raise Exception('Camera at index {} already has an acquired frame; release it first.'.format(idx))
+
+        self._begin_grab()
+        try:
+            with nogil:
+                tstmp = ps3eye_acquire_frame(_id, &data, &c_info)
+        finally:
+            self._end_grab()
+        if data == NULL:
+            raise Exception('Failed to acquire frame from camera at index {}.'.format(idx))
+
+        cdef RawFrame frame = RawFrame.__new__(RawFrame)
+        frame.data = data
+        frame._shape[0] = self.h[idx]
+        frame._shape[1] = self.w[idx]
+        frame._strides[0] = self.w[idx]
+        frame._strides[1] = 1
+        frame.cam_id = _id
+        frame.timestamp = tstmp*1e-6
+        frame.info = _info_dict(c_info)
+        frame.released = False
+        self._held[_id] = frame
+        return frame
+
+    def set_policy(self, policy, idx=None):
+        """Change the acquisition policy (see Camera.__init__), which takes effect immediately, also while streaming
+
+        Parameters
+        ----------
+        policy : 'fifo' / 'latest' / list-like
+            one policy for all cameras idx, or one per camera
+        idx : int / list-like / None
+            index/indices of camera/s to change
+            if None, all cameras controlled by this object
+        """
+        if idx is None:
+            idx = list(range(len(self.ids)))
+        elif isinstance(idx, (int, float)):
+            idx = [idx]
+        policy = _per_camera(policy, len(idx))
+        if not all([p in self._POLICIES for p in policy]):
+            raise Exception('policy not understood, should be one of {}.'.format(list(self._POLICIES)))
+        for i,p in zip(idx, policy):
+            if ps3eye_set_frame_policy(self.ids[i], self._POLICIES[p]) != 0:
+                raise Exception('Camera at index {} is not open.'.format(i))
+            self._policy[i] = p
+
+    def set_params(self, params, idx=None, at_frame=False, block=True, verify=True):
+        """Change several camera parameters at once
+
+        A faster alternative to setting them one at a time (e.g. cam.gain = 10) when changing them often, e.g. in closed-loop control:
+        the values are validated up front, values equal to those last set (and verified, if verify is True) are skipped, the register writes for the different cameras are made concurrently,
+        and the registers are read back afterwards in a background thread rather than before returning.
+        Calls are applied in order, including those with block=False.
+
+        Parameters
+        ----------
+        params : dict
+            parameter name (as the attributes of this object, e.g. 'gain', 'exposure') : value, or list of values (one per camera in idx)
+        idx : int / list-like / None
+            index/indices of camera/s to change
+            if None, changes all cameras controlled by this object
+        at_frame : True / False
+            defer each camera's changes until it completes its next frame, so that they are made between frames rather than during one
+        block : True / False
+            if False, returns immediately and the changes are made in the background thread
+        verify : True / False
+            read the registers back after the changes, and warn about any that did not take effect
+
+        Returns
+        -------
+        concurrent.futures.Future, whose result is a list of the (camera index, parameter name) that failed verification (empty if verify is False)
+        """
+        if idx is None:
+            idx = list(range(len(self.ids)))
+        elif isinstance(idx, (float,int)):
+            idx = [idx]
+        assert all([0<=i<len(self.ids) for i in idx]), 'All requested indices must refer to cameras of this object.'
+
+        # validate everything before changing anything
+        updates = []
+        for name,vals in params.items():
+            if name not in self._PARAM_RANGES:
+                raise Exception('Parameter "{}" not recognized; settable parameters are: {}'.format(name, list(self._PARAM_RANGES)))
+            pconst,low,high = self._PARAM_RANGES[name]
+            if not isinstance(vals, (list, tuple, np.ndarray)):
+                vals = [vals] * len(idx)
+            if len(vals) != len(idx):
+                raise Exception('{} values supplied for "{}", for {} cameras.'.format(len(vals), name, len(idx)))
+            for i,val in zip(idx, vals):
+                if not isinstance(val, (int, np.integer)) or not low <= val <= high:
+                    raise Exception('Invalid value for "{}": {} (allowed: {} to {}).'.format(name, val, low, high))
+                updates.append((i, name, pconst, val))
+
+        # the CtrlLists hold the values last set, and double as the shadow of the register state; they are updated once the registers are written (and verified, see _settle_params)
+        changed = []
+        for i,name,pconst,val in updates:
+            if getattr(self, '_'+name)[i] != val:
+                changed.append((i, name, pconst, val))
+
+        if not changed:
+            future = concurrent.futures.Future()
+            future.set_result([])
+            return future
+
+        timeout_ms = int(2000 / min([self.fps[i] for i in idx])) + 100 if at_frame else 0
+
+        if self._control is None:
+            self._control = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        if not block:
+            return self._control.submit(self._apply_params, changed, timeout_ms, verify)
+
+        # through the background thread too, so as not to overtake earlier calls made with block=False
+        self._control.submit(self._write_params, changed, timeout_ms).result()
+        future = self._control.submit(self._settle_params, changed, verify)
+        if not verify:
+            # nothing to read back, so the values are recorded before returning
+            future.result()
+        return future
+
+    def _apply_params(self, changed, timeout_ms, verify):
+        self._write_params(changed, timeout_ms)
+        return self._settle_params(changed, verify)
+
+    def _write_params(self, changed, timeout_ms):
+        cdef vector[ps3eye_parameter_update] c_updates = vector[ps3eye_parameter_update](len(changed))
+        cdef uint32_t c_timeout = timeout_ms
+        for j,(i,name,pconst,val) in enumerate(changed):
+            c_updates[j].id = self.ids[i]
+            c_updates[j].param = pconst
+            c_updates[j].value = val
+        with nogil:
+            ps3eye_set_parameters(<int>c_updates.size(), c_updates.data(), c_timeout)
+
+    def _settle_params(self, changed, verify):
+        # values that failed verification are left out of the shadow, so that setting them again is not skipped
+        failed = self._check_params(changed) if verify else []
+        for i,name,pconst,val in changed:
+            if (i, name) not in failed:
+                list.__setitem__(getattr(self, '_'+name), i, val)
+        return failed
+
+    def _check_params(self, changed):
+        cdef int _id
+        cdef ps3eye_parameter pconst
+        cdef int ok
+        failed = []
+        for i,name,_pconst,val in changed:
+            _id, pconst = self.ids[i], _pconst
+            with nogil:
+                ok = ps3eye_check_parameter(_id, pconst)
+            if ok != 1:
+                failed.append((i, name))
+                warnings.warn('\nParameter adjustment for "{}" of camera at index {} failed: the camera\'s registers do not hold the requested value {}.'.format(name, i, val))
+        return failed
+
+    def drop_counts(self, idx=None):
+        """Number of frames lost by the driver so far
+
+        Parameters
+        ----------
+        idx : int / list-like / None
+            index/indices of camera/s to query
+            if None, queries all cameras controlled by this object
+
+        Returns
+        -------
+        dict (or list of dicts, one per camera, if idx is not a scalar) with keys:
+            overwritten : completed frames dropped because the consumer fell behind and the driver's ring buffer was full (see queue_depth)
+            discarded : incomplete or corrupt frames dropped by the USB packet parser
+            unmatched : frames read but dropped by Camera.read_sync because they arrived too early to match the other cameras
+            skipped : frames passed over for a newer one under policy='latest'
+        """
+        cdef ps3eye_capture_stats c_stats
+
+        was_scalar = isinstance(idx, (int, float))
+        if idx is None:
+            idx = list(range(len(self.ids)))
+        elif was_scalar:
+            idx = [idx]
+
+        counts = []
+        for i in idx:
+            if ps3eye_get_stats(self.ids[i], &c_stats) != 0:
+                raise Exception('Camera at index {} is not open.'.format(i))
+            counts.append(dict(overwritten=c_stats.frames_overwritten, discarded=c_stats.frames_discarded, unmatched=self._unmatched[self.ids[i]],
+                               skipped=c_stats.frames_skipped))
+
+        return counts[0] if was_scalar else counts
+
+    def stats(self, idx=None, since=None):
+        """Statistics of the capture path, from counters kept by the driver
+
+        Reading them costs nothing while streaming, so unlike check_fps this can be polled continuously, e.g. for monitoring.
+
+        Parameters
+        ----------
+        idx : int / list-like / None
+            index/indices of camera/s to query
+            if None, queries all cameras controlled by this object
+        since : dict / list of dicts
+            a previous result of stats for the same camera/s; if given, the counts, interval statistics and histogram cover only the period since then
+
+        Returns
+        -------
+        dict (or list of dicts, one per camera, if idx is not a scalar) with keys:
+            transfers, transfer_errors : USB bulk transfers completed / failed
+            bytes : bytes received over USB
+            bad_headers : USB payloads dropped for an invalid header
+            payload_errors : USB payloads flagged as erroneous by the camera
+            frames : complete frames received
+            discarded, overwritten, skipped : frames lost, as in drop_counts
+            dequeues : frames read from the driver
+            dequeue_wait : total time (s) that reads spent waiting for a frame to arrive
+            dequeue_wait_max : longest such wait (s), always since the camera was opened
+            intervals : number of intervals measured between the arrivals of consecutive frames
+            interval_sum, interval_sumsq : sum (s) and sum of squares (s^2) of those intervals
+            interval_mean, interval_std : mean and standard deviation (s) of those intervals, nan if there are none
+            fps : measured frame rate, 1/interval_mean
+            interval_hist : histogram of those intervals (np.ndarray)
+            interval_edges : bin edges (s) of interval_hist; the last bin also holds all longer intervals
+        """
+        cdef ps3eye_capture_stats c_stats
+
+        was_scalar = isinstance(idx, (int, float))
+        if idx is None:
+            idx = list(range(len(self.ids)))
+        elif was_scalar:
+            idx = [idx]
+        if isinstance(since, dict):
+            since = [since]
+
+        edges = np.arange(PS3EYE_INTERVAL_BINS+1) * PS3EYE_INTERVAL_BIN_US * 1e-6
+        edges[-1] = np.inf
+
+        result = []
+        for j,i in enumerate(idx):
+            if ps3eye_get_stats(self.ids[i], &c_stats) != 0:
+                raise Exception('Camera at index {} is not open.'.format(i))
+            st = dict(transfers=c_stats.transfers, transfer_errors=c_stats.transfer_errors, bytes=c_stats.bytes,
+                      bad_headers=c_stats.bad_headers, payload_errors=c_stats.payload_errors,
+                      frames=c_stats.frames_completed, discarded=c_stats.frames_discarded, overwritten=c_stats.frames_overwritten, skipped=c_stats.frames_skipped,
+                      dequeues=c_stats.dequeues, dequeue_wait=c_stats.dequeue_wait_us*1e-6,
+                      intervals=c_stats.intervals, interval_sum=c_stats.interval_sum_us*1e-6, interval_sumsq=c_stats.interval_sumsq_us*1e-12,
+                      interval_hist=np.array(c_stats.interval_hist, dtype=np.int64))
+            if since is not None:
+                st = {k:v-since[j][k] for k,v in st.items()}
+
+            n = st['intervals']
+            mean = st['interval_sum'] / n if n else np.nan
+            std = np.sqrt(max(st['interval_sumsq'] / n - mean**2, 0)) if n else np.nan
+            st.update(dequeue_wait_max=c_stats.dequeue_wait_max_us*1e-6, interval_mean=mean, interval_std=std, fps=1/mean if mean > 0 else np.nan, interval_edges=edges)
+            result.append(st)
+
+        return result[0] if was_scalar else result
+
+    def measure_latency(self, idx=0, n_frames=200, work=0, policy=None):
+        """Measure the latency of frames returned by Camera.read, from their arrival over USB to the return of the read
+
+        USB arrival is the earliest moment the host sees a frame, about one readout time (roughly a frame interval) after the end of its exposure.
+        A consumer that spends `work` seconds on each frame shows how the policy behaves under load: with 'fifo', frames that queue up behind a slow consumer are returned late, whereas 'latest' returns the freshest and skips the others.
+
+        Parameters
+        ----------
+        idx : int
+            index of the camera to measure
+        n_frames : int
+            number of frames to read
+        work : float
+            time (s) to spend between reads, emulating the processing of each frame
+        policy : None / str / list-like
+            policy or policies to measure, e.g. ['fifo', 'latest'] to compare them; the camera's policy is restored afterwards
+            default: None, the camera's current policy
+
+        Returns
+        -------
+        dict (or dict of them, keyed by policy, if policy is list-like) with keys:
+            frames : number of frames read
+            median, p90, p99, max : latency (s)
+            skipped : frames skipped meanwhile under policy 'latest'
+            overwritten : frames dropped meanwhile because the ring buffer was full
+        """
+        if isinstance(policy, (list, tuple)):
+            return {p:self.measure_latency(idx, n_frames=n_frames, work=work, policy=p) for p in policy}
+
+        previous = self.policy[idx]
+        if policy is not None:
+            self.set_policy(policy, idx)
+        try:
+            # start from an empty ring, so that the frames queued before the measurement do not count
+            while self.read(idx, timestamp=False, block=False) is not None:
+                pass
+            before = self.stats(idx)
+            latency = np.empty(n_frames)
+            for k in range(n_frames):
+                _, info = self.read(idx, timestamp=False, info=True)
+                latency[k] = time.time() - info['arrival']
+                if work:
+                    time.sleep(work)
+            st = self.stats(idx, since=before)
+        finally:
+            self.set_policy(previous, idx)
+
+        return dict(frames=n_frames, median=float(np.median(latency)), p90=float(np.percentile(latency, 90)), p99=float(np.percentile(latency, 99)),
+                    max=float(latency.max()), skipped=st['skipped'], overwritten=st['overwritten'])
 
     def check_fps(self, n_seconds=10):
         """Empirical measurement of frame rate in frames per second
@@ -340,23 +1501,33 @@ class Camera():
 
         Returns
         -------
-        timestamps from each camera
+        frame arrival times from each camera
 
+        This blocks for n_seconds per camera; for continuous monitoring, see Camera.stats instead.
         Running this method will print out an analysis of the frame rate
+        Intervals are computed from frame arrival times, so they reflect the camera rather than the timing of the reads; frames dropped during the measurement are reported separately
         """
 
         tss = []
         for i in range(len(self.ids)):
-            n_frames = self.fps[i] * n_seconds
+            # with decimation, consecutive frames are that many apart in seq
+            step = self._decimation[i]
+            rate = self.fps[i] / step
+            n_frames = int(rate * n_seconds)
             ts = []
+            seq = []
             for f in range(n_frames):
-                _,tsi = self.read(i)
-                ts.append(tsi)
+                _,inf = self.read(i, timestamp=False, info=True)
+                ts.append(inf['arrival'])
+                seq.append(inf['seq'])
             ts = np.array(ts)
             tss.append(ts)
-            dif = np.diff(ts)
+            n_dropped = int(np.sum(np.diff(seq) // step - 1))
 
-            desired_interval = 1/self.fps[i]
+            # intervals spanning dropped frames are not representative of the frame rate
+            dif = np.diff(ts)[np.diff(seq) == step]
+
+            desired_interval = 1/rate
             mean_interval = np.mean(dif)
             mean_rate = 1/mean_interval
             std_interval = np.std(dif)
@@ -376,17 +1547,54 @@ class Camera():
                     >1 ms longer than desired: {:0.2f}%\t
                     >1 ms shorter than desired: {:0.2f}%\t
                     >2 ms longer than desired: {:0.2f}%\t
-                    >2 ms shorter than desired: {:0.2f}%
-                    """.format(i, mean_rate, self.fps[i], 1e3*mean_interval, 1e3/self.fps[i], 1e3*std_interval, 100*std_interval/mean_interval, self.fps[i], 100*within_1ms, self.fps[i], 100*within_2ms, 100*above_1ms, 100*below_1ms, 100*above_2ms, 100*below_2ms))
+                    >2 ms shorter than desired: {:0.2f}%	
+                    Frames dropped during measurement: {}
+                    """.format(i, mean_rate, rate, 1e3*mean_interval, 1e3/rate, 1e3*std_interval, 100*std_interval/mean_interval, rate, 100*within_1ms, rate, 100*within_2ms, 100*above_1ms, 100*below_1ms, 100*above_2ms, 100*below_2ms, n_dropped))
 
         return tss
 
+    def _begin_grab(self):
+        # registers a call about to wait on the driver without the GIL; end closes the cameras only once all such calls have returned
+        with self._grabs_lock:
+            if self._ended:
+                raise Exception('Camera has been closed.')
+            self._grabs += 1
+
+    def _end_grab(self):
+        with self._grabs_lock:
+            self._grabs -= 1
+            if self._ended:
+                # the call was cut short by end (which waits for it), so its frames are not valid
+                self._grabs_done.notify_all()
+                raise Exception('Camera has been closed.')
+
     def end(self):
         """Close the object; this should be run before creating a new Camera object, and before quitting Python (for latter, it does so automatically if not called explicitly)
+
+        Reads still waiting for frames in other threads are woken, and raise an exception, before the cameras close.
         """
         if not self._ended:
+            with self._grabs_lock:
+                self._ended = True
+            # the notification fds close with the cameras, so event loops must stop watching them first
+            for notifier in self._notifiers.values():
+                if notifier['loop'] is not None:
+                    notifier['loop'].remove_reader(notifier['fd'])
+                    for waiter in notifier['waiters']:
+                        if not waiter.done():
+                            waiter.set_exception(Exception('Camera has been closed.'))
+            self._notifiers = {}
+            # changes still queued by set_params are made before the cameras close
+            if self._control is not None:
+                self._control.shutdown(wait=True)
+            for frame in self._held.values():
+                frame.release()
+            # the driver wakes the reads waiting on it, and the cameras are closed once they have all returned
+            for _id in self.ids:
+                ps3eye_interrupt(_id)
+            with self._grabs_done:
+                self._grabs_done.wait_for(lambda: self._grabs == 0)
             for _id in self.ids:
                 ps3eye_close(_id)
             ps3eye_uninit()
-            self._ended = True
 
@@ -0,0 +1,99 @@
+"""
+Vectorized conversion of raw frames captured with colour='bayer'
+
+Capturing raw frames keeps decoding out of the acquisition path entirely; stacks of frames can then be converted in bulk, e.g. in a worker thread or after a recording has finished. The output is identical, byte for byte, to what the driver produces in 'rgb' / 'gray' mode.
+
+The PSEye sensor uses a GRBG mosaic:
+    even rows:  G R G R ...
+    odd rows:   B G B G ...
+"""
+import numpy as np
+
+def _avg2(a, b):
+    return (a + b + 1) >> 1
+
+def _avg4(a, b, c, d):
+    return (a + b + c + d + 2) >> 2
+
+def demosaic(raw, bgr=False, gray=False, out=None):
+    """Demosaic one or many raw Bayer frames
+
+    Bilinear interpolation matching the driver exactly, including rounding and the replicated border rows/columns.
+
+    Parameters
+    ----------
+    raw : np.ndarray
+        uint8 raw frame/s of shape (h,w) or (n,h,w), as returned by Camera.read in 'bayer' mode
+        h and w must be even and at least 4
+    bgr : True / False
+        order the colour channels as BGR (e.g. for OpenCV) instead of RGB
+    gray : True / False
+        return greyscale frames, identical to colour=False in the driver
+    out : np.ndarray
+        optional uint8 array of shape raw.shape+(3,) (or raw.shape if gray) to write into
+
+    Returns
+    -------
+    frames : np.ndarray
+        shape raw.shape+(3,) for colour, raw.shape for greyscale
+    """
+    raw = np.asarray(raw)
+    if raw.dtype != np.uint8:
+        raise Exception('Raw frames must be uint8, got {}.'.format(raw.dtype))
+    if raw.ndim not in (2,3):
+        raise Exception('Raw frames must be of shape (h,w) or (n,h,w), got {}.'.format(raw.shape))
+    h,w = raw.shape[-2:]
+    if h < 4 or w < 4 or h % 2 or w % 2:
+        raise Exception('Frame shape {} not supported; dimensions must be even and at least 4.'.format(raw.shape[-2:]))
+
+    shape = raw.shape if gray else raw.shape + (3,)
+    if out is None:
+        out = np.empty(shape, dtype=np.uint8)
+    elif out.shape != shape or out.dtype != np.uint8:
+        raise Exception('out must be a uint8 array of shape {}.'.format(shape))
+
+    # work on (n,h,w) stacks throughout; widen once so sums of 4 pixels cannot overflow
+    src = raw.astype(np.uint16)
+    dst = out
+    if raw.ndim == 2:
+        src = src[None]
+        dst = dst[None]
+
+    def px(r0, c0, dr, dc):
+        # for the interior pixels (r0::2, c0::2), their neighbours at offset (dr,dc)
+        return src[:, r0+dr:h-1+dr:2, c0+dc:w-1+dc:2]
+    def h2(r0, c0):
+        return _avg2(px(r0,c0,0,-1), px(r0,c0,0,1))
+    def v2(r0, c0):
+        return _avg2(px(r0,c0,-1,0), px(r0,c0,1,0))
+    def cross4(r0, c0):
+        return _avg4(px(r0,c0,-1,0), px(r0,c0,1,0), px(r0,c0,0,-1), px(r0,c0,0,1))
+    def diag4(r0, c0):
+        return _avg4(px(r0,c0,-1,-1), px(r0,c0,-1,1), px(r0,c0,1,-1), px(r0,c0,1,1))
+
+    # (r,g,b) at each of the 4 sites of the mosaic, keyed by the first interior pixel of that site
+    sites = {
+            (2,2): lambda: (h2(2,2), px(2,2,0,0), v2(2,2)),             # G on a GR row
+            (2,1): lambda: (px(2,1,0,0), cross4(2,1), diag4(2,1)),      # R
+            (1,2): lambda: (diag4(1,2), cross4(1,2), px(1,2,0,0)),      # B
+            (1,1): lambda: (v2(1,1), px(1,1,0,0), h2(1,1)),             # G on a BG row
+            }
+    for (r0,c0),interp in sites.items():
+        r,g,b = interp()
+        site = dst[:, r0:h-1:2, c0:w-1:2]
+        if gray:
+            site[...] = (r*77 + g*151 + b*28) >> 8
+        else:
+            if bgr:
+                r,b = b,r
+            site[...,0] = r
+            site[...,1] = g
+            site[...,2] = b
+
+    # borders replicate their inner neighbours: first the end columns of interior rows, then the full first and last rows
+    dst[:, 1:h-1, 0] = dst[:, 1:h-1, 1]
+    dst[:, 1:h-1, w-1] = dst[:, 1:h-1, w-2]
+    dst[:, 0] = dst[:, 1]
+    dst[:, h-1] = dst[:, h-2]
+
+    return out
@@ -5,13 +5,16 @@ import subprocess as sp
 import numpy as np
 import time
 import os
-import queue
+import warnings
+import shutil
+import collections
 import h5py
 try:
     import cv2
 except ImportError:
     cv2 = None
-from .asynchronous import CamDump
+from .asynchronous import CamDump, FrameRing, PooledFrames
+from .processing import Processor, FrameDiff
 from .ui import Display
 
 class OpencvWriter():
@@ -40,7 +43,7 @@ class OpencvWriter():
         codec = cv2.VideoWriter_fourcc(*codec)
         self.vw = cv2.VideoWriter(file_name, codec, fps, shape, isColor=True)
 
-    def write(self, frame, timestamp=None):
+    def write(self, frame, timestamp=None, seq=None):
         if self.colour==False:
             writeable = cv2.cvtColor((frame).astype(np.uint8), cv2.COLOR_GRAY2BGR)
         else:
@@ -61,29 +64,70 @@ class OpencvWriter():
 
 class FFMpegWriter():
     """Pipes to a video file using ffmpeg on command
+
+    Frames are handed to ffmpeg without copying, several per system call when written with write_many, and ffmpeg's log output is drained in the background so that it can never stall the pipe.
     """
-    def __init__(self, file_name, shape=(320,240), colour=False, fps=30, timestamps=False, codec='png'):
+    # encoder presets: output options for ffmpeg
+    PRESETS = {
+            'lossless':     ['-c:v', 'ffv1', '-level', '3', '-slices', '4', '-threads', '4'], # exact, moderate CPU, large files
+            'fast':         ['-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '17', '-pix_fmt', 'yuv420p'], # near-lossless, cheapest encoder
+            'small':        ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p'], # smaller files, more CPU
+            'mjpeg':        ['-c:v', 'mjpeg', '-q:v', '3'],
+            'png':          ['-c:v', 'png'], # exact but very slow; the former default
+            }
+    DEFAULT_PRESET = 'lossless'
+    EXTENSIONS = ('.avi', '.mkv', '.mp4', '.mov')
+
+    # at most this many buffers are passed to a single os.writev call (IOV_MAX is at least 1024 on common systems)
+    _MAX_IOV = 512
+
+    def __init__(self, file_name, shape=(320,240), colour=False, fps=30, timestamps=False, preset=None, codec=None, ffmpeg=None, extra_args=[]):
         """
         shape : w,h
+        preset : str
+            encoder preset, one of FFMpegWriter.PRESETS
+            default: FFMpegWriter.DEFAULT_PRESET
+        codec : str
+            ffmpeg video codec; overrides the codec of the preset, e.g. 'png'
+        ffmpeg : str
+            path to the ffmpeg executable
+            default: the PSEYEPY_FFMPEG environment variable if set, otherwise ffmpeg on the PATH
+        extra_args : list
+            further ffmpeg output options, e.g. ['-g', '120']
         """
         self.timestamps = timestamps
 
         fnroot,fnext = os.path.splitext(file_name)
         if fnext == '':
             fnext = '.avi'
-        if fnext != '.avi':
-            warnings.warn('Destination files for movies should be .avi')
+        if fnext not in self.EXTENSIONS:
+            warnings.warn('Destination files for movies should be one of {}'.format(self.EXTENSIONS))
         file_name = '{}{}'.format(fnroot,fnext)
         if self.timestamps:
             self.ts_file_name = '{}_time.txt'.format(fnroot)
             self.ts_file = open(self.ts_file_name, 'a')
 
+        if ffmpeg is None:
+            ffmpeg = os.environ.get('PSEYEPY_FFMPEG') or shutil.which('ffmpeg')
+        if ffmpeg is None:
+            raise Exception('ffmpeg not found. Install it, or supply its path as `ffmpeg` or with the PSEYEPY_FFMPEG environment variable.')
+
+        if preset is None:
+            preset = self.DEFAULT_PRESET
+        if preset not in self.PRESETS:
+            raise Exception('Preset not understood, should be one of {}.'.format(list(self.PRESETS)))
+        out_args = list(self.PRESETS[preset])
+        if codec is not None:
+            out_args[out_args.index('-c:v')+1] = codec
+
         _col = 'rgb24' if colour else 'gray'
         _shape = '{}x{}'.format(*shape)
         _fps = str(int(fps))
 
-        self.cmd =     ['/usr/local/bin/ffmpeg',
-            #'-y', # overwrite
+        self.cmd =     [ffmpeg,
+            '-hide_banner',
+            '-loglevel', 'warning',
+            '-n', # never overwrite
             '-f', 'rawvideo',
             '-vcodec','rawvideo',
             '-s', _shape,
@@ -91,26 +135,243 @@ class FFMpegWriter():
             '-r', _fps,
             '-i', '-', # pipe
             '-an', # no audio
-            '-vcodec', codec,
-            file_name ]
-        self.proc = sp.Popen(self.cmd, stdin=sp.PIPE, stderr=sp.PIPE)
+            ] + out_args + list(extra_args) + [file_name]
+        self.proc = sp.Popen(self.cmd, stdin=sp.PIPE, stderr=sp.PIPE, bufsize=0)
+        self.fd = self.proc.stdin.fileno()
 
-    def write(self, frame, timestamp=None):
-        self.proc.stdin.write(frame.tobytes())
-        if self.timestamps:
-            if isinstance(timestamp, (tuple,list,np.ndarray)):
-                timestamp = ','.join(['{:0.6f}']*len(timestamp)).format(*timestamp)
+        self.log = collections.deque(maxlen=50)
+        self._drain = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._drain.start()
+
+    def _drain_stderr(self):
+        for line in iter(self.proc.stderr.readline, b''):
+            self.log.append(line.decode(errors='replace').rstrip())
+
+    def _writev(self, bufs):
+        while bufs:
+            if hasattr(os, 'writev'):
+                n = os.writev(self.fd, bufs[:self._MAX_IOV])
             else:
-                timestamp = '{:0.6f}'.format(timestamp)
-            self.ts_file.write('{}\n'.format(timestamp))
-	
+                n = self.proc.stdin.write(bufs[0])
+            # a pipe may accept only part of the data; resume after the last byte written
+            while bufs and n >= len(bufs[0]):
+                n -= len(bufs[0])
+                bufs.pop(0)
+            if n:
+                bufs[0] = bufs[0][n:]
+
+    def write(self, frame, timestamp=None, seq=None):
+        self.write_many([frame], [timestamp], [seq])
+
+    def write_many(self, frames, timestamps=None, seqs=None):
+        """Write several frames in as few system calls as possible
+
+        The frames are not copied; they must remain unchanged until this returns.
+        """
+        bufs = [memoryview(np.ascontiguousarray(f)).cast('B') for f in frames]
+        try:
+            self._writev(bufs)
+        except BrokenPipeError:
+            self.proc.wait()
+            self._drain.join()
+            raise Exception('ffmpeg exited with code {}:\n{}'.format(self.proc.returncode, '\n'.join(self.log)))
+
+        if self.timestamps:
+            lines = []
+            for timestamp in timestamps:
+                if isinstance(timestamp, (tuple,list,np.ndarray)):
+                    timestamp = ','.join(['{:0.6f}']*len(timestamp)).format(*timestamp)
+                else:
+                    timestamp = '{:0.6f}'.format(timestamp)
+                lines.append('{}\n'.format(timestamp))
+            self.ts_file.write(''.join(lines))
+
     def end(self):
         if self.timestamps:
             self.ts_file.close()
-        self.proc.stdin.close()
-        self.proc.stderr.close()
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
         self.proc.wait()
+        self._drain.join()
+        self.proc.stderr.close()
+        if self.proc.returncode != 0:
+            warnings.warn('ffmpeg exited with code {}:\n{}'.format(self.proc.returncode, '\n'.join(self.log)))
+
+class HDF5Writer():
+    """Stores raw frames in an HDF5 file, without encoding
+
+    Datasets:
+        frames : (n,h,w[,3]) uint8, chunked one frame per chunk so that any frame can be read back directly
+        timestamps : (n,) float64
+        seq : (n,) int64, driver frame sequence numbers (gaps indicate dropped frames), or frame counts if these are not supplied
+    Frames are buffered and written batch_frames at a time, so the file is touched only a few times per second.
+    """
+    def __init__(self, file_name, shape=(320,240), colour=False, fps=30, timestamps=True, batch_frames=32, compression=None, compression_opts=None):
+        """
+        shape : w,h
+        compression : None / 'lzf' / 'gzip'
+            'lzf' compresses lightly at little CPU cost; 'gzip' with compression_opts=1 compresses further
+        """
+        fnroot,fnext = os.path.splitext(file_name)
+        self.file_name = '{}.h5'.format(fnroot)
+
+        w,h = shape
+        frame_shape = (h,w,3) if colour else (h,w)
+        self.batch = np.empty((batch_frames,)+frame_shape, dtype=np.uint8)
+        self.batch_ts = np.empty(batch_frames, dtype=np.float64)
+        self.batch_seq = np.empty(batch_frames, dtype=np.int64)
+        self.n_batched = 0
+        self.n_written = 0
+
+        self.file = h5py.File(self.file_name, 'w')
+        self.frames = self.file.create_dataset('frames', shape=(0,)+frame_shape, maxshape=(None,)+frame_shape, chunks=(1,)+frame_shape, dtype=np.uint8, compression=compression, compression_opts=compression_opts)
+        self.timestamps = self.file.create_dataset('timestamps', shape=(0,), maxshape=(None,), chunks=(4096,), dtype=np.float64)
+        self.seq = self.file.create_dataset('seq', shape=(0,), maxshape=(None,), chunks=(4096,), dtype=np.int64)
+        self.file.attrs['fps'] = fps
+
+    def write(self, frame, timestamp=None, seq=None):
+        i = self.n_batched
+        self.batch[i] = frame
+        self.batch_ts[i] = np.nan if timestamp is None else timestamp
+        self.batch_seq[i] = self.n_written + i if seq is None else seq
+        self.n_batched += 1
+        if self.n_batched == len(self.batch):
+            self.flush()
+
+    def flush(self):
+        n = self.n_batched
+        if n == 0:
+            return
+        start,stop = self.n_written, self.n_written+n
+        for ds,data in [(self.frames, self.batch), (self.timestamps, self.batch_ts), (self.seq, self.batch_seq)]:
+            ds.resize(stop, axis=0)
+            ds[start:stop] = data[:n]
+        self.n_written = stop
+        self.n_batched = 0
+
+    def end(self):
+        self.flush()
+        self.file.close()
+
+# sidecar index of RawWriter: a 64-byte header followed by one record per frame
+_RAW_MAGIC = b'PSEYERAW'
+_RAW_HEADER = np.dtype([('magic','S8'), ('version','<u4'), ('ndim','<u4'), ('shape','<u4',(3,)), ('pad','<u4'), ('fps','<f8'), ('reserved','<u8',(3,))])
+_RAW_RECORD = np.dtype([('timestamp','<f8'), ('seq','<i8')])
+
+class RawWriter():
+    """Stores raw frames back to back in a flat binary file, without encoding
+
+    Files:
+        <name>.raw : the frames, uint8, (h,w[,3]) each, with no header, so the file can be memory-mapped as an (n,h,w[,3]) array
+        <name>_index.bin : header (frame shape, fps) followed by one (timestamp, seq) record per frame
+    Frames are buffered and written batch_frames at a time, in a single write call.
+    Use RawReader to read the recording back.
+    """
+    def __init__(self, file_name, shape=(320,240), colour=False, fps=30, timestamps=True, batch_frames=32):
+        """
+        shape : w,h
+        """
+        fnroot,fnext = os.path.splitext(file_name)
+        self.file_name = '{}.raw'.format(fnroot)
+        self.index_file_name = '{}_index.bin'.format(fnroot)
+
+        w,h = shape
+        frame_shape = (h,w,3) if colour else (h,w)
+        self.batch = np.empty((batch_frames,)+frame_shape, dtype=np.uint8)
+        self.batch_index = np.empty(batch_frames, dtype=_RAW_RECORD)
+        self.n_batched = 0
+        self.n_written = 0
+
+        header = np.zeros(1, dtype=_RAW_HEADER)
+        header['magic'] = _RAW_MAGIC
+        header['version'] = 1
+        header['ndim'] = len(frame_shape)
+        header['shape'][0,:len(frame_shape)] = frame_shape
+        header['fps'] = fps
+
+        self.file = open(self.file_name, 'wb')
+        self.index_file = open(self.index_file_name, 'wb')
+        self.index_file.write(header.tobytes())
+
+    def write(self, frame, timestamp=None, seq=None):
+        i = self.n_batched
+        self.batch[i] = frame
+        self.batch_index[i] = (np.nan if timestamp is None else timestamp, self.n_written + i if seq is None else seq)
+        self.n_batched += 1
+        if self.n_batched == len(self.batch):
+            self.flush()
+
+    def flush(self):
+        n = self.n_batched
+        if n == 0:
+            return
+        # frames first, so the index never refers to frames that are not on disk
+        self.file.write(memoryview(self.batch[:n]).cast('B'))
+        self.file.flush()
+        self.index_file.write(memoryview(self.batch_index[:n]).cast('B'))
+        self.index_file.flush()
+        self.n_written += n
+        self.n_batched = 0
+
+    def end(self):
+        self.flush()
+        self.file.close()
+        self.index_file.close()
+
+class RawReader():
+    """Random access to recordings made by RawWriter or HDF5Writer
+
+    reader[k] returns frame k (slices return stacks of frames); reader.timestamps and reader.seq hold the per-frame index.
+    Frames of RawWriter recordings are memory-mapped, so only the frames accessed are read from disk.
+    """
+    def __init__(self, file_name):
+        """
+        file_name : path of the recording, with or without its extension (.raw / .h5)
+        """
+        fnroot,fnext = os.path.splitext(file_name)
+        self.file = None
+        if fnext == '.h5' or (fnext == '' and os.path.exists(fnroot+'.h5') and not os.path.exists(fnroot+'.raw')):
+            self.file = h5py.File(fnroot+'.h5', 'r')
+            self.frames = self.file['frames']
+            self.timestamps = self.file['timestamps'][:]
+            self.seq = self.file['seq'][:]
+            self.fps = self.file.attrs['fps']
+        else:
+            index = np.fromfile('{}_index.bin'.format(fnroot), dtype=np.uint8)
+            header = index[:_RAW_HEADER.itemsize].view(_RAW_HEADER)[0]
+            if header['magic'] != _RAW_MAGIC:
+                raise Exception('{}_index.bin is not a pseyepy raw recording index.'.format(fnroot))
+            frame_shape = tuple(int(d) for d in header['shape'][:header['ndim']])
+            records = index[_RAW_HEADER.itemsize:]
+            records = records[:len(records)//_RAW_RECORD.itemsize*_RAW_RECORD.itemsize].view(_RAW_RECORD)
+
+            # a recording cut short may hold a partial last frame
+            frame_bytes = int(np.prod(frame_shape))
+            n = min(len(records), os.path.getsize(fnroot+'.raw') // frame_bytes)
+            self.frames = np.memmap(fnroot+'.raw', dtype=np.uint8, mode='r', shape=(n,)+frame_shape) if n else np.empty((0,)+frame_shape, dtype=np.uint8)
+            self.timestamps = records['timestamp'][:n].copy()
+            self.seq = records['seq'][:n].copy()
+            self.fps = float(header['fps'])
+        self.shape = self.frames.shape[1:]
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, k):
+        return np.asarray(self.frames[k])
 
+    def end(self):
+        if self.file is not None:
+            self.file.close()
+        self.frames = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.end()
 
 def generate_movie_params(cam, file_name, **kw):
     """Given a camera object and a root file_name, format and return file-saving parameters
@@ -130,8 +391,8 @@ def generate_movie_params(cam, file_name, **kw):
 
     movie_params = [ dict(   
             file_name = file_name[i],
-            shape = cam.resolution[i],
-            fps = cam.fps[i],
+            shape = (cam.shape[i][1], cam.shape[i][0]), # w,h of the frames as read, which may differ from the sensor resolution
+            fps = cam.fps[i] / cam.decimation[i], # the rate at which frames are read
             colour = cam.colour[i],
             ) for i in range(len(cam.ids)) ]
 
@@ -141,74 +402,168 @@ def generate_movie_params(cam, file_name, **kw):
     return movie_params
 
 class Stream():
-    """Convenience class to handle the creation of a CamDump and Writer, to grab and save input from a camera
+    """Convenience class to handle the creation of a CamDump and Writers, to grab and save input from a camera
+
+    Each camera is written by a Writer thread of its own, fed by its own FrameRing (file_queue_size items, 'drop_newest' by default), which absorbs writer stalls without unbounded memory growth; the display ring always holds the freshest frames.
+    Use Stream.stats() to see how many frames each ring has dropped, and how far each writer lags behind the cameras.
+
+    With kernels or a trigger, a Processor (see pseyepy.processing) runs kernels on every frame, fed by a ring of its own ('process'), and keeps their per-frame results (Stream.processor.results()).
+    With a trigger, the files are fed by the Processor rather than the CamDump, and only receive frames around the events it detects, e.g. trigger=('motion', 0.01) records only while more than 1% of the pixels of some camera change from one frame to the next.
     """
-    def __init__(self, cam, file_name=None, display=False, writer_class=None, **kwargs):
+    def __init__(self, cam, file_name=None, display=False, writer_class=None, file_queue_size=64, file_overflow='drop_newest',
+                 kernels=None, trigger=None, pre_trigger=30, post_trigger=60, results_file=None, **kwargs):
+        """
+        kernels : list
+            frame-processing kernels, e.g. [FrameDiff(), BlobCentroid()]; default [FrameDiff()] if a trigger is given
+        trigger, pre_trigger, post_trigger, results_file :
+            see Processor
+        kwargs :
+            writer parameters (see generate_movie_params)
+        """
         self.cam = cam
         self.file_name = file_name
         self.ques = {}
+        self.writers = []
+        self.processor = None
+
+        if trigger is not None and kernels is None:
+            kernels = [FrameDiff()]
 
         if writer_class is None:
             writer_class = Writer.DEFAULT_WRITER_CLASS
 
         if self.file_name is not None:
             movie_params = generate_movie_params(self.cam, self.file_name, **kwargs)
-            self.ques['file'] = queue.Queue()
+            # with a trigger, the frames from before an event reach the rings all at once
+            capacity = file_queue_size + (pre_trigger if trigger is not None else 0)
+            for i in range(len(self.cam.ids)):
+                self.ques['file_{}'.format(i)] = FrameRing(self.cam.shape, capacity=capacity, policy=file_overflow, seq=True, cams=[i])
         if display:
-            self.ques['display'] = queue.Queue()
+            self.ques['display'] = FrameRing(self.cam.shape, capacity=1, policy='drop_oldest')
+
+        dumped = list(self.ques.values())
+        if kernels is not None:
+            self.ques['process'] = FrameRing(self.cam.shape, capacity=file_queue_size, policy='drop_newest', seq=True)
+            outputs = []
+            if trigger is not None:
+                outputs = [q for k,q in self.ques.items() if k.startswith('file_')]
+                dumped = [q for q in dumped if q not in outputs]
+            self.processor = Processor(self.ques['process'], kernels, outputs=outputs, trigger=trigger, pre_trigger=pre_trigger, post_trigger=post_trigger, results_file=results_file)
+            dumped.append(self.ques['process'])
 
-        self.cd = CamDump(self.cam, ques=list(self.ques.values()))
+        self.cd = CamDump(self.cam, ques=dumped)
 
         if self.file_name is not None:
-            self.w = Writer(klass=writer_class, que=self.ques['file'], movie_params=movie_params)
+            for i in range(len(self.cam.ids)):
+                self.writers.append(Writer(klass=writer_class, que=self.ques['file_{}'.format(i)], movie_params=movie_params[i]))
         if display:
-            d = Display(lambda: self.ques['display'].get(block=False))
+            d = Display(lambda: self.ques['display'].get(timeout=1.0))
+
+    def stats(self):
+        """Statistics of each ring, keyed by 'file_<camera index>' / 'display' / 'process'
+
+        Those of the file rings include the statistics of their writer (see Writer.stats), and that of the processing ring those of the Processor (see Processor.stats).
+        """
+        stats = {k:q.stats() for k,q in self.ques.items()}
+        for i,w in enumerate(self.writers):
+            stats['file_{}'.format(i)].update(w.stats())
+        if self.processor is not None:
+            stats['process'].update(self.processor.stats())
+        return stats
 
     def end(self):
         self.cd.end()
-        if self.file_name is not None:
-            self.w.end()
+        if self.processor is not None:
+            self.processor.end()
+        for w in self.writers:
+            w.end()
 
 class Writer(threading.Thread):
-    """Continually reads from a queue and writes to a file
+    """Continually reads from a queue and writes to file/s
+
+    Blocks until frames are available; PooledFrames received from a queue.Queue are released once written. From a FrameRing, up to batch_size queued items are taken at once, and passed in a single call to writers that support it (FFMpegWriter.write_many).
+    The time from a frame's timestamp to the moment it is handed to the writer is tracked as the encode lag (see stats); a lag that keeps growing means the writer cannot keep up.
+    On end, the frames still queued are written before the files are closed; end the CamDump feeding the queue first.
     """
-    DEFAULT_WRITER_CLASS = FFMpegWriter # or OpencvWriter
-    def __init__(self, klass, que, movie_params={}):
+    DEFAULT_WRITER_CLASS = FFMpegWriter # or OpencvWriter, or HDF5Writer / RawWriter to store frames without encoding
+    def __init__(self, klass, que, movie_params={}, batch_size=8):
         super().__init__()
    
         self.klass = klass
         self.que = que
+        self.batch_size = batch_size
         self.movie_params = movie_params
         if isinstance(self.movie_params, dict):
             self.movie_params = [self.movie_params]
         self.kill = threading.Event()
         self.done = threading.Event()
 
+        self.n_written = 0
+        self.lag = np.nan
+        self.max_lag = np.nan
+
         self.start()
 
     def run(self):
        
-        ffmpws = []
-        for mpm in self.movie_params:
-            ff = self.klass(timestamps=True, **mpm)
-            ffmpws.append(ff)
+        writers = []
+        try:
+            for mpm in self.movie_params:
+                writers.append(self.klass(timestamps=True, **mpm))
+
+            while True:
+                try:
+                    if isinstance(self.que, FrameRing):
+                        items = self.que.get_many(self.batch_size, timeout=0.1)
+                    else:
+                        items = [self.que.get(timeout=0.1)]
+                except queue.Empty:
+                    if self.kill.is_set():
+                        break
+                    continue
+                self._write(writers, items)
 
-        while not self.kill.is_set():
-            time.sleep(0.005) # wait 5ms, necessary for smooth operation, shouldn't affect framerates b/c this is a thread
-            try:
-                data,ts = self.que.get(block=False)
+                # frames from a FramePool (see CamDump) go back to it once written
+                for item in items:
+                    if isinstance(item[0], PooledFrames):
+                        item[0].release()
 
-                assert len(data) == len(ffmpws), 'Param and cam count mismatch'
-                for dat,t,ff in zip(data, ts, ffmpws):
-                    ff.write(dat, timestamp=t)
+            if isinstance(self.que, FrameRing):
+                self.que.release()
+        finally:
+            for ff in writers:
+                ff.end()
+            self.done.set()
 
-            except queue.Empty:
-                pass
+    def _write(self, writers, items):
+        assert len(items[0][0]) == len(writers), 'Param and cam count mismatch'
+        for j,ff in enumerate(writers):
+            frames = [item[0][j] for item in items]
+            ts = [item[1][j] for item in items]
+            seqs = [item[2][j] if len(item) > 2 else None for item in items]
+            if hasattr(ff, 'write_many'):
+                ff.write_many(frames, ts, seqs)
+            else:
+                for dat,t,sq in zip(frames, ts, seqs):
+                    ff.write(dat, timestamp=t, seq=sq)
+
+        # lag of the oldest frame of the batch, which waited longest
+        self.lag = float(time.time() - np.min(items[0][1]))
+        self.max_lag = float(np.nanmax([self.max_lag, self.lag]))
+        self.n_written += len(items)
 
-        ff.end()
-        self.done.set()
+    def stats(self):
+        """Writing statistics
+
+        Returns
+        -------
+        dict with keys:
+            written : number of items written so far
+            lag : time (s) from the timestamp of the most recently written frame(s) to their being written
+            max_lag : maximum lag so far
+        """
+        return dict(written=self.n_written, lag=self.lag, max_lag=self.max_lag)
 
     def end(self):
         self.kill.set()
-        while not self.done.is_set():
-            pass
+        self.join()
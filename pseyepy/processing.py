@@ -0,0 +1,353 @@
+import threading
+import queue
+import collections
+import concurrent.futures
+import copy
+import time
+import numpy as np
+
+from .asynchronous import FrameRing
+
+def luminance(frame, step=1):
+    """Grayscale version of a frame, subsampled by taking every step-th row and column
+
+    Parameters
+    ----------
+    frame : np.ndarray
+        uint8 frame, (h, w) or (h, w, 3)
+    step : int
+
+    Returns
+    -------
+    np.ndarray : uint8 frame of shape (ceil(h/step), ceil(w/step)); a view into frame if it is grayscale
+    """
+    sub = frame[::step, ::step]
+    if sub.ndim == 2:
+        return sub
+    # (r + 2g + b) / 4, which is close to the perceived brightness and needs no floating point
+    total = sub[...,0].astype(np.uint16)
+    total += sub[...,1]
+    total += sub[...,1]
+    total += sub[...,2]
+    return (total >> 2).astype(np.uint8)
+
+def _absdiff(a, b):
+    # |a - b| of uint8 arrays, without widening them
+    return np.maximum(a, b) - np.minimum(a, b)
+
+def _centroid(mask, step):
+    # area and centroid of the pixels set in mask, in the coordinates of the full frame, from the row and column projections
+    area = int(np.count_nonzero(mask))
+    if area == 0:
+        return area, np.nan, np.nan
+    cols = np.count_nonzero(mask, axis=0)
+    rows = np.count_nonzero(mask, axis=1)
+    x = step * float(cols @ np.arange(len(cols))) / area
+    y = step * float(rows @ np.arange(len(rows))) / area
+    return area * step * step, x, y
+
+class FrameDiff():
+    """Kernel measuring the change from one frame of a camera to the next
+
+    Returns
+    -------
+    dict with keys:
+        diff : mean absolute difference in brightness from the previous frame
+        motion : fraction of pixels whose brightness changed by more than threshold
+    Both are 0 for the first frame.
+    """
+    def __init__(self, threshold=15, step=2):
+        """
+        Parameters
+        ----------
+        threshold : int
+            change in brightness (0-255) counted as motion
+        step : int
+            only every step-th row and column is compared (see luminance)
+        """
+        self.threshold = threshold
+        self.step = step
+        self.prev = None
+
+    def __call__(self, frame):
+        cur = luminance(frame, self.step).copy()
+        prev, self.prev = self.prev, cur
+        if prev is None:
+            return dict(diff=0., motion=0.)
+        d = _absdiff(cur, prev)
+        return dict(diff=float(d.mean()), motion=float(np.count_nonzero(d > self.threshold)) / d.size)
+
+class BackgroundSubtraction():
+    """Kernel separating moving objects from a slowly adapting background, the running average of past frames
+
+    Returns
+    -------
+    dict with keys:
+        foreground : fraction of pixels that differ from the background by more than threshold
+        fg_x, fg_y : centroid of these pixels, in pixels of the full frame (nan if there are none)
+    """
+    def __init__(self, alpha=0.02, threshold=25, step=2):
+        """
+        Parameters
+        ----------
+        alpha : float
+            weight of each new frame in the background, i.e. it adapts over roughly 1/alpha frames
+        threshold : int
+            difference in brightness (0-255) from the background counted as foreground
+        step : int
+            only every step-th row and column is used (see luminance)
+        """
+        self.alpha = alpha
+        self.threshold = threshold
+        self.step = step
+        self.background = None
+        self.mask = None
+
+    def __call__(self, frame):
+        cur = luminance(frame, self.step).astype(np.float32)
+        if self.background is None:
+            self.background = cur
+        diff = cur - self.background
+        self.mask = np.abs(diff) > self.threshold
+        self.background += self.alpha * diff
+        area, x, y = _centroid(self.mask, self.step)
+        return dict(foreground=float(np.count_nonzero(self.mask)) / self.mask.size, fg_x=x, fg_y=y)
+
+class BlobCentroid():
+    """Kernel locating a bright (or dark) object, e.g. an LED or an animal on a contrasting floor, as the centroid of the pixels beyond a brightness threshold
+
+    Returns
+    -------
+    dict with keys:
+        x, y : centroid, in pixels of the full frame (nan if no pixel is beyond threshold)
+        area : number of pixels beyond threshold, in pixels of the full frame
+    """
+    def __init__(self, threshold=200, dark=False, step=2):
+        """
+        Parameters
+        ----------
+        threshold : int
+            brightness (0-255) beyond which pixels belong to the object
+        dark : True / False
+            the object is darker than threshold, rather than brighter
+        step : int
+            only every step-th row and column is used (see luminance)
+        """
+        self.threshold = threshold
+        self.dark = dark
+        self.step = step
+
+    def __call__(self, frame):
+        lum = luminance(frame, self.step)
+        mask = lum < self.threshold if self.dark else lum > self.threshold
+        area, x, y = _centroid(mask, self.step)
+        return dict(x=x, y=y, area=area)
+
+class Processor(threading.Thread):
+    """Runs frame-processing kernels on the frames of a queue as they arrive, keeping compact per-frame results, and optionally forwards frames to other queues only around detected events
+
+    A kernel is any callable that takes a frame (a uint8 array as read from a camera) and returns a dict of scalars, e.g. FrameDiff, BackgroundSubtraction, BlobCentroid.
+    Each camera has its own copies of the kernels, as kernels may keep state (a previous frame, a background); the cameras of a frame set are processed in parallel by a thread pool, which numpy's kernels can make use of as they release the GIL.
+
+    Results are records with fields timestamp, seq, cam, followed by the values returned by the kernels, one record per camera and frame; see results().
+
+    Event-triggered forwarding: with a trigger, frames are put to the outputs (e.g. the FrameRings of Writers) only from pre_trigger frames before the trigger fires until post_trigger frames after it last fired.
+    Frames before an event are held in a ring buffer of pre_trigger frames, so nothing is written while the scene is still. Without a trigger, every frame is forwarded.
+    """
+    def __init__(self, que, kernels, outputs=[], trigger=None, pre_trigger=30, post_trigger=60, history=100000, results_file=None, n_workers=None):
+        """
+        Parameters
+        ----------
+        que : FrameRing
+            source of frame sets, with seq=True, e.g. a destination of a CamDump
+        kernels : list
+            kernels run on every frame of every camera, in order; their results are merged, so later kernels overwrite fields of the same name
+        outputs : list
+            queues (FrameRing / queue.Queue) to which frame sets are forwarded, as (frames, timestamps, seqs) items
+        trigger : (field, threshold) / callable
+            (field, threshold): fires when the field of any camera exceeds threshold, e.g. ('motion', 0.01) with FrameDiff
+            callable: takes the records of a frame set (structured array, one per camera) and returns True to fire
+            None: forward every frame
+        pre_trigger : int
+            frames forwarded from before the trigger fires
+        post_trigger : int
+            frames forwarded after the trigger last fired
+        history : int
+            maximum number of frame sets whose results are kept in memory (see results)
+        results_file : str
+            path of a csv file to which each record is appended as well
+        n_workers : int
+            threads processing cameras in parallel
+            default: one per camera
+        """
+        super().__init__()
+
+        if isinstance(trigger, (tuple, list)):
+            field, threshold = trigger
+            trigger = lambda records: bool(np.any(records[field] > threshold))
+        if pre_trigger < 0 or post_trigger < 0:
+            raise Exception('pre_trigger and post_trigger cannot be negative.')
+
+        self.que = que
+        self.kernels = [[copy.deepcopy(k) for k in kernels] for c in que.cams]
+        self.outputs = outputs
+        self.trigger = trigger
+        self.post_trigger = post_trigger
+        self.results_file = results_file
+        self.dtype = None # that of the records, known once the first frame set is processed
+
+        n_workers = len(que.cams) if n_workers is None else n_workers
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) if n_workers > 1 else None
+        self.pre = FrameRing(que.shapes, capacity=pre_trigger, policy='drop_oldest', seq=True) if (trigger is not None and pre_trigger > 0) else None
+
+        self._history = collections.deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._file = None
+        self.recording = trigger is None
+        self._remaining = 0
+        self.events = [] # [first, last] timestamps of the frame sets that fired the trigger, for each event
+
+        self.n_processed = 0
+        self.n_forwarded = 0
+        self.process_time = 0.
+        self.lag = np.nan
+
+        self.kill = threading.Event()
+        self.done = threading.Event()
+        self.start()
+
+    def run(self):
+        try:
+            while True:
+                try:
+                    items = self.que.get_many(8, timeout=0.1)
+                except queue.Empty:
+                    if self.kill.is_set():
+                        break
+                    continue
+                for item in items:
+                    self._step(item)
+            self.que.release()
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+            if self._file is not None:
+                self._file.close()
+            self.done.set()
+
+    def _step(self, item):
+        frames, ts, seqs = item
+        t0 = time.perf_counter()
+
+        if self.pool is not None:
+            results = list(self.pool.map(self._process, range(len(frames)), frames))
+        else:
+            results = [self._process(j, f) for j,f in enumerate(frames)]
+        records = self._records(ts, seqs, results)
+        self.process_time += time.perf_counter() - t0
+        self.n_processed += 1
+        self.lag = float(time.time() - np.min(ts))
+
+        if self.trigger is not None:
+            t = float(np.min(ts))
+            if self.trigger(records):
+                if not self.recording:
+                    self.recording = True
+                    self._flush_pre()
+                    self.events.append([t, t])
+                self.events[-1][1] = t
+                self._remaining = self.post_trigger
+            elif self.recording:
+                if self._remaining == 0:
+                    self.recording = False
+                else:
+                    self._remaining -= 1
+
+        if self.recording:
+            self._forward(item)
+        elif self.pre is not None:
+            self.pre.put(item)
+
+    def _process(self, j, frame):
+        result = {}
+        for kernel in self.kernels[j]:
+            result.update(kernel(frame))
+        return result
+
+    def _records(self, ts, seqs, results):
+        if self.dtype is None:
+            fields = [('timestamp', np.float64), ('seq', np.int64), ('cam', np.int16)]
+            fields += [(name, np.float64) for name in results[0]]
+            self.dtype = np.dtype(fields)
+            if self.results_file is not None:
+                self._file = open(self.results_file, 'a')
+                self._file.write('{}\n'.format(','.join(self.dtype.names)))
+
+        records = np.zeros(len(results), dtype=self.dtype)
+        records['timestamp'] = ts
+        records['seq'] = seqs
+        records['cam'] = self.que.cams
+        for name in self.dtype.names[3:]:
+            records[name] = [result.get(name, np.nan) for result in results]
+        with self._lock:
+            self._history.append(records)
+
+        if self._file is not None:
+            self._file.write(''.join(['{:0.6f},{},{},{}\n'.format(r['timestamp'], r['seq'], r['cam'], ','.join([repr(float(v)) for v in r.tolist()[3:]])) for r in records]))
+        return records
+
+    def _flush_pre(self):
+        # the frames held from before the event go out first, oldest first
+        while True:
+            try:
+                items = self.pre.get_many(self.pre.capacity, block=False)
+            except queue.Empty:
+                break
+            for item in items:
+                self._forward(item)
+        self.pre.release()
+
+    def _forward(self, item):
+        for que in self.outputs:
+            if isinstance(que, FrameRing):
+                que.put(item)
+            else:
+                que.put(([f.copy() for f in item[0]], item[1].copy(), item[2].copy()))
+        self.n_forwarded += 1
+
+    def results(self, n=None):
+        """Records of the last n frame sets processed (all of those kept, by default)
+
+        Returns
+        -------
+        structured array with fields timestamp, seq, cam and those of the kernels, one record per camera and frame, oldest first
+        """
+        with self._lock:
+            history = list(self._history)
+        if n is not None:
+            history = history[len(history)-n:] if n > 0 else []
+        if not history:
+            return np.zeros(0, dtype=self.dtype or [('timestamp', np.float64), ('seq', np.int64), ('cam', np.int16)])
+        return np.concatenate(history)
+
+    def stats(self):
+        """Processing and event statistics
+
+        Returns
+        -------
+        dict with keys:
+            processed : number of frame sets processed so far
+            forwarded : number of frame sets put to the outputs so far
+            events : number of times the trigger started an event
+            recording : whether frames are currently forwarded
+            process_ms : mean time spent running the kernels on a frame set
+            lag : seconds from the timestamp of the last frame set processed to the moment it was processed
+        """
+        return dict(processed=self.n_processed, forwarded=self.n_forwarded, events=len(self.events), recording=self.recording,
+                    process_ms=1e3 * self.process_time / self.n_processed if self.n_processed else np.nan, lag=self.lag)
+
+    def end(self):
+        """Processes the frame sets still queued, then stops; end the CamDump feeding the queue first
+        """
+        self.kill.set()
+        self.join()
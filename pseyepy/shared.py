@@ -0,0 +1,367 @@
+"""
+Frame transport between processes through shared memory
+
+A CaptureProcess owns the Camera in a process of its own and publishes every frame set into a SharedFrameRing. Any number of consumer processes can attach to the ring by name, and read frames as numpy arrays that point straight into shared memory.
+
+There is a single writer and no lock: readers find new frames by polling a counter in the ring header, so the capture loop never waits on a consumer. In return, a reader that falls more than `capacity` frame sets behind has frames overwritten under it; every slot carries a sequence number so this can be detected (see SharedFrameReader.valid).
+"""
+import multiprocessing as mp
+import queue
+import secrets
+import sys
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+# header: int64 words
+_MAGIC = 0x50534559455259 # 'PSEYERY'
+_H_MAGIC, _H_CAPACITY, _H_NCAMS, _H_COUNT, _H_CLOSED, _H_STRIDE = range(6)
+_H_SHAPES = 8 # 4 words per camera: ndim, dims
+_HEADER_WORDS = 256
+_MAX_CAMS = (_HEADER_WORDS - _H_SHAPES) // 4
+_ALIGN = 64
+
+def _aligned(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+def _attach_shm(name):
+    # the process that created the segment owns it; attaching must not register it for cleanup here as well
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    from multiprocessing import resource_tracker
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args, **kwargs: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+def _unlink_shm(name):
+    # frees a segment whose owner can no longer do so, if it exists
+    try:
+        shm = _attach_shm(name)
+    except FileNotFoundError:
+        return
+    shm.unlink()
+    shm.close()
+
+class SharedFrameRing():
+    """Ring of frame sets in shared memory, with one writer
+
+    Each slot holds one frame per camera, and per camera the read timestamp, arrival time and driver sequence number (as in Camera.read(info=True)).
+    The slot's sequence number is odd while the slot is being written, and 2*(k+1) once frame set k has been published into it.
+    """
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.name = shm.name
+        self.owner = owner
+
+        self.header = np.ndarray((_HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        if self.header[_H_MAGIC] != _MAGIC:
+            raise Exception('Shared memory block {} is not a pseyepy frame ring.'.format(self.name))
+        self.capacity = int(self.header[_H_CAPACITY])
+        self.n_cams = int(self.header[_H_NCAMS])
+        self.dtype = np.dtype(np.uint8)
+        stride = int(self.header[_H_STRIDE])
+        self.shapes = []
+        for c in range(self.n_cams):
+            w = self.header[_H_SHAPES+4*c : _H_SHAPES+4*c+4]
+            self.shapes.append(tuple(int(d) for d in w[1:1+w[0]]))
+
+        # views of every slot: sequence number, metadata, frames
+        base = _HEADER_WORDS * 8
+        self.seq, self.ts, self.arrival, self.drv_seq, self.frames = [], [], [], [], []
+        for s in range(self.capacity):
+            off = base + s*stride
+            self.seq.append(np.ndarray((1,), dtype=np.int64, buffer=shm.buf, offset=off))
+            meta = np.ndarray((3, self.n_cams), dtype=np.float64, buffer=shm.buf, offset=off+8)
+            self.ts.append(meta[0])
+            self.arrival.append(meta[1])
+            self.drv_seq.append(meta[2])
+            off = _aligned(off + 8 + meta.nbytes)
+            frames = []
+            for shape in self.shapes:
+                f = np.ndarray(shape, dtype=self.dtype, buffer=shm.buf, offset=off)
+                frames.append(f)
+                off = _aligned(off + f.nbytes)
+            self.frames.append(frames)
+
+    @classmethod
+    def create(cls, shapes, capacity=64, name=None):
+        """Allocate a new ring
+
+        Parameters
+        ----------
+        shapes : list-like
+            shape of the (uint8) frames from each camera, e.g. Camera.shape
+        capacity : int
+            number of frame sets held in the ring
+        name : str
+            name of the shared memory block
+            default: a new unique name
+        """
+        shapes = [tuple(s) for s in shapes]
+        if len(shapes) > _MAX_CAMS:
+            raise Exception('At most {} cameras can share a ring.'.format(_MAX_CAMS))
+        if capacity < 2:
+            raise Exception('capacity must be at least 2.')
+
+        stride = _aligned(8 + 3*8*len(shapes))
+        for shape in shapes:
+            stride += _aligned(int(np.prod(shape)))
+        shm = shared_memory.SharedMemory(name=name, create=True, size=_HEADER_WORDS*8 + capacity*stride)
+
+        header = np.ndarray((_HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[_H_CAPACITY] = capacity
+        header[_H_NCAMS] = len(shapes)
+        header[_H_STRIDE] = stride
+        for c,shape in enumerate(shapes):
+            header[_H_SHAPES+4*c] = len(shape)
+            header[_H_SHAPES+4*c+1 : _H_SHAPES+4*c+1+len(shape)] = shape
+        header[_H_MAGIC] = _MAGIC
+        del header
+
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Attach to an existing ring by the name of its shared memory block
+        """
+        return cls(_attach_shm(name), owner=False)
+
+    @property
+    def count(self):
+        """Number of frame sets published so far"""
+        return int(self.header[_H_COUNT])
+
+    @property
+    def closed(self):
+        """True once the writer has finished"""
+        return bool(self.header[_H_CLOSED])
+
+    def publish(self, frames, ts, infos=None):
+        """Write one frame set into the next slot (writer only)
+
+        Parameters
+        ----------
+        frames : list of np.ndarray
+            one frame per camera
+        ts : list-like
+            one timestamp per camera
+        infos : list of dict
+            optional per-camera metadata, as returned by Camera.read(info=True)
+        """
+        k = self.count
+        s = k % self.capacity
+        self.seq[s][0] = 2*k + 1
+        for dst,src in zip(self.frames[s], frames):
+            np.copyto(dst, src)
+        self.ts[s][:] = ts
+        if infos is not None:
+            self.arrival[s][:] = [i['arrival'] for i in infos]
+            self.drv_seq[s][:] = [i['seq'] for i in infos]
+        self.seq[s][0] = 2*k + 2
+        self.header[_H_COUNT] = k + 1
+
+    def close(self):
+        """Detach from the ring; the writer also marks it finished and frees the shared memory
+        """
+        if self.shm is None:
+            return
+        if self.owner:
+            self.header[_H_CLOSED] = 1
+        # views into the buffer must be gone before it can be closed
+        self.header = self.seq = self.ts = self.arrival = self.drv_seq = self.frames = None
+        if self.owner:
+            self.shm.unlink()
+        try:
+            self.shm.close()
+        except BufferError:
+            # frames handed out are still referenced; the mapping goes away with them
+            pass
+        self.shm = None
+
+class SharedFrameReader():
+    """Reads frame sets from a SharedFrameRing, in any process
+
+    Frames are returned as views into shared memory, without copying. A view remains intact until the writer wraps around the ring to its slot, i.e. for about `capacity` frame intervals; use valid() to check that a frame set was not overwritten while it was being used, or get(copy=True) for a consistent private copy.
+    """
+    def __init__(self, name, poll_interval=0.0005):
+        """
+        Parameters
+        ----------
+        name : str
+            name of the ring's shared memory block (CaptureProcess.shm_name)
+        poll_interval : float
+            time (s) slept between checks for a new frame set while waiting
+        """
+        self.ring = SharedFrameRing.attach(name)
+        self.poll_interval = poll_interval
+        self.next = self.ring.count # start with the next frame set published
+        self.n_missed = 0
+
+    @property
+    def shapes(self):
+        return self.ring.shapes
+
+    def _wait(self, timeout):
+        t0 = time.perf_counter()
+        while self.ring.count <= self.next:
+            if self.ring.closed:
+                raise EOFError('The capture process has ended.')
+            if timeout is not None and time.perf_counter() - t0 >= timeout:
+                raise queue.Empty
+            time.sleep(self.poll_interval)
+
+    def get(self, timeout=None, latest=False, copy=False):
+        """Retrieve the next frame set
+
+        Parameters
+        ----------
+        timeout : float
+            maximum time (s) to wait for a frame set; raises queue.Empty when it passes
+        latest : True / False
+            skip ahead to the newest frame set, rather than the next one in order
+        copy : True / False
+            return private copies of the frames instead of views into shared memory
+
+        Returns
+        -------
+        frames : list of np.ndarray, one per camera
+        timestamps : np.ndarray, one per camera
+        seq : int, index of this frame set in the stream; gaps indicate frame sets missed by this reader (also counted in n_missed)
+
+        Raises EOFError once the capture process has ended and all published frame sets have been read.
+        """
+        ring = self.ring
+        while True:
+            self._wait(timeout)
+            count = ring.count
+            k = count - 1 if latest else self.next
+            # too far behind: the oldest frame sets have been overwritten already
+            k = max(k, count - ring.capacity + 1)
+            self.n_missed += k - self.next
+            self.next = k + 1
+
+            s = k % ring.capacity
+            frames, ts = ring.frames[s], ring.ts[s]
+            if copy:
+                frames, ts = [f.copy() for f in frames], ts.copy()
+            if self.valid(k):
+                return frames, (ts if copy else ts.copy()), k
+            # overwritten mid-read; the next iteration moves on to a newer frame set
+
+    def info(self, seq):
+        """Per-camera metadata of frame set `seq`: list of dicts with keys arrival, seq (as in Camera.read(info=True))
+        """
+        s = seq % self.ring.capacity
+        return [dict(arrival=a, seq=int(q)) for a,q in zip(self.ring.arrival[s], self.ring.drv_seq[s])]
+
+    def valid(self, seq):
+        """True if frame set `seq` is still intact in shared memory
+        """
+        return int(self.ring.seq[seq % self.ring.capacity][0]) == 2*seq + 2
+
+    def close(self):
+        self.ring.close()
+
+class CaptureProcess(mp.Process):
+    """Runs a Camera in a process of its own, publishing all frames into a SharedFrameRing
+
+    Camera acquisition then shares no GIL with analysis; consumers in any process read the frames with a SharedFrameReader:
+        cp = CaptureProcess(ids=[0,1], fps=60, colour=True)
+        reader = SharedFrameReader(cp.shm_name) # e.g. in a worker process
+        frames, ts, seq = reader.get()
+        cp.end()
+
+    The Camera must not also be opened in the parent process.
+    """
+    def __init__(self, capacity=64, startup_timeout=30, **cam_kwargs):
+        """
+        Parameters
+        ----------
+        capacity : int
+            number of frame sets held in the shared ring
+        startup_timeout : float
+            time (s) to wait for the camera/s to open
+        cam_kwargs :
+            passed to Camera, e.g. ids, resolution, fps, colour
+        """
+        super().__init__(daemon=True)
+        self.capacity = capacity
+        self.cam_kwargs = cam_kwargs
+        # named here, so that the ring can be freed even if the process is stopped before it reports having created it
+        self.shm_name = 'pseyepy_{}'.format(secrets.token_hex(8))
+
+        self.kill = mp.Event()
+        self._params = mp.Queue()
+        self._parent_conn, self._child_conn = mp.Pipe(duplex=False)
+
+        self.start()
+
+        if not self._parent_conn.poll(startup_timeout):
+            self._abort()
+            raise Exception('Capture process did not start within {} s.'.format(startup_timeout))
+        ok, result = self._parent_conn.recv()
+        if not ok:
+            self._abort()
+            raise Exception('Capture process failed to start: {}'.format(result))
+        self.shapes = result
+
+    def _abort(self, timeout=5):
+        # after a failed start, nothing else holds the process: stop it, by force if need be, so that it lets go of the camera/s, and free its ring
+        self.kill.set()
+        self.join(timeout)
+        if self.is_alive():
+            self.terminate()
+            self.join()
+        _unlink_shm(self.shm_name)
+
+    def run(self):
+        from .cameras import Camera
+
+        cam, ring = None, None
+        try:
+            cam = Camera(**self.cam_kwargs)
+            ring = SharedFrameRing.create(cam.shape, capacity=self.capacity, name=self.shm_name)
+        except Exception as exc:
+            self._child_conn.send((False, repr(exc)))
+            if cam is not None:
+                cam.end()
+            return
+        self._child_conn.send((True, ring.shapes))
+
+        try:
+
+            while not self.kill.is_set():
+                frames, ts, infos = cam.read(timestamp=True, squeeze=False, info=True)
+                ring.publish(frames, ts, infos)
+
+                # parameter changes requested by the parent, applied between frames
+                while True:
+                    try:
+                        name, value = self._params.get_nowait()
+                    except queue.Empty:
+                        break
+                    setattr(cam, name, value)
+        finally:
+            cam.end()
+            ring.close()
+
+    def set_param(self, name, value):
+        """Change a camera setting in the capture process, e.g. set_param('exposure', [100, 120])
+
+        Applied asynchronously, between frames; `value` is assigned as in setattr(camera, name, value).
+        """
+        self._params.put((name, value))
+
+    def reader(self, **kwargs):
+        """A SharedFrameReader attached to this process's ring"""
+        return SharedFrameReader(self.shm_name, **kwargs)
+
+    def end(self, timeout=5):
+        """Stop capturing, close the camera/s, and free the ring
+        """
+        self.kill.set()
+        self.join(timeout)
@@ -0,0 +1,417 @@
+// Bayer demosaicing for the PS3EYE driver
+//
+// The camera outputs a GRBG mosaic:
+//
+// G R G R G R
+// B G B G B G
+// G R G R G R
+// B G B G B G
+//
+// The full-resolution modes reproduce the bilinear interpolation of the original PS3EYEDriver byte for byte:
+// every interior pixel takes its own colour from the mosaic and averages the nearest neighbours of the other two
+// ((a+b+1)>>1 for two neighbours, (a+b+c+d+2)>>2 for four), the first and last column of a row are copies of the
+// second and second-to-last, and the first and last row are copies of the second and second-to-last.
+//
+// On x86 the interior of each row is computed 16 pixels at a time with SSE2 (which every x86-64 CPU has): the
+// two- and four-neighbour averages are formed for all 16 pixels at once and the colour role of each pixel is then
+// selected with an even/odd lane mask. Elsewhere, and for the few pixels left at the end of a row, the interior is
+// processed as (even, odd) pixel pairs, whose colour roles are fixed for a given row parity, so the loop is
+// branch-free integer code that the compiler is free to auto-vectorize.
+
+#ifndef PS3EYE_DEBAYER_H
+#define PS3EYE_DEBAYER_H
+
+#include <stdint.h>
+#include <string.h>
+#include <algorithm>
+
+#if defined(_MSC_VER)
+	#define DEBAYER_RESTRICT __restrict
+#else
+	#define DEBAYER_RESTRICT __restrict__
+#endif
+
+#if defined(__SSE2__) || defined(_M_X64) || (defined(_M_IX86_FP) && _M_IX86_FP >= 2)
+	#define DEBAYER_SSE2 1
+	#include <emmintrin.h>
+#endif
+
+namespace ps3eye {
+namespace debayer {
+
+static inline uint32_t avg2(uint32_t a, uint32_t b) { return (a + b + 1) >> 1; }
+static inline uint32_t avg4(uint32_t a, uint32_t b, uint32_t c, uint32_t d) { return (a + b + c + d + 2) >> 2; }
+
+#ifdef DEBAYER_SSE2
+// 16-lane exact equivalent of avg4
+static inline __m128i avg4_epu8(__m128i a, __m128i b, __m128i c, __m128i d)
+{
+	const __m128i zero = _mm_setzero_si128();
+	const __m128i two = _mm_set1_epi16(2);
+	__m128i lo = _mm_add_epi16(_mm_add_epi16(_mm_unpacklo_epi8(a, zero), _mm_unpacklo_epi8(b, zero)),
+							   _mm_add_epi16(_mm_unpacklo_epi8(c, zero), _mm_unpacklo_epi8(d, zero)));
+	__m128i hi = _mm_add_epi16(_mm_add_epi16(_mm_unpackhi_epi8(a, zero), _mm_unpackhi_epi8(b, zero)),
+							   _mm_add_epi16(_mm_unpackhi_epi8(c, zero), _mm_unpackhi_epi8(d, zero)));
+	lo = _mm_srli_epi16(_mm_add_epi16(lo, two), 2);
+	hi = _mm_srli_epi16(_mm_add_epi16(hi, two), 2);
+	return _mm_packus_epi16(lo, hi);
+}
+
+// even lanes from a, odd lanes from b
+static inline __m128i select_even(__m128i even_mask, __m128i a, __m128i b)
+{
+	return _mm_or_si128(_mm_and_si128(even_mask, a), _mm_andnot_si128(even_mask, b));
+}
+
+static inline __m128i load16(const uint8_t* p)
+{
+	return _mm_loadu_si128((const __m128i*)p);
+}
+#endif
+
+// Output pixel writers: each receives the interpolated R, G, B of pixel x of the current output row
+// (and, with SSE2, of the 16 pixels starting at x)
+
+template <int RI, int BI>
+struct RGBWriter
+{
+	static const int channels = 3;
+	uint8_t* DEBAYER_RESTRICT row;
+
+	inline void put(int x, uint32_t r, uint32_t g, uint32_t b)
+	{
+		uint8_t* p = row + 3 * x;
+		p[RI] = (uint8_t)r;
+		p[1] = (uint8_t)g;
+		p[BI] = (uint8_t)b;
+	}
+
+#ifdef DEBAYER_SSE2
+	inline void put16(int x, __m128i r, __m128i g, __m128i b)
+	{
+		// SSE2 has no byte shuffle, so the planes are unpacked into 4-byte (c0, c1, c2, 0) pixels, which are then
+		// stored 3 bytes apart. Each store spills one byte into the next pixel, which is overwritten by the next
+		// store; the spill of the last one lands on pixel x+16 (at most width-2), which is written after this call.
+		const __m128i zero = _mm_setzero_si128();
+		const __m128i c0 = (RI == 0) ? r : b;
+		const __m128i c2 = (RI == 0) ? b : r;
+		const __m128i c01_lo = _mm_unpacklo_epi8(c0, g), c01_hi = _mm_unpackhi_epi8(c0, g);
+		const __m128i c2z_lo = _mm_unpacklo_epi8(c2, zero), c2z_hi = _mm_unpackhi_epi8(c2, zero);
+		__m128i quads[4] = {
+			_mm_unpacklo_epi16(c01_lo, c2z_lo), _mm_unpackhi_epi16(c01_lo, c2z_lo),
+			_mm_unpacklo_epi16(c01_hi, c2z_hi), _mm_unpackhi_epi16(c01_hi, c2z_hi)
+		};
+
+		uint8_t* p = row + 3 * x;
+		for (int q = 0; q < 4; ++q)
+		{
+			__m128i v = quads[q];
+			for (int i = 0; i < 4; ++i, p += 3)
+			{
+				uint32_t pixel = (uint32_t)_mm_cvtsi128_si32(v);
+				memcpy(p, &pixel, 4);
+				v = _mm_srli_si128(v, 4);
+			}
+		}
+	}
+#endif
+};
+
+struct GrayWriter
+{
+	static const int channels = 1;
+	uint8_t* DEBAYER_RESTRICT row;
+
+	inline void put(int x, uint32_t r, uint32_t g, uint32_t b)
+	{
+		row[x] = (uint8_t)((r * 77 + g * 151 + b * 28) >> 8);
+	}
+
+#ifdef DEBAYER_SSE2
+	inline void put16(int x, __m128i r, __m128i g, __m128i b)
+	{
+		// the weights sum to 256, so the weighted sum fits in 16 bits
+		const __m128i zero = _mm_setzero_si128();
+		const __m128i wr = _mm_set1_epi16(77), wg = _mm_set1_epi16(151), wb = _mm_set1_epi16(28);
+		__m128i lo = _mm_add_epi16(_mm_add_epi16(_mm_mullo_epi16(_mm_unpacklo_epi8(r, zero), wr),
+												 _mm_mullo_epi16(_mm_unpacklo_epi8(g, zero), wg)),
+								   _mm_mullo_epi16(_mm_unpacklo_epi8(b, zero), wb));
+		__m128i hi = _mm_add_epi16(_mm_add_epi16(_mm_mullo_epi16(_mm_unpackhi_epi8(r, zero), wr),
+												 _mm_mullo_epi16(_mm_unpackhi_epi8(g, zero), wg)),
+								   _mm_mullo_epi16(_mm_unpackhi_epi8(b, zero), wb));
+		_mm_storeu_si128((__m128i*)(row + x), _mm_packus_epi16(_mm_srli_epi16(lo, 8), _mm_srli_epi16(hi, 8)));
+	}
+#endif
+};
+
+struct GreenWriter
+{
+	static const int channels = 1;
+	uint8_t* DEBAYER_RESTRICT row;
+
+	// r and b are unused, so their interpolation is optimized away after inlining
+	inline void put(int x, uint32_t, uint32_t g, uint32_t)
+	{
+		row[x] = (uint8_t)g;
+	}
+
+#ifdef DEBAYER_SSE2
+	inline void put16(int x, __m128i, __m128i g, __m128i)
+	{
+		_mm_storeu_si128((__m128i*)(row + x), g);
+	}
+#endif
+};
+
+// Interpolate pixels [begin, end) of output row y (1 <= y <= height-2) from mosaic rows y-1, y, y+1, leaving out the first and last pixel of the row.
+// begin and end are even.
+template <class Writer>
+static inline void interior_row(const uint8_t* DEBAYER_RESTRICT up, const uint8_t* DEBAYER_RESTRICT mid, const uint8_t* DEBAYER_RESTRICT dn, int width, bool gr_row, Writer& out, int begin, int end)
+{
+	int start = begin < 2 ? 2 : begin;
+	const int stop = end > width - 2 ? width - 2 : end;
+
+#ifdef DEBAYER_SSE2
+	// the 16 pixels written at once may spill into the next one, which must be inside the window and written afterwards
+	const int sse_stop = end > width - 2 ? width - 2 : end - 1;
+	const __m128i even_mask = _mm_set1_epi16(0x00ff);
+	for (; start + 16 <= sse_stop; start += 16)
+	{
+		const int x = start;
+		__m128i u = load16(up + x), ul = load16(up + x - 1), ur = load16(up + x + 1);
+		__m128i m = load16(mid + x), ml = load16(mid + x - 1), mr = load16(mid + x + 1);
+		__m128i d = load16(dn + x), dl = load16(dn + x - 1), dr = load16(dn + x + 1);
+
+		__m128i horizontal = _mm_avg_epu8(ml, mr);		// _mm_avg_epu8 is exactly avg2
+		__m128i vertical = _mm_avg_epu8(u, d);
+		__m128i cross = avg4_epu8(u, d, ml, mr);
+		__m128i diagonal = avg4_epu8(ul, ur, dl, dr);
+
+		if (gr_row)
+			out.put16(x, select_even(even_mask, horizontal, m), select_even(even_mask, m, cross), select_even(even_mask, vertical, diagonal));
+		else
+			out.put16(x, select_even(even_mask, diagonal, vertical), select_even(even_mask, cross, m), select_even(even_mask, m, horizontal));
+	}
+#endif
+
+	if (gr_row)
+	{
+		// G R G R ...: green at even x (red left/right, blue above/below), red at odd x
+		for (int x = start; x < stop; x += 2)
+		{
+			out.put(x, avg2(mid[x - 1], mid[x + 1]), mid[x], avg2(up[x], dn[x]));
+			out.put(x + 1, mid[x + 1], avg4(up[x + 1], dn[x + 1], mid[x], mid[x + 2]), avg4(up[x], up[x + 2], dn[x], dn[x + 2]));
+		}
+		if (begin < 2)
+			out.put(1, mid[1], avg4(up[1], dn[1], mid[0], mid[2]), avg4(up[0], up[2], dn[0], dn[2]));
+		int x = width - 2;
+		if (end > x)
+			out.put(x, avg2(mid[x - 1], mid[x + 1]), mid[x], avg2(up[x], dn[x]));
+	}
+	else
+	{
+		// B G B G ...: blue at even x, green at odd x (blue left/right, red above/below)
+		for (int x = start; x < stop; x += 2)
+		{
+			out.put(x, avg4(up[x - 1], up[x + 1], dn[x - 1], dn[x + 1]), avg4(up[x], dn[x], mid[x - 1], mid[x + 1]), mid[x]);
+			out.put(x + 1, avg2(up[x + 1], dn[x + 1]), mid[x + 1], avg2(mid[x], mid[x + 2]));
+		}
+		if (begin < 2)
+			out.put(1, avg2(up[1], dn[1]), mid[1], avg2(mid[0], mid[2]));
+		int x = width - 2;
+		if (end > x)
+			out.put(x, avg4(up[x - 1], up[x + 1], dn[x - 1], dn[x + 1]), avg4(up[x], dn[x], mid[x - 1], mid[x + 1]), mid[x]);
+	}
+}
+
+// The functions below decode either the whole frame (w = h = 0), or only the window of w * h pixels at (x0, y0), all even,
+// with exactly the result that the same part of the whole decoded frame would have
+
+template <class Writer>
+static void demosaic(const uint8_t* in, int width, int height, uint8_t* out, int x0, int y0, int w, int h)
+{
+	const int channels = Writer::channels;
+	if (w == 0 || h == 0)
+	{
+		x0 = y0 = 0;
+		w = width;
+		h = height;
+	}
+	const int out_stride = w * channels;
+
+	Writer writer;
+	for (int y = y0; y < y0 + h; ++y)
+	{
+		uint8_t* row = out + (y - y0) * out_stride;
+
+		// first and last row are copies of their neighbours: copied from them where they are in the window too, and otherwise decoded as them
+		if (y == 0 && h > 1)
+			continue;	// copied after the loop
+		if (y == height - 1 && y > y0)
+		{
+			memcpy(row, row - out_stride, out_stride);
+			continue;
+		}
+		const int src = y < 1 ? 1 : (y > height - 2 ? height - 2 : y);
+
+		// pixel x of the frame goes to pixel x - x0 of the output row
+		writer.row = row - x0 * channels;
+		interior_row(in + (src - 1) * width, in + src * width, in + (src + 1) * width, width, (src % 2) == 0, writer, x0, x0 + w);
+
+		// first and last pixel of the row are copies of their neighbours
+		if (x0 == 0)
+			memcpy(row, row + channels, channels);
+		if (x0 + w == width)
+			memcpy(row + (w - 1) * channels, row + (w - 2) * channels, channels);
+	}
+
+	if (y0 == 0 && h > 1)
+		memcpy(out, out + out_stride, out_stride);
+}
+
+// Full-resolution RGB (or BGR), w * h * 3 bytes
+static inline void rgb(const uint8_t* in, int width, int height, uint8_t* out, bool bgr, int x0 = 0, int y0 = 0, int w = 0, int h = 0)
+{
+	if (bgr)
+		demosaic< RGBWriter<2, 0> >(in, width, height, out, x0, y0, w, h);
+	else
+		demosaic< RGBWriter<0, 2> >(in, width, height, out, x0, y0, w, h);
+}
+
+// Full-resolution luma of the interpolated RGB image, w * h bytes
+static inline void gray(const uint8_t* in, int width, int height, uint8_t* out, int x0 = 0, int y0 = 0, int w = 0, int h = 0)
+{
+	demosaic<GrayWriter>(in, width, height, out, x0, y0, w, h);
+}
+
+// Full-resolution interpolated green channel only, w * h bytes.
+// Cheaper than gray, and green carries most of the luminance.
+static inline void green(const uint8_t* in, int width, int height, uint8_t* out, int x0 = 0, int y0 = 0, int w = 0, int h = 0)
+{
+	demosaic<GreenWriter>(in, width, height, out, x0, y0, w, h);
+}
+
+// Half-resolution "superpixel" RGB (or BGR), (w/2) * (h/2) * 3 bytes.
+// Each 2x2 GRBG cell becomes one pixel: its red, its blue, and the mean of its two greens. No interpolation across cells.
+static inline void rgb_half(const uint8_t* in, int width, int height, uint8_t* out, bool bgr, int x0 = 0, int y0 = 0, int w = 0, int h = 0)
+{
+	const int ri = bgr ? 2 : 0;
+	const int bi = bgr ? 0 : 2;
+	if (w == 0 || h == 0)
+	{
+		x0 = y0 = 0;
+		w = width;
+		h = height;
+	}
+	const int out_width = w / 2;
+
+	for (int y = 0; y < h / 2; ++y)
+	{
+		const uint8_t* DEBAYER_RESTRICT gr = in + (y0 + 2 * y) * width + x0;
+		const uint8_t* DEBAYER_RESTRICT bg = gr + width;
+		uint8_t* DEBAYER_RESTRICT dest = out + y * out_width * 3;
+
+		for (int x = 0; x < out_width; ++x)
+		{
+			dest[3 * x + ri] = gr[2 * x + 1];
+			dest[3 * x + 1] = (uint8_t)avg2(gr[2 * x], bg[2 * x + 1]);
+			dest[3 * x + bi] = bg[2 * x];
+		}
+	}
+}
+
+// The raw mosaic itself, w * h bytes
+static inline void bayer(const uint8_t* in, int width, int height, uint8_t* out, int x0 = 0, int y0 = 0, int w = 0, int h = 0)
+{
+	if (w == 0 || h == 0)
+	{
+		w = width;
+		h = height;
+	}
+	// full-width regions are contiguous
+	if (x0 == 0 && w == width)
+	{
+		memcpy(out, in + y0 * width, w * h);
+		return;
+	}
+	for (int y = 0; y < h; ++y)
+		memcpy(out + y * w, in + (y0 + y) * width + x0, w);
+}
+
+// Binning: each F x F block of a decoded image of width * height pixels (C bytes each) is averaged into one pixel, rounding to nearest.
+// width and height are multiples of F
+template <int F, int C>
+static void bin(const uint8_t* in, int width, int height, uint8_t* out)
+{
+	const int stride = width * C;
+	// rows are summed vertically first, which vectorizes, a chunk of whole blocks at a time
+	const int chunk = (1536 / (F * C)) * (F * C);
+	uint16_t sums[1536];
+
+	for (int oy = 0; oy < height / F; ++oy)
+	{
+		const uint8_t* DEBAYER_RESTRICT block_row = in + oy * F * stride;
+		uint8_t* DEBAYER_RESTRICT dest = out + oy * (width / F) * C;
+
+		for (int start = 0; start < stride; start += chunk)
+		{
+			const int n = (std::min)(chunk, stride - start);
+			for (int k = 0; k < n; ++k)
+				sums[k] = block_row[start + k];
+			for (int j = 1; j < F; ++j)
+			{
+				const uint8_t* DEBAYER_RESTRICT row = block_row + j * stride + start;
+				for (int k = 0; k < n; ++k)
+					sums[k] += row[k];
+			}
+
+			for (int b = 0; b < n; b += F * C, dest += C)
+				for (int c = 0; c < C; ++c)
+				{
+					uint32_t sum = 0;
+					for (int i = 0; i < F; ++i)
+						sum += sums[b + i * C + c];
+					dest[c] = (uint8_t)((sum + F * F / 2) / (F * F));
+				}
+		}
+	}
+}
+
+template <int F>
+static void bin(const uint8_t* in, int width, int height, int channels, uint8_t* out)
+{
+	if (channels == 3)
+		bin<F, 3>(in, width, height, out);
+	else
+		bin<F, 1>(in, width, height, out);
+}
+
+// Binning of the raw mosaic: each pixel averages the F x F pixels of its colour in a block of 2F x 2F, so the output is a GRBG mosaic too.
+// width and height are multiples of 2F
+template <int F>
+static void bin_mosaic(const uint8_t* in, int width, int height, uint8_t* out)
+{
+	const int out_width = width / F;
+
+	for (int oy = 0; oy < height / F; ++oy)
+	{
+		// the output pixel (ox, oy) is colour (ox & 1, oy & 1) of the cell (ox / 2, oy / 2)
+		const uint8_t* DEBAYER_RESTRICT block_row = in + ((oy & ~1) * F + (oy & 1)) * width;
+		uint8_t* DEBAYER_RESTRICT dest = out + oy * out_width;
+
+		for (int ox = 0; ox < out_width; ++ox)
+		{
+			const uint8_t* DEBAYER_RESTRICT p = block_row + (ox & ~1) * F + (ox & 1);
+			uint32_t sum = 0;
+			for (int j = 0; j < F; ++j)
+				for (int i = 0; i < F; ++i)
+					sum += p[2 * j * width + 2 * i];
+			dest[ox] = (uint8_t)((sum + F * F / 2) / (F * F));
+		}
+	}
+}
+
+} // namespace debayer
+} // namespace ps3eye
+
+#endif
@@ -1,10 +1,15 @@
 // source code from https://github.com/inspirit/PS3EYEDriver
 #include "ps3eye.h"
+#include "debayer.h"
 
 #include <thread>
 #include <mutex>
 #include <condition_variable>
 #include <atomic>
+#include <chrono>
+#include <algorithm>
+#include <map>
+#include <random>
 #include <time.h>
 
 #if defined WIN32 || defined _WIN32 || defined WINCE
@@ -81,6 +86,13 @@
 #else
 	#include <sys/time.h>
 	#include <time.h>
+	#include <unistd.h>
+	#include <fcntl.h>
+	#include <pthread.h>
+	#include <sched.h>
+	#if defined __linux__
+		#include <sys/eventfd.h>
+	#endif
 	#if defined __MACH__ && defined __APPLE__
 		#include <mach/mach.h>
 		#include <mach/mach_time.h>
@@ -99,9 +111,6 @@
 
 namespace ps3eye {
 
-#define TRANSFER_SIZE		65536
-#define NUM_TRANSFERS		5
-
 #define OV534_REG_ADDRESS	0xf1	/* sensor address */
 #define OV534_REG_SUBADDR	0xf2
 #define OV534_REG_WRITE		0xf3
@@ -321,6 +330,128 @@ static uint8_t find_ep(struct libusb_device *device)
 const uint16_t PS3EYECam::VENDOR_ID = 0x1415;
 const uint16_t PS3EYECam::PRODUCT_ID = 0x2000;
 
+// Pin the calling thread to a CPU; returns false where unsupported
+static bool PinCurrentThread(int cpu)
+{
+#if defined(_WIN32)
+	return SetThreadAffinityMask(GetCurrentThread(), (DWORD_PTR)1 << cpu) != 0;
+#elif defined(__linux__)
+	cpu_set_t set;
+	CPU_ZERO(&set);
+	CPU_SET(cpu, &set);
+	return pthread_setaffinity_np(pthread_self(), sizeof(set), &set) == 0;
+#else
+	(void)cpu;
+	return false;
+#endif
+}
+
+// A libusb context, and the thread that handles its events while any camera using it is streaming
+class USBEventThread
+{
+public:
+	USBEventThread(libusb_context* context, bool owns_context, int cpu) :
+		usb_context			(context),
+		owns_context		(owns_context),
+		cpu					(cpu)
+	{
+		exit_signaled = false;
+		active_camera_count = 0;
+	}
+
+	~USBEventThread()
+	{
+		if (update_thread.joinable())
+			stopTransferThread();
+		if (owns_context)
+			libusb_exit(usb_context);
+	}
+
+	libusb_context* context() const { return usb_context; }
+	void setCPU(int val) { cpu = val; }
+
+	void cameraStarted()
+	{
+		std::lock_guard<std::mutex> lock(mutex);
+		if (active_camera_count++ == 0)
+			startTransferThread();
+	}
+
+	void cameraStopped()
+	{
+		std::lock_guard<std::mutex> lock(mutex);
+		if (--active_camera_count == 0)
+			stopTransferThread();
+	}
+
+	// The device at the same USB port as `device` (enumerated in another context), referenced; NULL if it is gone
+	libusb_device* findDevice(libusb_device* device)
+	{
+		uint8_t ports[8], candidate_ports[8];
+		int n_ports = libusb_get_port_numbers(device, ports, sizeof(ports));
+		uint8_t bus = libusb_get_bus_number(device);
+
+		libusb_device** devs;
+		ssize_t cnt = libusb_get_device_list(usb_context, &devs);
+		libusb_device* found = NULL;
+		for (ssize_t i = 0; i < cnt && !found; ++i)
+		{
+			if (libusb_get_bus_number(devs[i]) != bus)
+				continue;
+			int n = libusb_get_port_numbers(devs[i], candidate_ports, sizeof(candidate_ports));
+			if (n == n_ports && memcmp(ports, candidate_ports, n) == 0)
+				found = libusb_ref_device(devs[i]);
+		}
+		if (cnt >= 0)
+			libusb_free_device_list(devs, 1);
+		return found;
+	}
+
+private:
+	void startTransferThread()
+	{
+		update_thread = std::thread(&USBEventThread::transferThreadFunc, this);
+	}
+
+	void stopTransferThread()
+	{
+		exit_signaled = true;
+		update_thread.join();
+		// Reset the exit signal flag.
+		// If we don't and we call startTransferThread() again, transferThreadFunc will exit immediately.
+		exit_signaled = false;
+	}
+
+	void transferThreadFunc()
+	{
+		SetThreadName("PS3EyeDriver Transfer Thread");
+		if (cpu >= 0 && !PinCurrentThread(cpu))
+		{
+			debug("could not pin transfer thread to cpu %d\n", cpu);
+		}
+
+		struct timeval tv;
+		tv.tv_sec = 0;
+		tv.tv_usec = 50 * 1000; // ms
+
+		while (!exit_signaled)
+		{
+			libusb_handle_events_timeout_completed(usb_context, &tv, NULL);
+		}
+	}
+
+	libusb_context*					usb_context;
+	bool							owns_context;
+	int								cpu;
+	std::thread						update_thread;
+	std::mutex						mutex;
+	std::atomic_bool				exit_signaled;
+	int								active_camera_count;
+
+	USBEventThread(const USBEventThread&);
+	void operator=(const USBEventThread&);
+};
+
 class USBMgr
 {
  public:
@@ -329,24 +460,23 @@ class USBMgr
 
 	static std::shared_ptr<USBMgr>  instance();
     int listDevices(std::vector<PS3EYECam::PS3EYERef>& list);
-	void cameraStarted();
-	void cameraStopped();
+
+	// The event thread that services a camera at `device` opened with `config`
+	std::shared_ptr<USBEventThread> getEventThread(const USBConfig& config, libusb_device* device);
 
     static std::shared_ptr<USBMgr>  sInstance;
     static int                      sTotalDevices;
 
  private:   
     libusb_context*					usb_context;
-	std::thread						update_thread;
-	std::atomic_bool				exit_signaled;
-	std::atomic_int					active_camera_count;
+	std::shared_ptr<USBEventThread>	shared_events;
+	std::map<int, std::weak_ptr<USBEventThread>> bus_events;
+	std::mutex						events_mutex;
 
     USBMgr(const USBMgr&);
     void operator=(const USBMgr&);
 
-	void startTransferThread();
-	void stopTransferThread();
-	void transferThreadFunc();
+	std::shared_ptr<USBEventThread> newEventThread(int cpu);
 };
 
 std::shared_ptr<USBMgr> USBMgr::sInstance;
@@ -354,16 +484,22 @@ int                     USBMgr::sTotalDevices = 0;
 
 USBMgr::USBMgr() 
 {
-	exit_signaled = false;
-	active_camera_count = 0;
-    libusb_init(&usb_context);
-    libusb_set_debug(usb_context, 1);
+    if (libusb_init(&usb_context) != 0)
+	{
+		debug("libusb init failed\n");
+		usb_context = NULL;
+	}
+	else
+		libusb_set_debug(usb_context, 1);
+	shared_events = std::make_shared<USBEventThread>(usb_context, false, -1);
 }
 
 USBMgr::~USBMgr()
 {
     debug("USBMgr destructor\n");
-    libusb_exit(usb_context);
+	shared_events.reset();
+	if (usb_context)
+		libusb_exit(usb_context);
 }
 
 std::shared_ptr<USBMgr> USBMgr::instance()
@@ -374,43 +510,38 @@ std::shared_ptr<USBMgr> USBMgr::instance()
     return sInstance;
 }
 
-void USBMgr::cameraStarted()
-{
-	if (active_camera_count++ == 0)
-		startTransferThread();
-}
-
-void USBMgr::cameraStopped()
-{
-	if (--active_camera_count == 0)
-		stopTransferThread();
-}
-
-void USBMgr::startTransferThread()
+std::shared_ptr<USBEventThread> USBMgr::newEventThread(int cpu)
 {
-	update_thread = std::thread(&USBMgr::transferThreadFunc, this);
+	libusb_context* context = NULL;
+	if (libusb_init(&context) != 0)
+		return std::shared_ptr<USBEventThread>();
+	return std::make_shared<USBEventThread>(context, true, cpu);
 }
 
-void USBMgr::stopTransferThread()
+std::shared_ptr<USBEventThread> USBMgr::getEventThread(const USBConfig& config, libusb_device* device)
 {
-	exit_signaled = true;
-	update_thread.join();
-	// Reset the exit signal flag.
-	// If we don't and we call startTransferThread() again, transferThreadFunc will exit immediately.
-	exit_signaled = false;    
-}
+	std::lock_guard<std::mutex> lock(events_mutex);
 
-void USBMgr::transferThreadFunc()
-{
-	SetThreadName("PS3EyeDriver Transfer Thread");
-
-	struct timeval tv;
-	tv.tv_sec = 0;
-	tv.tv_usec = 50 * 1000; // ms
-
-	while (!exit_signaled)
+	switch (config.event_thread)
+	{
+	case USBConfig::EventThread::PerCamera:
+		return newEventThread(config.cpu);
+	case USBConfig::EventThread::PerBus:
 	{
-		libusb_handle_events_timeout_completed(usb_context, &tv, NULL);
+		int bus = libusb_get_bus_number(device);
+		std::shared_ptr<USBEventThread> events = bus_events[bus].lock();
+		if (!events)
+		{
+			events = newEventThread(config.cpu);
+			bus_events[bus] = events;
+		}
+		return events;
+	}
+	default:
+		// takes effect the next time the shared thread starts
+		if (config.cpu >= 0)
+			shared_events->setCPU(config.cpu);
+		return shared_events;
 	}
 }
 
@@ -422,10 +553,14 @@ int USBMgr::listDevices( std::vector<PS3EYECam::PS3EYERef>& list )
     int i = 0;
     int cnt;
 
+    if (!usb_context)
+		return 0;
     cnt = (int)libusb_get_device_list(usb_context, &devs);
 
 	if (cnt < 0) {
+		// no device list to walk, e.g. where USB is not accessible at all
 		debug("Error Device scan\n");
+		return 0;
 	}else{
 		debug("Found Device scan\n");
 
@@ -459,22 +594,114 @@ int USBMgr::listDevices( std::vector<PS3EYECam::PS3EYERef>& list )
 
 static void LIBUSB_CALL transfer_completed_callback(struct libusb_transfer *xfr);
 
+// Lock-free counterparts of CaptureStats, updated on the capture path and readable at any time.
+// Every counter has a single writer at a time (the USB event thread, or a consumer holding the frame queue's mutex), so a relaxed load and store is enough to bump it, without a locked read-modify-write.
+struct CaptureCounters
+{
+	CaptureCounters()
+	{
+		std::atomic<uint64_t>* all[] = { &transfers, &transfer_errors, &bytes, &bad_headers, &payload_errors, &frames_completed, &frames_discarded, &frames_overwritten,
+										 &frames_skipped, &dequeues, &dequeue_wait_us, &dequeue_wait_max_us, &intervals, &interval_sum_us, &interval_sumsq_us };
+		for (std::atomic<uint64_t>* counter : all)
+			counter->store(0);
+		for (int i = 0; i < CaptureStats::INTERVAL_BINS; ++i)
+			interval_hist[i].store(0);
+	}
+
+	static void bump(std::atomic<uint64_t>& counter, uint64_t n = 1)
+	{
+		counter.store(counter.load(std::memory_order_relaxed) + n, std::memory_order_relaxed);
+	}
+
+	void add_dequeue(uint64_t wait_us)
+	{
+		bump(dequeues);
+		bump(dequeue_wait_us, wait_us);
+		if (wait_us > dequeue_wait_max_us.load(std::memory_order_relaxed))
+			dequeue_wait_max_us.store(wait_us, std::memory_order_relaxed);
+	}
+
+	void add_interval(uint64_t interval_us)
+	{
+		bump(intervals);
+		bump(interval_sum_us, interval_us);
+		bump(interval_sumsq_us, interval_us * interval_us);
+		bump(interval_hist[(std::min)(interval_us / CaptureStats::INTERVAL_BIN_US, (uint64_t)CaptureStats::INTERVAL_BINS - 1)]);
+	}
+
+	void snapshot(CaptureStats* stats) const
+	{
+		stats->transfers = transfers.load(std::memory_order_relaxed);
+		stats->transfer_errors = transfer_errors.load(std::memory_order_relaxed);
+		stats->bytes = bytes.load(std::memory_order_relaxed);
+		stats->bad_headers = bad_headers.load(std::memory_order_relaxed);
+		stats->payload_errors = payload_errors.load(std::memory_order_relaxed);
+		stats->frames_completed = frames_completed.load(std::memory_order_relaxed);
+		stats->frames_discarded = frames_discarded.load(std::memory_order_relaxed);
+		stats->frames_overwritten = frames_overwritten.load(std::memory_order_relaxed);
+		stats->frames_skipped = frames_skipped.load(std::memory_order_relaxed);
+		stats->dequeues = dequeues.load(std::memory_order_relaxed);
+		stats->dequeue_wait_us = dequeue_wait_us.load(std::memory_order_relaxed);
+		stats->dequeue_wait_max_us = dequeue_wait_max_us.load(std::memory_order_relaxed);
+		stats->intervals = intervals.load(std::memory_order_relaxed);
+		stats->interval_sum_us = interval_sum_us.load(std::memory_order_relaxed);
+		stats->interval_sumsq_us = interval_sumsq_us.load(std::memory_order_relaxed);
+		for (int i = 0; i < CaptureStats::INTERVAL_BINS; ++i)
+			stats->interval_hist[i] = interval_hist[i].load(std::memory_order_relaxed);
+	}
+
+	std::atomic<uint64_t>	transfers;
+	std::atomic<uint64_t>	transfer_errors;
+	std::atomic<uint64_t>	bytes;
+	std::atomic<uint64_t>	bad_headers;
+	std::atomic<uint64_t>	payload_errors;
+	std::atomic<uint64_t>	frames_completed;
+	std::atomic<uint64_t>	frames_discarded;
+	std::atomic<uint64_t>	frames_overwritten;
+	std::atomic<uint64_t>	frames_skipped;
+	std::atomic<uint64_t>	dequeues;
+	std::atomic<uint64_t>	dequeue_wait_us;
+	std::atomic<uint64_t>	dequeue_wait_max_us;
+	std::atomic<uint64_t>	intervals;
+	std::atomic<uint64_t>	interval_sum_us;
+	std::atomic<uint64_t>	interval_sumsq_us;
+	std::atomic<uint64_t>	interval_hist[CaptureStats::INTERVAL_BINS];
+};
+
 class FrameQueue
 {
 public:
-	FrameQueue(uint32_t frame_size) :
+	FrameQueue(uint32_t frame_size, uint32_t num_frames, CaptureCounters& counters, uint32_t decimation = 1, PS3EYECam::EFramePolicy policy = PS3EYECam::EFramePolicy::Fifo) :
 		frame_size			(frame_size),
-		num_frames			(2),
-		frame_buffer		((uint8_t*)malloc(frame_size * num_frames)),
+		num_frames			((std::max)(num_frames, (uint32_t)2)),	// one slot is always owned by the producer
+		frame_buffer		((uint8_t*)malloc(frame_size * this->num_frames)),
+		frame_info			(new FrameInfo[this->num_frames]),
 		head				(0),
 		tail				(0),
-		available			(0)
+		available			(0),
+		held				(false),
+		reading				(false),
+		closing				(false),
+		users				(0),
+		next_seq			(0),
+		counters			(counters),
+		decimation			((std::max)(decimation, (uint32_t)1)),
+		policy				(policy),
+		boundary_waiters	(0)
 	{
+		notify_fd[0] = notify_fd[1] = -1;
 	}
 
 	~FrameQueue()
 	{
 		free(frame_buffer);
+		delete[] frame_info;
+#if !defined(_WIN32)
+		if (notify_fd[0] >= 0)
+			close(notify_fd[0]);
+		if (notify_fd[1] >= 0 && notify_fd[1] != notify_fd[0])
+			close(notify_fd[1]);
+#endif
 	}
 
 	uint8_t* GetFrameBufferStart()
@@ -482,285 +709,350 @@ public:
 		return frame_buffer;
 	}
 
-	uint8_t* Enqueue()
+	// Register a consumer about to use the queue, which Close() waits for; false once the queue is closing
+	bool Enter()
 	{
-		uint8_t* new_frame = NULL;
+		std::lock_guard<std::mutex> lock(mutex);
+		if (closing)
+			return false;
+		users++;
+		return true;
+	}
 
+	void Leave()
+	{
 		std::lock_guard<std::mutex> lock(mutex);
+		if (--users == 0 && closing)
+			idle_condition.notify_all();
+	}
+
+	// Wake all consumers waiting for frames, and make them, and any that come later, return without one
+	void Interrupt()
+	{
+		std::lock_guard<std::mutex> lock(mutex);
+		closing = true;
+		empty_condition.notify_all();
+		frame_condition.notify_all();
+	}
+
+	// Interrupt, then wait until no consumer uses the queue any more, so that it can be deleted
+	void Close()
+	{
+		Interrupt();
+		std::unique_lock<std::mutex> lock(mutex);
+		idle_condition.wait(lock, [this] () { return users == 0; });
+	}
+
+	uint8_t* Enqueue(struct timeval arrival, uint32_t pts)
+	{
+		uint8_t* new_frame = NULL;
+		int fd;
 
-		// Unlike traditional producer/consumer, we don't block the producer if the buffer is full (ie. the consumer is not reading data fast enough).
-		// Instead, if the buffer is full, we simply return the current frame pointer, causing the producer to overwrite the previous frame.
-		// This allows performance to degrade gracefully: if the consumer is not fast enough (< Camera FPS), it will miss frames, but if it is fast enough (>= Camera FPS), it will see everything.
-		//
-		// Note that because the the producer is writing directly to the ring buffer, we can only ever be a maximum of num_frames-1 ahead of the consumer, 
-		// otherwise the producer could overwrite the frame the consumer is currently reading (in case of a slow consumer)
-		if (available >= num_frames - 1)
 		{
-			return frame_buffer + head * frame_size;
-		}
+			std::lock_guard<std::mutex> lock(mutex);
+
+			// Stamp the frame that was just completed in the head slot
+			frame_info[head].arrival = arrival;
+			frame_info[head].pts = pts;
+			frame_info[head].seq = next_seq++;
+			if (boundary_waiters)
+				frame_condition.notify_all();
+
+			// A frame left out by decimation is not queued: the producer writes the next one to the same slot
+			if (frame_info[head].seq % decimation != 0)
+				return frame_buffer + head * frame_size;
+
+			// Unlike traditional producer/consumer, we don't block the producer if the buffer is full (ie. the consumer is not reading data fast enough).
+			// Instead, if the buffer is full, we simply return the current frame pointer, causing the producer to overwrite the previous frame.
+			// This allows performance to degrade gracefully: if the consumer is not fast enough (< Camera FPS), it will miss frames, but if it is fast enough (>= Camera FPS), it will see everything.
+			//
+			// Note that because the the producer is writing directly to the ring buffer, we can only ever be a maximum of num_frames-1 ahead of the consumer,
+			// otherwise the producer could overwrite the frame the consumer is currently reading (in case of a slow consumer)
+			CaptureCounters::bump(counters.frames_completed);
+			if (available >= num_frames - 1)
+			{
+				// Under the Latest policy, the oldest frame makes room instead, unless a consumer is using it
+				if (policy != PS3EYECam::EFramePolicy::Latest || reading || held)
+				{
+					CaptureCounters::bump(counters.frames_overwritten);
+					return frame_buffer + head * frame_size;
+				}
+				tail = (tail + 1) % num_frames;
+				available--;
+				CaptureCounters::bump(counters.frames_skipped);
+			}
+
+			// Note: we don't need to copy any data to the buffer since the USB packets are directly written to the frame buffer.
+			// We just need to update head and available count to signal to the consumer that a new frame is available
+			head = (head + 1) % num_frames;
+			available++;
+
+			// Determine the next frame pointer that the producer should write to
+			new_frame = frame_buffer + head * frame_size;
 
-		// Note: we don't need to copy any data to the buffer since the USB packets are directly written to the frame buffer.
-		// We just need to update head and available count to signal to the consumer that a new frame is available
-		head = (head + 1) % num_frames;
-		available++;
+			// Signal consumer that data became available
+			empty_condition.notify_one();
 
-		// Determine the next frame pointer that the producer should write to
-		new_frame = frame_buffer + head * frame_size;
+			fd = notify_fd[1];
+		}
 
-		// Signal consumer that data became available
-		empty_condition.notify_one();
+		// Wake any event loop waiting on the notification fd; done outside the lock, as it is a system call
+		if (fd >= 0)
+			Notify(fd);
 
 		return new_frame;
 	}
 
-	struct timeval Dequeue(uint8_t* new_frame, int frame_width, int frame_height, PS3EYECam::EOutputFormat outputFormat)
+	// Number of frames that can be dequeued without blocking
+	uint32_t Available()
+	{
+		std::lock_guard<std::mutex> lock(mutex);
+		return held ? available - 1 : available;
+	}
+
+	// A file descriptor that becomes readable whenever a frame is enqueued, for waiting on frames with select/poll or an event loop.
+	// Created on first use; an eventfd on Linux, a pipe on other POSIX systems, and unsupported (-1) on Windows.
+	// Readiness only means that frames may be available (check Available()); the waiter must drain the fd by reading it.
+	int GetNotifyFd()
+	{
+		std::lock_guard<std::mutex> lock(mutex);
+#if defined(__linux__)
+		if (notify_fd[0] < 0)
+			notify_fd[0] = notify_fd[1] = eventfd(0, EFD_NONBLOCK | EFD_CLOEXEC);
+#elif !defined(_WIN32)
+		if (notify_fd[0] < 0 && pipe(notify_fd) == 0)
+		{
+			for (int i = 0; i < 2; ++i)
+			{
+				fcntl(notify_fd[i], F_SETFL, fcntl(notify_fd[i], F_GETFL) | O_NONBLOCK);
+				fcntl(notify_fd[i], F_SETFD, FD_CLOEXEC);
+			}
+		}
+#endif
+		return notify_fd[0];
+	}
+
+	// Decode the oldest available frame into new_frame. If deadline is not NULL, gives up once it has passed without a frame becoming available, and returns false, as it does once the queue is closing,
+	// or if a frame is held (see Acquire), as that frame is the oldest
+	bool Dequeue(uint8_t* new_frame, int frame_width, int frame_height, PS3EYECam::EOutputFormat outputFormat, const FrameReduction& reduction, FrameInfo* info,
+				 struct timeval* timestamp, const std::chrono::steady_clock::time_point* deadline = NULL)
 	{		
-		std::unique_lock<std::mutex> lock(mutex);
+		// Consumers are serialized among themselves, but not against the producer
+		std::lock_guard<std::mutex> consumer_lock(consumer_mutex);
 
-		// If there is no data in the buffer, wait until data becomes available
-		empty_condition.wait(lock, [this] () { return available != 0; });
+		uint8_t* source;
+		{
+			std::unique_lock<std::mutex> lock(mutex);
 
-        gettimeofday(&timestamp,NULL);
+			// If there is no data in the buffer, wait until data becomes available
+			if (held || !Wait(lock, deadline))
+				return false;
+			SkipToLatest();
 
-		// Copy from internal buffer
-		uint8_t* source = frame_buffer + frame_size * tail;
+			gettimeofday(timestamp,NULL);
 
-		if (outputFormat == PS3EYECam::EOutputFormat::Bayer)
-		{
-			memcpy(new_frame, source, frame_size);
+			if (info)
+				*info = frame_info[tail];
+
+			source = frame_buffer + frame_size * tail;
+			reading = true;
 		}
-		else if (outputFormat == PS3EYECam::EOutputFormat::BGR ||
-				 outputFormat == PS3EYECam::EOutputFormat::RGB)
-		{
-			DebayerRGB(frame_width, frame_height, source, new_frame, outputFormat == PS3EYECam::EOutputFormat::BGR);
-		}		
-		else if (outputFormat == PS3EYECam::EOutputFormat::Gray)
+
+		// Decode without holding the lock, so the USB thread can keep enqueueing meanwhile.
+		// This is safe because the producer never writes to a slot holding an available frame (see Enqueue).
+		Decode(source, new_frame, frame_width, frame_height, outputFormat, reduction, scratch);
+
 		{
-			DebayerGray(frame_width, frame_height, source, new_frame);
+			std::lock_guard<std::mutex> lock(mutex);
+
+			// Update tail and available count
+			tail = (tail + 1) % num_frames;
+			available--;
+			reading = false;
 		}
-		// Update tail and available count
-		tail = (tail + 1) % num_frames;
-		available--;
 
-        return timestamp;
+        return true;
 	}
-	
-	void DebayerGray(int frame_width, int frame_height, const uint8_t* inBayer, uint8_t* outBuffer)
-	{
-		// PSMove output is in the following Bayer format (GRBG):
-		//
-		// G R G R G R
-		// B G B G B G
-		// G R G R G R
-		// B G B G B G
-		//
-		// This is the normal Bayer pattern shifted left one place.
-		
-		int				source_stride	= frame_width;
-		const uint8_t*	source_row		= inBayer;						// Start at first bayer pixel
-		int				dest_stride		= frame_width;
-		uint8_t*		dest_row		= outBuffer + dest_stride + 1; 	// We start outputting at the second pixel of the second row's G component
-		uint32_t R,G,B;
-		
-		// Fill rows 1 to height-1 of the destination buffer. First and last row are filled separately (they are copied from the second row and second-to-last rows respectively)
-		for (int y = 0; y < frame_height-1; source_row += source_stride, dest_row += dest_stride, ++y)
-		{
-			const uint8_t* source		= source_row;
-			const uint8_t* source_end	= source + (source_stride-2);								// -2 to deal with the fact that we're starting at the second pixel of the row and should end at the second-to-last pixel of the row (first and last are filled separately)
-			uint8_t* dest				= dest_row;
-			
-			// Row starting with Green
-			if (y % 2 == 0)
-			{
-				// Fill first pixel (green)
-				B = (source[source_stride] + source[source_stride + 2] + 1) >> 1;
-				G = source[source_stride + 1];
-				R = (source[1] + source[source_stride * 2 + 1] + 1) >> 1;
-				*dest = (uint8_t)((R*77 + G*151 + B*28)>>8);
-				
-				source++;
-				dest++;
-				
-				// Fill remaining pixel
-				for (; source <= source_end - 2; source += 2, dest += 2)
-				{
-					// Blue pixel
-					B = source[source_stride + 1];
-					G = (source[1] + source[source_stride] + source[source_stride + 2] + source[source_stride * 2 + 1] + 2) >> 2;
-					R = (source[0] + source[2] + source[source_stride * 2] + source[source_stride * 2 + 2] + 2) >> 2;
-					dest[0] = (uint8_t)((R*77 + G*151 + B*28)>>8);
-
-					//  Green pixel
-					B = (source[source_stride + 1] + source[source_stride + 3] + 1) >> 1;
-					G = source[source_stride + 2];
-					R = (source[2] + source[source_stride * 2 + 2] + 1) >> 1;
-					dest[1] = (uint8_t)((R*77 + G*151 + B*28)>>8);
-
-				}
-			}
-			else
-			{
-				for (; source <= source_end - 2; source += 2, dest += 2)
-				{
-					// Red pixel
-					B = (source[0] + source[2] + source[source_stride * 2] + source[source_stride * 2 + 2] + 2) >> 2;;
-					G = (source[1] + source[source_stride] + source[source_stride + 2] + source[source_stride * 2 + 1] + 2) >> 2;;
-					R = source[source_stride + 1];
-					dest[0] = (uint8_t)((R*77 + G*151 + B*28)>>8);
-
-					// Green pixel
-					B = (source[2] + source[source_stride * 2 + 2] + 1) >> 1;
-					G = source[source_stride + 2];
-					R = (source[source_stride + 1] + source[source_stride + 3] + 1) >> 1;
-					dest[1] = (uint8_t)((R*77 + G*151 + B*28)>>8);
-				}
-			}
-			
-			if (source < source_end)
-			{
-				B = source[source_stride + 1];
-				G = (source[1] + source[source_stride] + source[source_stride + 2] + source[source_stride * 2 + 1] + 2) >> 2;
-				R = (source[0] + source[2] + source[source_stride * 2] + source[source_stride * 2 + 2] + 2) >> 2;;
-				dest[0] = (uint8_t)((R*77 + G*151 + B*28)>>8);
 
-				source++;
-				dest++;
-			}
-			
-			// Fill first pixel of row (copy second pixel)
-			uint8_t* first_pixel	= dest_row-1;
-			first_pixel[0]			= dest_row[0];
-			
-			// Fill last pixel of row (copy second-to-last pixel). Note: dest row starts at the *second* pixel of the row, so dest_row + (width-2) * num_output_channels puts us at the last pixel of the row
-			uint8_t* last_pixel				= dest_row + (frame_width - 2);
-			uint8_t* second_to_last_pixel	= last_pixel - 1;
-			last_pixel[0]					= second_to_last_pixel[0];
+	// Decode the region of interest of a raw frame, and bin it; scratch holds the decoded region when it is binned
+	static void Decode(const uint8_t* source, uint8_t* new_frame, int frame_width, int frame_height, PS3EYECam::EOutputFormat outputFormat,
+					   const FrameReduction& reduction, std::vector<uint8_t>& scratch)
+	{
+		const int x = reduction.x, y = reduction.y, w = reduction.width, h = reduction.height;
+		const bool half = outputFormat == PS3EYECam::EOutputFormat::RGBHalf || outputFormat == PS3EYECam::EOutputFormat::BGRHalf;
+		const bool colour = half || outputFormat == PS3EYECam::EOutputFormat::RGB || outputFormat == PS3EYECam::EOutputFormat::BGR;
+		const int decoded_width = half ? w / 2 : w;
+		const int decoded_height = half ? h / 2 : h;
+		const int channels = colour ? 3 : 1;
+
+		uint8_t* decoded = new_frame;
+		if (reduction.binning > 1)
+		{
+			scratch.resize(decoded_width * decoded_height * channels);
+			decoded = scratch.data();
 		}
-		
-		// Fill first & last row
-		for (int i = 0; i < dest_stride; i++)
+
+		switch (outputFormat)
 		{
-			outBuffer[i]									= outBuffer[i + dest_stride];
-			outBuffer[i + (frame_height - 1)*dest_stride]	= outBuffer[i + (frame_height - 2)*dest_stride];
+		case PS3EYECam::EOutputFormat::Bayer:
+			debayer::bayer(source, frame_width, frame_height, decoded, x, y, w, h);
+			break;
+		case PS3EYECam::EOutputFormat::BGR:
+		case PS3EYECam::EOutputFormat::RGB:
+			debayer::rgb(source, frame_width, frame_height, decoded, outputFormat == PS3EYECam::EOutputFormat::BGR, x, y, w, h);
+			break;
+		case PS3EYECam::EOutputFormat::Gray:
+			debayer::gray(source, frame_width, frame_height, decoded, x, y, w, h);
+			break;
+		case PS3EYECam::EOutputFormat::BGRHalf:
+		case PS3EYECam::EOutputFormat::RGBHalf:
+			debayer::rgb_half(source, frame_width, frame_height, decoded, outputFormat == PS3EYECam::EOutputFormat::BGRHalf, x, y, w, h);
+			break;
+		case PS3EYECam::EOutputFormat::Green:
+			debayer::green(source, frame_width, frame_height, decoded, x, y, w, h);
+			break;
 		}
+
+		if (outputFormat == PS3EYECam::EOutputFormat::Bayer && reduction.binning == 2)
+			debayer::bin_mosaic<2>(decoded, decoded_width, decoded_height, new_frame);
+		else if (outputFormat == PS3EYECam::EOutputFormat::Bayer && reduction.binning == 4)
+			debayer::bin_mosaic<4>(decoded, decoded_width, decoded_height, new_frame);
+		else if (reduction.binning == 2)
+			debayer::bin<2>(decoded, decoded_width, decoded_height, channels, new_frame);
+		else if (reduction.binning == 4)
+			debayer::bin<4>(decoded, decoded_width, decoded_height, channels, new_frame);
 	}
 
-	void DebayerRGB(int frame_width, int frame_height, const uint8_t* inBayer, uint8_t* outBuffer, bool inBGR)
+	// Hand out the oldest available frame in place, without copying it.
+	// The slot stays valid (the producer never writes to a slot holding an available frame) until Release() is called.
+	// Only one slot may be held at a time; returns NULL if one is already held, or if the queue is closing.
+	uint8_t* Acquire(struct timeval* timestamp, FrameInfo* info)
 	{
-		// PSMove output is in the following Bayer format (GRBG):
-		//
-		// G R G R G R
-		// B G B G B G
-		// G R G R G R
-		// B G B G B G
-		//
-		// This is the normal Bayer pattern shifted left one place.
+		// serialized with Dequeue, so that the two never take the same frame; the slot is then marked held, which Dequeue respects until Release
+		std::lock_guard<std::mutex> consumer_lock(consumer_mutex);
+		std::unique_lock<std::mutex> lock(mutex);
 
-		int				num_output_channels	    = 3;
-		int				source_stride			= frame_width;
-		const uint8_t*	source_row				= inBayer;												// Start at first bayer pixel
-		int				dest_stride				= frame_width * num_output_channels;
-		uint8_t*		dest_row				= outBuffer + dest_stride + num_output_channels + 1; 	// We start outputting at the second pixel of the second row's G component
-		int				swap_br					= inBGR ? 1 : -1;
+		if (held)
+			return NULL;
 
-		// Fill rows 1 to height-1 of the destination buffer. First and last row are filled separately (they are copied from the second row and second-to-last rows respectively)
-		for (int y = 0; y < frame_height-1; source_row += source_stride, dest_row += dest_stride, ++y)
-		{
-			const uint8_t* source		= source_row;
-			const uint8_t* source_end	= source + (source_stride-2);								// -2 to deal with the fact that we're starting at the second pixel of the row and should end at the second-to-last pixel of the row (first and last are filled separately)
-			uint8_t* dest				= dest_row;		
+		if (!Wait(lock))
+			return NULL;
+		SkipToLatest();
 
-			// Row starting with Green
-			if (y % 2 == 0)
-			{
-				// Fill first pixel (green)
-				dest[-1*swap_br]	= (source[source_stride] + source[source_stride + 2] + 1) >> 1;
-				dest[0]				= source[source_stride + 1];
-				dest[1*swap_br]		= (source[1] + source[source_stride * 2 + 1] + 1) >> 1;		
+        gettimeofday(timestamp,NULL);
+		if (info)
+			*info = frame_info[tail];
+		held = true;
 
-				source++;
-				dest += num_output_channels;
+		return frame_buffer + frame_size * tail;
+	}
 
-				// Fill remaining pixel
-				for (; source <= source_end - 2; source += 2, dest += num_output_channels * 2)
-				{
-					// Blue pixel
-					uint8_t* cur_pixel	= dest;
-					cur_pixel[-1*swap_br]	= source[source_stride + 1];
-					cur_pixel[0]			= (source[1] + source[source_stride] + source[source_stride + 2] + source[source_stride * 2 + 1] + 2) >> 2;
-					cur_pixel[1*swap_br]	= (source[0] + source[2] + source[source_stride * 2] + source[source_stride * 2 + 2] + 2) >> 2;				
-
-					//  Green pixel
-					uint8_t* next_pixel		= cur_pixel+num_output_channels;
-					next_pixel[-1*swap_br]	= (source[source_stride + 1] + source[source_stride + 3] + 1) >> 1;					
-					next_pixel[0]			= source[source_stride + 2];
-					next_pixel[1*swap_br]	= (source[2] + source[source_stride * 2 + 2] + 1) >> 1;
-				}
-			}
-			else
-			{
-				for (; source <= source_end - 2; source += 2, dest += num_output_channels * 2)
-				{
-					// Red pixel
-					uint8_t* cur_pixel	= dest;
-					cur_pixel[-1*swap_br]	= (source[0] + source[2] + source[source_stride * 2] + source[source_stride * 2 + 2] + 2) >> 2;;
-					cur_pixel[0]			= (source[1] + source[source_stride] + source[source_stride + 2] + source[source_stride * 2 + 1] + 2) >> 2;;
-					cur_pixel[1*swap_br]	= source[source_stride + 1];
-
-					// Green pixel
-					uint8_t* next_pixel		= cur_pixel+num_output_channels;
-					next_pixel[-1*swap_br]	= (source[2] + source[source_stride * 2 + 2] + 1) >> 1;
-					next_pixel[0]			= source[source_stride + 2];
-					next_pixel[1*swap_br]	= (source[source_stride + 1] + source[source_stride + 3] + 1) >> 1;
-				}
-			}
+	// Give a slot obtained with Acquire() back to the producer
+	void Release()
+	{
+		std::lock_guard<std::mutex> lock(mutex);
 
-			if (source < source_end)
-			{
-				dest[-1*swap_br]	= source[source_stride + 1];
-				dest[0]				= (source[1] + source[source_stride] + source[source_stride + 2] + source[source_stride * 2 + 1] + 2) >> 2;			
-				dest[1*swap_br]		= (source[0] + source[2] + source[source_stride * 2] + source[source_stride * 2 + 2] + 2) >> 2;;			
+		if (!held)
+			return;
 
-				source++;
-				dest += num_output_channels;
-			}
+		tail = (tail + 1) % num_frames;
+		available--;
+		held = false;
+	}
 
-			// Fill first pixel of row (copy second pixel)
-			uint8_t* first_pixel		= dest_row-num_output_channels;
-			first_pixel[-1*swap_br]		= dest_row[-1*swap_br];
-			first_pixel[0]				= dest_row[0];
-			first_pixel[1*swap_br]		= dest_row[1*swap_br];
-		
- 			// Fill last pixel of row (copy second-to-last pixel). Note: dest row starts at the *second* pixel of the row, so dest_row + (width-2) * num_output_channels puts us at the last pixel of the row
-			uint8_t* last_pixel				= dest_row + (frame_width - 2)*num_output_channels;
-			uint8_t* second_to_last_pixel	= last_pixel - num_output_channels;
-			
-			last_pixel[-1*swap_br]			= second_to_last_pixel[-1*swap_br];
-			last_pixel[0]					= second_to_last_pixel[0];
-			last_pixel[1*swap_br]			= second_to_last_pixel[1*swap_br];
-		}
+	// Block until the next frame is completed by the producer (whether or not a consumer gets to see it), or the timeout expires; false on timeout, or if the queue is closing
+	bool WaitNextFrame(uint32_t timeout_ms)
+	{
+		std::unique_lock<std::mutex> lock(mutex);
 
-		// Fill first & last row
-		for (int i = 0; i < dest_stride; i++)
+		uint64_t seq = next_seq;
+		boundary_waiters++;
+		frame_condition.wait_for(lock, std::chrono::milliseconds(timeout_ms), [&] () { return next_seq != seq || closing; });
+		boundary_waiters--;
+		return next_seq != seq && !closing;
+	}
+
+	uint32_t GetFrameSize() const { return frame_size; }
+
+	void SetPolicy(PS3EYECam::EFramePolicy new_policy)
+	{
+		std::lock_guard<std::mutex> lock(mutex);
+		policy = new_policy;
+	}
+
+private:
+	// Wait (with the lock held) until a frame is available, and record how long that took; the clock is only read if there is a wait.
+	// With a deadline, false if it passes first; false as well once the queue is closing (nothing is recorded then)
+	bool Wait(std::unique_lock<std::mutex>& lock, const std::chrono::steady_clock::time_point* deadline = NULL)
+	{
+		uint64_t wait_us = 0;
+		if (closing)
+			return false;
+		if (available == 0)
 		{
-			outBuffer[i]									= outBuffer[i + dest_stride];
-			outBuffer[i + (frame_height - 1)*dest_stride]	= outBuffer[i + (frame_height - 2)*dest_stride];
+			std::chrono::steady_clock::time_point start = std::chrono::steady_clock::now();
+			if (!deadline)
+				empty_condition.wait(lock, [this] () { return available != 0 || closing; });
+			else if (!empty_condition.wait_until(lock, *deadline, [this] () { return available != 0 || closing; }))
+				return false;
+			if (closing)
+				return false;
+			wait_us = std::chrono::duration_cast<std::chrono::microseconds>(std::chrono::steady_clock::now() - start).count();
 		}
+		counters.add_dequeue(wait_us);
+		return true;
+	}
+
+	// Under the Latest policy, pass over (with the lock held) all available frames but the newest
+	void SkipToLatest()
+	{
+		if (policy != PS3EYECam::EFramePolicy::Latest || available <= 1)
+			return;
+		CaptureCounters::bump(counters.frames_skipped, available - 1);
+		tail = (tail + available - 1) % num_frames;
+		available = 1;
+	}
+
+	static void Notify(int fd)
+	{
+#if defined(__linux__)
+		uint64_t one = 1;
+		ssize_t res = write(fd, &one, sizeof(one));
+		(void)res;
+#elif !defined(_WIN32)
+		// a full pipe is fine: the reader has not drained the earlier wake-ups yet
+		uint8_t one = 1;
+		ssize_t res = write(fd, &one, sizeof(one));
+		(void)res;
+#endif
 	}
 
-private:
 	uint32_t				frame_size;
 	uint32_t				num_frames;
 
 	uint8_t*				frame_buffer;
+	FrameInfo*				frame_info;
 	uint32_t				head;
 	uint32_t				tail;
 	uint32_t				available;
-    
-    struct timeval          timestamp;
+	bool					held;
+	bool					reading;			// a consumer is decoding the frame at tail, without the lock
+	bool					closing;			// set by Interrupt(): consumers return without a frame
+	uint32_t				users;				// consumers between Enter() and Leave()
+	uint64_t				next_seq;
+	CaptureCounters&		counters;
+	uint32_t				decimation;
+	PS3EYECam::EFramePolicy	policy;
+	std::vector<uint8_t>	scratch;			// decoded frames before binning, used under consumer_mutex
 
 	std::mutex				mutex;
+	std::mutex				consumer_mutex;
 	std::condition_variable	empty_condition;
+	std::condition_variable	frame_condition;	// signalled at each completed frame, but only while someone waits for one
+	std::condition_variable	idle_condition;		// signalled when the last user leaves a closing queue
+	uint32_t				boundary_waiters;
+
+	int						notify_fd[2];		// read and write ends of the notification fd (the same fd for an eventfd)
 };
 
 // URBDesc
@@ -773,11 +1065,15 @@ public:
 		last_packet_type		(DISCARD_PACKET), 
 		last_pts				(0), 
 		last_fid				(0), 
+		cur_frame_pts			(0),
+		last_arrival_us			(0),
 		transfer_buffer			(NULL),
 		cur_frame_start			(NULL),
 		cur_frame_data_len		(0),
 		frame_size				(0),
-		frame_queue				(NULL)
+		frame_queue				(NULL),
+		decimation				(1),
+		frame_policy			(PS3EYECam::EFramePolicy::Fifo)
 	{
 	}
 
@@ -787,40 +1083,84 @@ public:
 		close_transfers();
 	}
 
-	bool start_transfers(libusb_device_handle *handle, uint32_t curr_frame_size)
+	// Set up the frame queue that completed frames go to
+	void start_queue(uint32_t curr_frame_size, uint32_t queue_depth)
 	{
-		// Initialize the frame queue
         frame_size = curr_frame_size;
-		frame_queue = new FrameQueue(frame_size);
+		FrameQueue* queue = new FrameQueue(frame_size, queue_depth, counters, decimation, frame_policy);
+		{
+			std::lock_guard<std::mutex> lock(queue_mutex);
+			frame_queue = queue;
+		}
 
 		// Initialize the current frame pointer to the start of the buffer; it will be updated as frames are completed and pushed onto the frame queue
 		cur_frame_start = frame_queue->GetFrameBufferStart();
 		cur_frame_data_len = 0;
 
+		last_packet_type = DISCARD_PACKET;
+		last_pts = 0;
+		last_fid = 0;
+		last_arrival_us = 0;	// the pause since a previous stop is not an inter-arrival interval
+	}
+
+	// The frame queue, registered as in use by a consumer (see FrameQueue::Enter), or NULL if there is none or it is closing; the consumer must call Leave() on it when done
+	FrameQueue* enter_queue()
+	{
+		std::lock_guard<std::mutex> lock(queue_mutex);
+		return frame_queue && frame_queue->Enter() ? frame_queue : NULL;
+	}
+
+	// Make consumers waiting for frames return without one, without freeing the queue
+	void interrupt_queue()
+	{
+		std::lock_guard<std::mutex> lock(queue_mutex);
+		if (frame_queue)
+			frame_queue->Interrupt();
+	}
+
+	void stop_queue()
+	{
+		FrameQueue* queue;
+		{
+			std::lock_guard<std::mutex> lock(queue_mutex);
+			queue = frame_queue;
+			frame_queue = NULL;
+		}
+		// consumers still waiting in the queue are woken, and the queue is freed once the last one has left it
+		if (queue)
+		{
+			queue->Close();
+			delete queue;
+		}
+	}
+
+	bool start_transfers(libusb_device_handle *handle, uint32_t curr_frame_size, uint32_t queue_depth, const USBConfig& config, std::shared_ptr<USBEventThread> event_thread)
+	{
+		start_queue(curr_frame_size, queue_depth);
+
 		// Find the bulk transfer endpoint
 		uint8_t bulk_endpoint = find_ep(libusb_get_device(handle));
 		libusb_clear_halt(handle, bulk_endpoint);
 
 		// Allocate the transfer buffer
-		transfer_buffer = (uint8_t*)malloc(TRANSFER_SIZE * NUM_TRANSFERS);
-		memset(transfer_buffer, 0, TRANSFER_SIZE * NUM_TRANSFERS);
+		transfer_buffer = (uint8_t*)malloc(config.transfer_size * config.num_transfers);
+		memset(transfer_buffer, 0, config.transfer_size * config.num_transfers);
 
 		int res = 0;
-		for (int index = 0; index < NUM_TRANSFERS; ++index)
+		xfr.resize(config.num_transfers);
+		for (uint32_t index = 0; index < config.num_transfers; ++index)
 		{
 			// Create & submit the transfer
 			xfr[index] = libusb_alloc_transfer(0);
-			libusb_fill_bulk_transfer(xfr[index], handle, bulk_endpoint, transfer_buffer + index * TRANSFER_SIZE, TRANSFER_SIZE, transfer_completed_callback, reinterpret_cast<void*>(this), 0);
+			libusb_fill_bulk_transfer(xfr[index], handle, bulk_endpoint, transfer_buffer + index * config.transfer_size, config.transfer_size, transfer_completed_callback, reinterpret_cast<void*>(this), 0);
 
 			res |= libusb_submit_transfer(xfr[index]);
 			
 			num_active_transfers++;
 		}
 
-		last_pts = 0;
-		last_fid = 0;
-
-		USBMgr::instance()->cameraStarted();
+		events = event_thread;
+		events->cameraStarted();
 
 		return res == 0;
 	}
@@ -832,7 +1172,7 @@ public:
 			return;
 
 		// Cancel any pending transfers
-		for (int index = 0; index < NUM_TRANSFERS; ++index)
+		for (size_t index = 0; index < xfr.size(); ++index)
 		{
 			libusb_cancel_transfer(xfr[index]);
 		}
@@ -840,13 +1180,21 @@ public:
 		// Wait for cancelation to finish
 		num_active_transfers_condition.wait(lock, [this]() { return num_active_transfers == 0; });
 
-		USBMgr::instance()->cameraStopped();
+		events->cameraStopped();
+		events.reset();
 
 		free(transfer_buffer);
 		transfer_buffer = NULL;
 
-		delete frame_queue;
-		frame_queue = NULL;
+		stop_queue();
+	}
+
+	// Process the data of a completed bulk transfer
+	void transfer_completed(uint8_t *data, int len)
+	{
+		CaptureCounters::bump(counters.transfers);
+		CaptureCounters::bump(counters.bytes, len);
+		pkt_scan(data, len);
 	}
 
 	void transfer_canceled()
@@ -892,11 +1240,22 @@ public:
             }
 	    }
 
+	    /* a frame in progress is being thrown away */
+	    if (packet_type == DISCARD_PACKET && last_packet_type != DISCARD_PACKET) {
+	        CaptureCounters::bump(counters.frames_discarded);
+	    }
+
 	    last_packet_type = packet_type;
 
 	    if (packet_type == LAST_PACKET) {        
+			struct timeval arrival;
+			gettimeofday(&arrival, NULL);
+			uint64_t arrival_us = (uint64_t)arrival.tv_sec * 1000000 + arrival.tv_usec;
+			if (last_arrival_us != 0 && arrival_us >= last_arrival_us)
+				counters.add_interval(arrival_us - last_arrival_us);
+			last_arrival_us = arrival_us;
 			cur_frame_data_len = 0;
-			cur_frame_start = frame_queue->Enqueue();
+			cur_frame_start = frame_queue->Enqueue(arrival, cur_frame_pts);
 	        //debug("frame completed %d\n", frame_complete_ind);
 	    }
 	}
@@ -920,18 +1279,21 @@ public:
 	        /* Verify UVC header.  Header length is always 12 */
 	        if (data[0] != 12 || len < 12) {
 	            debug("bad header\n");
+	            CaptureCounters::bump(counters.bad_headers);
 	            goto discard;
 	        }
 
 	        /* Check errors */
 	        if (data[1] & UVC_STREAM_ERR) {
 	            debug("payload error\n");
+	            CaptureCounters::bump(counters.payload_errors);
 	            goto discard;
 	        }
 
 	        /* Extract PTS and FID */
 	        if (!(data[1] & UVC_STREAM_PTS)) {
 	            debug("PTS not present\n");
+	            CaptureCounters::bump(counters.bad_headers);
 	            goto discard;
 	        }
 
@@ -947,6 +1309,7 @@ public:
 	            }
 	            last_pts = this_pts;
 	            last_fid = this_fid;
+	            cur_frame_pts = this_pts;
 	            frame_add(FIRST_PACKET, data + 12, len - 12);
 	        } /* If this packet is marked as EOF, end the frame */
 	        else if (data[1] & UVC_STREAM_EOF) 
@@ -982,13 +1345,33 @@ public:
 	enum gspca_packet_type	last_packet_type;
 	uint32_t				last_pts;
 	uint16_t				last_fid;
-	libusb_transfer*		xfr[NUM_TRANSFERS];
+	uint32_t				cur_frame_pts;
+	uint64_t				last_arrival_us;
+	CaptureCounters			counters;
+	std::vector<libusb_transfer*> xfr;
+	std::shared_ptr<USBEventThread> events;
 
 	uint8_t*				transfer_buffer;
     uint8_t*				cur_frame_start;
 	uint32_t				cur_frame_data_len;
 	uint32_t				frame_size;
 	FrameQueue*				frame_queue;
+	std::mutex				queue_mutex;		// guards frame_queue against consumers (see enter_queue) while it is stopped
+	uint32_t				decimation;			// of the frame queue, set before it starts
+	PS3EYECam::EFramePolicy	frame_policy;		// likewise
+};
+
+// Use of the frame queue by a consumer, for the lifetime of this object; converts to false if there is no queue or it is closing
+class QueueUse
+{
+public:
+	QueueUse(URBDesc& urb) : queue(urb.enter_queue()) {}
+	~QueueUse() { if (queue) queue->Leave(); }
+	FrameQueue* operator->() const { return queue; }
+	explicit operator bool() const { return queue != NULL; }
+
+private:
+	FrameQueue* queue;
 };
 
 static void LIBUSB_CALL transfer_completed_callback(struct libusb_transfer *xfr)
@@ -999,6 +1382,8 @@ static void LIBUSB_CALL transfer_completed_callback(struct libusb_transfer *xfr)
     if (status != LIBUSB_TRANSFER_COMPLETED) 
     {
         debug("transfer status %d\n", status);
+        if (status != LIBUSB_TRANSFER_CANCELLED)
+            CaptureCounters::bump(urb->counters.transfer_errors);
 
         libusb_free_transfer(xfr);
 		urb->transfer_canceled();
@@ -1012,14 +1397,197 @@ static void LIBUSB_CALL transfer_completed_callback(struct libusb_transfer *xfr)
 
     //debug("length:%u, actual_length:%u\n", xfr->length, xfr->actual_length);
 
-    urb->pkt_scan(xfr->buffer, xfr->actual_length);
+    urb->transfer_completed(xfr->buffer, xfr->actual_length);
 
     if (libusb_submit_transfer(xfr) < 0) {
         debug("error re-submitting URB\n");
+        CaptureCounters::bump(urb->counters.transfer_errors);
         urb->close_transfers();
     }
 }
 
+// Simulator
+
+// Stands in for the hardware of a simulated camera: shadows the bridge and sensor registers, and generates the UVC bulk payloads
+// of its frames on a thread of its own, delivering them as completed transfers, as the USB event thread would
+class Simulator
+{
+public:
+	Simulator(const SimulationConfig& config, int index) :
+		config				(config),
+		rng					(config.seed + index),
+		index				(index),
+		urb					(NULL),
+		running				(false)
+	{
+		if (config.frames)
+		{
+			replay.assign(config.frames, config.frames + (size_t)config.n_frames * config.width * config.height);
+			this->config.frames = NULL;
+		}
+
+		memset(bridge_regs, 0, sizeof(bridge_regs));
+		memset(sensor_regs, 0, sizeof(sensor_regs));
+		// sensor id, as probed by init
+		sensor_regs[0x0a] = 0x77;
+		sensor_regs[0x0b] = 0x21;
+	}
+
+	~Simulator()
+	{
+		stop();
+	}
+
+	int getIndex() const { return index; }
+
+	// Replayed frames fix the resolution
+	bool supports(uint32_t width, uint32_t height) const
+	{
+		return replay.empty() || (width == config.width && height == config.height);
+	}
+
+	// The bridge relays sensor (SCCB) accesses through its registers; status 0x00 means success
+	void writeRegister(uint16_t reg, uint8_t val)
+	{
+		std::lock_guard<std::mutex> lock(regs_mutex);
+		bridge_regs[reg & 0xff] = val;
+		if (reg == OV534_REG_OPERATION)
+		{
+			uint8_t subaddr = bridge_regs[OV534_REG_SUBADDR];
+			if (val == OV534_OP_WRITE_3)
+				sensor_regs[subaddr] = bridge_regs[OV534_REG_WRITE];
+			else if (val == OV534_OP_READ_2)
+				bridge_regs[OV534_REG_READ] = sensor_regs[subaddr];
+			bridge_regs[OV534_REG_STATUS] = 0x00;
+		}
+	}
+
+	uint8_t readRegister(uint16_t reg)
+	{
+		std::lock_guard<std::mutex> lock(regs_mutex);
+		return bridge_regs[reg & 0xff];
+	}
+
+	void start(URBDesc* target, uint32_t width, uint32_t height, uint16_t fps, uint32_t transfer_size)
+	{
+		stop();
+		urb = target;
+		frame_width = width;
+		frame_height = height;
+		frame_rate = fps;
+		transfer_buffer.resize(transfer_size);
+
+		if (replay.empty())
+		{
+			// a static diagonal gradient; the frame number is written into its first bytes (see generate)
+			pattern.resize(width * height);
+			for (uint32_t y = 0; y < height; ++y)
+				for (uint32_t x = 0; x < width; ++x)
+					pattern[y * width + x] = (uint8_t)(x + y);
+		}
+
+		running = true;
+		thread = std::thread(&Simulator::run, this);
+	}
+
+	void stop()
+	{
+		if (!thread.joinable())
+			return;
+		running = false;
+		thread.join();
+	}
+
+private:
+	// The payload data of frame n: replayed, or the pattern stamped with n (little-endian, 8 bytes)
+	const uint8_t* generate(uint64_t n)
+	{
+		size_t frame_size = (size_t)frame_width * frame_height;
+		if (!replay.empty())
+			return &replay[(n % config.n_frames) * frame_size];
+		for (int i = 0; i < 8; ++i)
+			pattern[i] = (uint8_t)(n >> (8 * i));
+		return &pattern[0];
+	}
+
+	void run()
+	{
+		SetThreadName("PS3EyeDriver Simulator Thread");
+
+		const uint32_t payload_data = USBConfig::PAYLOAD_SIZE - 12;
+		const uint32_t frame_size = frame_width * frame_height;
+		std::uniform_real_distribution<double> uniform(0.0, 1.0);
+		std::normal_distribution<double> normal(0.0, config.jitter > 0 ? config.jitter : 1.0);
+
+		std::chrono::steady_clock::time_point t0 = std::chrono::steady_clock::now();
+		std::chrono::duration<double> period(1.0 / frame_rate);
+		uint32_t fid = 0;
+
+		for (uint64_t n = 0; running; ++n)
+		{
+			// a frame is delivered when its last payload arrives
+			double offset = config.jitter > 0 ? normal(rng) : 0.0;
+			std::chrono::duration<double> due = period * (double)(n + 1) + std::chrono::duration<double>((std::max)(offset, -0.9 * period.count()));
+			std::this_thread::sleep_until(t0 + std::chrono::duration_cast<std::chrono::steady_clock::duration>(due));
+			if (!running)
+				break;
+
+			const uint8_t* data = generate(n);
+			uint32_t pts = (uint32_t)(n * 1000000 / frame_rate);
+			fid ^= 1;
+
+			// Split the frame into payloads with a UVC header, packed into transfers as the camera does;
+			// a transfer completes when it is full, or with the short final payload of the frame
+			uint32_t len = 0;
+			for (uint32_t pos = 0; pos < frame_size; pos += payload_data)
+			{
+				uint32_t chunk = (std::min)(payload_data, frame_size - pos);
+				bool last = pos + chunk == frame_size;
+
+				if (config.loss > 0 && uniform(rng) < config.loss)
+					continue;
+
+				uint8_t* payload = &transfer_buffer[len];
+				payload[0] = 12;
+				payload[1] = UVC_STREAM_EOH | UVC_STREAM_PTS | (last ? UVC_STREAM_EOF : 0) | fid;
+				payload[2] = (uint8_t)pts;
+				payload[3] = (uint8_t)(pts >> 8);
+				payload[4] = (uint8_t)(pts >> 16);
+				payload[5] = (uint8_t)(pts >> 24);
+				memset(payload + 6, 0, 6);
+				memcpy(payload + 12, data + pos, chunk);
+				len += 12 + chunk;
+
+				if (len == transfer_buffer.size() || last)
+				{
+					urb->transfer_completed(&transfer_buffer[0], len);
+					len = 0;
+				}
+			}
+			if (len > 0)
+				urb->transfer_completed(&transfer_buffer[0], len);
+		}
+	}
+
+	SimulationConfig		config;
+	std::vector<uint8_t>	replay;
+	std::vector<uint8_t>	pattern;
+	std::vector<uint8_t>	transfer_buffer;
+	std::mt19937			rng;
+	int						index;
+
+	URBDesc*				urb;
+	uint32_t				frame_width;
+	uint32_t				frame_height;
+	uint16_t				frame_rate;
+	std::thread				thread;
+	std::atomic_bool		running;
+
+	std::mutex				regs_mutex;
+	uint8_t					bridge_regs[256];
+	uint8_t					sensor_regs[256];
+};
+
 // PS3EYECam
 
 bool PS3EYECam::devicesEnumerated = false;
@@ -1043,7 +1611,38 @@ const std::vector<PS3EYECam::PS3EYERef>& PS3EYECam::getDevices( bool forceRefres
 
 PS3EYECam::PS3EYECam(libusb_device *device)
 {
-	// default controls
+	set_defaults();
+
+	device_ = device;
+	mgrPtr = USBMgr::instance();
+}
+
+PS3EYECam::PS3EYECam(const SimulationConfig& simulation, int index)
+{
+	set_defaults();
+
+	device_ = NULL;
+	simulator = std::make_shared<Simulator>(simulation, index);
+}
+
+void PS3EYECam::set_defaults()
+{
+	frame_queue_depth = 2;
+	frame_policy = EFramePolicy::Fifo;
+
+	set_default_controls();
+
+	usb_buf = NULL;
+	handle_ = NULL;
+	open_device_ = NULL;
+
+	is_streaming = false;
+
+	urb = std::shared_ptr<URBDesc>( new URBDesc() );
+}
+
+void PS3EYECam::set_default_controls()
+{
 	autogain = false;
 	gain = 20;
 	exposure = 128;
@@ -1058,15 +1657,6 @@ PS3EYECam::PS3EYECam(libusb_device *device)
 	greenblc = 128;
     flip_h = false;
     flip_v = false;
-
-	usb_buf = NULL;
-	handle_ = NULL;
-
-	is_streaming = false;
-
-	device_ = device;
-	mgrPtr = USBMgr::instance();
-	urb = std::shared_ptr<URBDesc>( new URBDesc() );
 }
 
 PS3EYECam::~PS3EYECam()
@@ -1080,9 +1670,23 @@ void PS3EYECam::release()
 	if(handle_ != NULL) 
 		close_usb();
 	if(usb_buf) free(usb_buf);
+	usb_buf = NULL;
+	// referenced by USBMgr::listDevices
+	if(device_ != NULL)
+		libusb_unref_device(device_);
+	device_ = NULL;
+}
+
+void PS3EYECam::close()
+{
+	stop();
+	if(handle_ != NULL)
+		close_usb();
+	set_default_controls();
+	reduction = FrameReduction();
 }
 
-bool PS3EYECam::init(uint32_t width, uint32_t height, uint16_t desiredFrameRate, EOutputFormat outputFormat)
+bool PS3EYECam::init(uint32_t width, uint32_t height, uint16_t desiredFrameRate, EOutputFormat outputFormat, uint32_t queueDepth)
 {
 	uint16_t sensor_id;
 
@@ -1110,8 +1714,15 @@ bool PS3EYECam::init(uint32_t width, uint32_t height, uint16_t desiredFrameRate,
 	}
 	frame_rate = ov534_set_frame_rate(desiredFrameRate, true);
 	frame_output_format = outputFormat;
+	frame_queue_depth = queueDepth;
 	//
 
+	if (simulator && !simulator->supports(frame_width, frame_height))
+	{
+		debug("replayed frames do not match the resolution\n");
+		return false;
+	}
+
 	/* reset bridge */
 	ov534_reg_write(0xe7, 0x3a);
 	ov534_reg_write(0xe0, 0x08);
@@ -1183,7 +1794,15 @@ void PS3EYECam::start()
 	ov534_reg_write(0xe0, 0x00); // start stream
 
 	// init and start urb
-	urb->start_transfers(handle_, frame_width*frame_height);
+	urb->decimation = reduction.decimation;
+	urb->frame_policy = frame_policy;
+	if (simulator)
+	{
+		urb->start_queue(frame_width*frame_height, frame_queue_depth);
+		simulator->start(urb.get(), frame_width, frame_height, frame_rate, usb_config.transfer_size);
+	}
+	else
+		urb->start_transfers(handle_, frame_width*frame_height, frame_queue_depth, usb_config, events);
     is_streaming = true;
 }
 
@@ -1196,7 +1815,13 @@ void PS3EYECam::stop()
 	ov534_set_led(0);
     
 	// close urb
-	urb->close_transfers();
+	if (simulator)
+	{
+		simulator->stop();
+		urb->stop_queue();
+	}
+	else
+		urb->close_transfers();
 
     is_streaming = false;
 }
@@ -1207,7 +1832,14 @@ bool PS3EYECam::getUSBPortPath(char *out_identifier, size_t max_identifier_lengt
 {
     bool success = false;
 
-    if (isInitialized())
+    if (simulator)
+    {
+        snprintf(out_identifier, max_identifier_length, "sim%d", simulator->getIndex());
+        return true;
+    }
+
+    // known from enumeration, before the device is opened
+    if (device_ != NULL)
     {
         uint8_t port_numbers[MAX_USB_DEVICE_PORT_PATH];
 
@@ -1228,7 +1860,7 @@ bool PS3EYECam::getUSBPortPath(char *out_identifier, size_t max_identifier_lengt
                 char port_string[8];
 
                 snprintf(port_string, sizeof(port_string), (port_index == 0) ? "_p%d" : ".%d", port_number);
-                port_string[sizeof(port_string) - 1] = '0';
+                port_string[sizeof(port_string) - 1] = '\0';
                 
                 if (strlen(out_identifier)+strlen(port_string)+1 <= max_identifier_length)
                 {
@@ -1256,20 +1888,168 @@ uint32_t PS3EYECam::getOutputBytesPerPixel() const
 		return 3;
 	else if (frame_output_format == EOutputFormat::Gray)
 		return 1;
+	else if (frame_output_format == EOutputFormat::RGBHalf)
+		return 3;
+	else if (frame_output_format == EOutputFormat::BGRHalf)
+		return 3;
+	else if (frame_output_format == EOutputFormat::Green)
+		return 1;
 	return 0;
 }
 
-struct timeval PS3EYECam::getFrame(uint8_t* frame)
+bool PS3EYECam::isHalfResolutionFormat() const
+{
+	return frame_output_format == EOutputFormat::RGBHalf || frame_output_format == EOutputFormat::BGRHalf;
+}
+
+struct timeval PS3EYECam::getFrame(uint8_t* frame, FrameInfo* info)
+{
+	struct timeval timestamp = {0, 0};
+	QueueUse queue(*urb);
+	if (queue && !queue->Dequeue(frame, frame_width, frame_height, frame_output_format, getFrameReduction(), info, &timestamp))
+		timestamp.tv_sec = timestamp.tv_usec = 0;
+	return timestamp;
+}
+
+uint32_t PS3EYECam::getFrames(uint8_t* frames, uint32_t count, struct timeval* timestamps, FrameInfo* infos, const std::chrono::steady_clock::time_point* deadline)
+{
+	// the reduction and frame size are looked up once for the whole batch
+	const FrameReduction frame_reduction = getFrameReduction();
+	const size_t frame_bytes = (size_t)getRowBytes() * getOutputHeight();
+	QueueUse queue(*urb);
+	if (!queue)
+		return 0;
+	for (uint32_t i = 0; i < count; ++i)
+	{
+		if (!queue->Dequeue(frames + i * frame_bytes, frame_width, frame_height, frame_output_format, frame_reduction, infos ? &infos[i] : NULL,
+									   &timestamps[i], deadline))
+			return i;
+	}
+	return count;
+}
+
+const uint8_t* PS3EYECam::acquireRawFrame(struct timeval* timestamp, FrameInfo* info)
+{
+	QueueUse queue(*urb);
+	return queue ? queue->Acquire(timestamp, info) : NULL;
+}
+
+void PS3EYECam::decodeFrame(const uint8_t* bayer, uint32_t width, uint32_t height, uint8_t* frame, EOutputFormat outputFormat)
 {
-	return urb->frame_queue->Dequeue(frame, frame_width, frame_height, frame_output_format);
+	FrameReduction whole;
+	whole.width = width;
+	whole.height = height;
+	std::vector<uint8_t> unused;
+	FrameQueue::Decode(bayer, frame, width, height, outputFormat, whole, unused);
+}
+
+bool PS3EYECam::setFrameReduction(const FrameReduction& val)
+{
+	if (is_streaming)
+		return false;
+
+	uint32_t width = val.width ? val.width : frame_width - (std::min)(val.x, frame_width);
+	uint32_t height = val.height ? val.height : frame_height - (std::min)(val.y, frame_height);
+	if (val.binning != 1 && val.binning != 2 && val.binning != 4)
+		return false;
+	if (val.x % 2 || val.y % 2 || width == 0 || height == 0 || width % (2 * val.binning) || height % (2 * val.binning))
+		return false;
+	if (val.x + width > frame_width || val.y + height > frame_height || val.decimation < 1)
+		return false;
+
+	reduction = val;
+	return true;
+}
+
+FrameReduction PS3EYECam::getFrameReduction() const
+{
+	FrameReduction val = reduction;
+	if (!val.width)
+		val.width = frame_width - val.x;
+	if (!val.height)
+		val.height = frame_height - val.y;
+	return val;
+}
+
+uint32_t PS3EYECam::getFramesAvailable() const
+{
+	QueueUse queue(*urb);
+	return queue ? queue->Available() : 0;
+}
+
+int PS3EYECam::getFrameNotifyFd()
+{
+	QueueUse queue(*urb);
+	return queue ? queue->GetNotifyFd() : -1;
+}
+
+bool PS3EYECam::waitFrameBoundary(uint32_t timeout_ms)
+{
+	QueueUse queue(*urb);
+	return is_streaming && queue ? queue->WaitNextFrame(timeout_ms) : false;
+}
+
+uint64_t PS3EYECam::getFramesOverwritten() const
+{
+	return urb->counters.frames_overwritten.load(std::memory_order_relaxed);
+}
+
+uint64_t PS3EYECam::getFramesDiscarded() const
+{
+	return urb->counters.frames_discarded.load(std::memory_order_relaxed);
+}
+
+void PS3EYECam::getCaptureStats(CaptureStats* stats) const
+{
+	urb->counters.snapshot(stats);
+}
+
+void PS3EYECam::setFramePolicy(EFramePolicy policy)
+{
+	frame_policy = policy;
+	QueueUse queue(*urb);
+	if (queue)
+		queue->SetPolicy(policy);
+}
+
+void PS3EYECam::releaseRawFrame()
+{
+	// a frame held when the queue is closed goes with it
+	QueueUse queue(*urb);
+	if (queue)
+		queue->Release();
+}
+
+void PS3EYECam::interrupt()
+{
+	urb->interrupt_queue();
 }
 
 bool PS3EYECam::open_usb()
 {
+	if (simulator)
+		return true;
+
+	// cameras with a dedicated event thread are opened in its own libusb context
+	events = mgrPtr->getEventThread(usb_config, device_);
+	if (!events)
+		return false;
+	open_device_ = device_;
+	if (usb_config.event_thread != USBConfig::EventThread::Shared)
+	{
+		open_device_ = events->findDevice(device_);
+		if (!open_device_) {
+			debug("device not found in event thread context\n");
+			events.reset();
+			return false;
+		}
+	}
+
 	// open, set first config and claim interface
-	int res = libusb_open(device_, &handle_);
+	int res = libusb_open(open_device_, &handle_);
 	if(res != 0) {
 		debug("device open error: %d\n", res);
+		release_event_thread();
 		return false;
 	}
 
@@ -1278,6 +2058,9 @@ bool PS3EYECam::open_usb()
 	res = libusb_claim_interface(handle_, 0);
 	if(res != 0) {
 		debug("device claim interface error: %d\n", res);
+		libusb_close(handle_);
+		handle_ = NULL;
+		release_event_thread();
 		return false;
 	}
 
@@ -1288,14 +2071,29 @@ void PS3EYECam::close_usb()
 {
 	debug("closing device\n");
 	libusb_release_interface(handle_, 0);
-	libusb_close(handle_);
 	libusb_attach_kernel_driver(handle_,0);
-	libusb_unref_device(device_);
+	libusb_close(handle_);
+	release_event_thread();
 	handle_ = NULL;
-	device_ = NULL;
 	debug("device closed\n");
 }
 
+void PS3EYECam::release_event_thread()
+{
+	if (open_device_ && open_device_ != device_)
+		libusb_unref_device(open_device_);
+	open_device_ = NULL;
+	events.reset();
+}
+
+bool PS3EYECam::setUSBConfig(const USBConfig& config)
+{
+	if (handle_ != NULL || !config.isValid())
+		return false;
+	usb_config = config;
+	return true;
+}
+
 /* Two bits control LED: 0x21 bit 7 and 0x23 bit 7.
  * (direction and output)? */
 void PS3EYECam::ov534_set_led(int status)
@@ -1403,6 +2201,11 @@ void PS3EYECam::ov534_reg_write(uint16_t reg, uint8_t val)
 	int ret;
 
 	//debug("reg=0x%04x, val=0%02x", reg, val);
+	if (simulator)
+	{
+		simulator->writeRegister(reg, val);
+		return;
+	}
 	usb_buf[0] = val;
 
   	ret = libusb_control_transfer(handle_,
@@ -1419,6 +2222,9 @@ uint8_t PS3EYECam::ov534_reg_read(uint16_t reg)
 {
 	int ret;
 
+	if (simulator)
+		return simulator->readRegister(reg);
+
 	ret = libusb_control_transfer(handle_,
 							LIBUSB_ENDPOINT_IN|LIBUSB_REQUEST_TYPE_VENDOR|LIBUSB_RECIPIENT_DEVICE, 
 							0x01, 0x00, reg,
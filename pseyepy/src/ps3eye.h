@@ -9,6 +9,7 @@
 #include <math.h>
 
 #include <memory>
+#include <chrono>
 
 // Get rid of annoying zero length structure warnings from libusb.h in MSVC
 
@@ -36,6 +37,89 @@
 
 namespace ps3eye {
 
+// Capture-side metadata of a frame, recorded when its last USB packet arrives
+struct FrameInfo
+{
+	struct timeval arrival;		// host time at which the last packet of the frame was received
+	uint32_t pts;				// UVC presentation timestamp of the frame, in camera clock ticks
+	uint64_t seq;				// per-camera sequence number, incremented for every completed frame; gaps indicate dropped frames
+};
+
+// Snapshot of the counters kept by a camera's capture path since it was opened (see PS3EYECam::getCaptureStats)
+struct CaptureStats
+{
+	static const int INTERVAL_BINS = 256;		// number of bins of the inter-arrival histogram
+	static const int INTERVAL_BIN_US = 250;		// width of a bin, in microseconds; the last bin also holds all longer intervals
+
+	uint64_t transfers;				// USB bulk transfers completed
+	uint64_t transfer_errors;		// USB bulk transfers that failed, or could not be resubmitted
+	uint64_t bytes;					// bytes received, including payload headers
+	uint64_t bad_headers;			// payloads with an invalid UVC header (wrong length, or no PTS)
+	uint64_t payload_errors;		// payloads flagged with an error by the camera
+	uint64_t frames_completed;		// complete frames handed to the ring buffer
+	uint64_t frames_discarded;		// incomplete or corrupt frames dropped by the packet parser
+	uint64_t frames_overwritten;	// completed frames dropped because the ring buffer was full
+	uint64_t frames_skipped;		// completed frames passed over for a newer one, under EFramePolicy::Latest
+	uint64_t dequeues;				// frames taken from the ring buffer by getFrame / acquireRawFrame
+	uint64_t dequeue_wait_us;		// total time spent by those calls waiting for a frame to arrive
+	uint64_t dequeue_wait_max_us;	// longest such wait
+	uint64_t intervals;				// number of inter-arrival intervals measured (between consecutive completed frames)
+	uint64_t interval_sum_us;		// sum of those intervals
+	uint64_t interval_sumsq_us;		// sum of their squares (us^2)
+	uint64_t interval_hist[INTERVAL_BINS];
+};
+
+// How a camera's USB bulk transfers are set up and serviced (see PS3EYECam::setUSBConfig)
+struct USBConfig
+{
+	enum class EventThread
+	{
+		Shared,					// a single thread handles the transfers of all cameras opened this way (the default)
+		PerBus,					// one thread per USB bus, shared by the cameras opened this way on that bus
+		PerCamera				// a thread for this camera alone
+	};
+
+	static const uint32_t PAYLOAD_SIZE = 2048;	// size of the camera's UVC payloads; transfers hold whole payloads
+	static const uint32_t MAX_TRANSFERS = 64;
+
+	uint32_t	num_transfers	= 5;			// bulk transfers kept in flight
+	uint32_t	transfer_size	= 65536;		// bytes per transfer, a multiple of PAYLOAD_SIZE
+	EventThread	event_thread	= EventThread::Shared;
+	int			cpu				= -1;			// CPU to pin the event thread to when it starts (Linux and Windows), or -1 to leave it unpinned
+
+	bool isValid() const
+	{
+		return num_transfers >= 1 && num_transfers <= MAX_TRANSFERS && transfer_size >= PAYLOAD_SIZE && transfer_size % PAYLOAD_SIZE == 0;
+	}
+};
+
+// Reduction of the frames returned by getFrame, applied as they are decoded, so that the output is only as large as what is kept (see PS3EYECam::setFrameReduction).
+// Frames held with acquireRawFrame are not affected.
+struct FrameReduction
+{
+	uint32_t	x			= 0;		// region of interest in sensor pixels: position and size, all even (in the half-resolution formats, the output is half its size)
+	uint32_t	y			= 0;
+	uint32_t	width		= 0;		// 0 for the whole frame
+	uint32_t	height		= 0;
+	uint32_t	binning		= 1;		// 1, 2 or 4: each binning x binning block of output pixels is averaged into one; the Bayer format averages the pixels of each colour, so the output is still a GRBG mosaic
+	uint32_t	decimation	= 1;		// keep only every decimation-th frame, those whose seq is a multiple of it; the others are not queued
+
+	static const uint32_t MAX_BINNING = 4;
+};
+
+// Settings of a simulated camera, which needs no hardware: it generates the camera's UVC bulk payloads itself, at the configured frame rate,
+// and feeds them through the same packet parser and frame queue as the data of a real camera
+struct SimulationConfig
+{
+	double			loss		= 0;		// probability that a USB payload is lost (which makes the parser discard its frame)
+	double			jitter		= 0;		// standard deviation of the frame timing, in seconds
+	const uint8_t*	frames		= NULL;		// raw Bayer frames to replay in a loop (copied), or NULL for a synthetic pattern
+	uint32_t		n_frames	= 0;
+	uint32_t		width		= 0;		// size of the replayed frames; the camera can only be opened at this resolution
+	uint32_t		height		= 0;
+	uint32_t		seed		= 0;		// seed of the random loss and jitter
+};
+
 class PS3EYECam
 {
 public:
@@ -44,7 +128,17 @@ public:
 		Bayer,					// Output in Bayer. Destination buffer must be width * height bytes
 		BGR,					// Output in BGR. Destination buffer must be width * height * 3 bytes
 		RGB	,					// Output in RGB. Destination buffer must be width * height * 3 bytes
-		Gray					// Output in Grayscale. Destination buffer must be width * height bytes
+		Gray,					// Output in Grayscale. Destination buffer must be width * height bytes
+		RGBHalf,				// Output in half-resolution RGB, one pixel per 2x2 Bayer cell. Destination buffer must be (width/2) * (height/2) * 3 bytes
+		BGRHalf,				// Output in half-resolution BGR, one pixel per 2x2 Bayer cell. Destination buffer must be (width/2) * (height/2) * 3 bytes
+		Green					// Output the interpolated green channel only, a cheap grayscale. Destination buffer must be width * height bytes
+	};
+
+	// Which of the frames in the ring buffer getFrame / acquireRawFrame hand out (see setFramePolicy)
+	enum class EFramePolicy
+	{
+		Fifo,					// The oldest: every frame is seen if the consumer keeps up; when the ring is full, the newest frames are dropped (counted as overwritten)
+		Latest					// The newest: older frames are skipped, and when the ring is full, the oldest are dropped (both counted as skipped), for minimum latency
 	};
 
 	typedef std::shared_ptr<PS3EYECam> PS3EYERef;
@@ -53,11 +147,21 @@ public:
 	static const uint16_t PRODUCT_ID;
 
 	PS3EYECam(libusb_device *device);
+	PS3EYECam(const SimulationConfig& simulation, int index);	// a simulated camera; index tells it apart from the others
 	~PS3EYECam();
 
-	bool init(uint32_t width = 0, uint32_t height = 0, uint16_t desiredFrameRate = 30, EOutputFormat outputFormat = EOutputFormat::BGR);
+	bool isSimulated() const { return simulator != NULL; }
+
+	bool init(uint32_t width = 0, uint32_t height = 0, uint16_t desiredFrameRate = 30, EOutputFormat outputFormat = EOutputFormat::BGR, uint32_t queueDepth = 2);
+
+	// Set up the USB transfers and their event thread; only possible before init. Returns false if the camera is already open or the config is invalid.
+	// Cameras with their own event thread (PerBus, PerCamera) are opened through a libusb context of their own, so that they do not contend with the others for event handling.
+	bool setUSBConfig(const USBConfig& config);
+	const USBConfig& getUSBConfig() const { return usb_config; }
 	void start();
 	void stop();
+	// Stop, and close the USB device, so that other processes can open it; the camera object can be opened again with init, and starts over with the default controls
+	void close();
 
 	// Controls
 
@@ -109,24 +213,7 @@ public:
 	uint8_t getGain() const { return gain; }
 	void setGain(uint8_t val) {
 	    gain = val;
-	    switch(val & 0x30){
-		case 0x00:
-		    val &=0x0F;
-		    break;
-		case 0x10:
-		    val &=0x0F;
-		    val |=0x30;
-		    break;
-		case 0x20:
-		    val &=0x0F;
-		    val |=0x70;
-		    break;
-		case 0x30:
-		    val &=0x0F;
-		    val |=0xF0;
-		    break;
-	    }
-	    sccb_reg_write(0x00, val);
+	    sccb_reg_write(0x00, gainRegister(val));
 	}
 	uint8_t getExposure() const { return exposure; }
 	void setExposure(uint8_t val) {
@@ -199,17 +286,77 @@ public:
         if (!vertical) val |= 0x80;
         sccb_reg_write(0x0c, val);
 	}
-    
+
+
+	// Read-back of the controls: read the sensor registers holding a control and compare them with the value last set.
+	// True if they agree; a control that an automatic mode currently owns is not compared. Each check costs one or two USB control transfers.
+	bool checkAutogain() { return ((sccb_reg_read(0x13) & 0x04) != 0) == autogain; }
+	bool checkAutoWhiteBalance() { return ((sccb_reg_read(0x13) & 0x02) != 0) == awb; }
+	bool checkAutoExposure() { return ((sccb_reg_read(0x13) & 0x01) != 0) == aex; }
+	bool checkGain() { return autogain || aex || sccb_reg_read(0x00) == gainRegister(gain); }
+	bool checkExposure() { return aex || (sccb_reg_read(0x08) == (uint8_t)(exposure >> 7) && sccb_reg_read(0x10) == (uint8_t)(exposure << 1)); }
+	bool checkSharpness() { return sccb_reg_read(0x91) == sharpness && sccb_reg_read(0x8E) == sharpness; }
+	bool checkContrast() { return sccb_reg_read(0x9C) == contrast; }
+	bool checkBrightness() { return sccb_reg_read(0x9B) == brightness; }
+	bool checkHue() { return sccb_reg_read(0x01) == hue; }
+	bool checkRedBalance() { return awb || sccb_reg_read(0x43) == redblc; }
+	bool checkBlueBalance() { return awb || sccb_reg_read(0x42) == blueblc; }
+	bool checkGreenBalance() { return awb || sccb_reg_read(0x44) == greenblc; }
+	bool checkFlip() { return (sccb_reg_read(0x0c) & 0xc0) == ((flip_h ? 0 : 0x40) | (flip_v ? 0 : 0x80)); }
+
+	// Crop, bin and decimate the frames returned by getFrame. Only possible between init and start; returns false if the camera is streaming,
+	// or if the region of interest is not inside the frame, or if its size is not a multiple of 2 * binning
+	bool setFrameReduction(const FrameReduction& reduction);
+	// the reduction in effect, with the size of the region of interest filled in
+	FrameReduction getFrameReduction() const;
+
+	// Block until the camera completes its next frame, e.g. to change settings between frames rather than during one. False on timeout, or if the camera is not streaming
+	bool waitFrameBoundary(uint32_t timeout_ms);
 
     bool isStreaming() const { return is_streaming; }
-    bool isInitialized() const { return device_ != NULL && handle_ != NULL && usb_buf != NULL; }
+    bool isInitialized() const { return (isSimulated() || (device_ != NULL && handle_ != NULL)) && usb_buf != NULL; }
 
 	bool getUSBPortPath(char *out_identifier, size_t max_identifier_length) const;
 	
 	// Get a frame from the camera. Notes:
-	// - If there is no frame available, this function will block until one is
+	// - If there is no frame available, this function will block until one is, or until interrupt() is called or the camera stops, returning a zero timestamp
 	// - The output buffer must be sized correctly, depending out the output format. See EOutputFormat.
-	struct timeval getFrame(uint8_t* frame);
+	// - If info is not NULL, the capture-side metadata of the frame is written to it
+	struct timeval getFrame(uint8_t* frame, FrameInfo* info = NULL);
+	// Get count consecutive frames, one after the other in frames, each with its timestamp (and metadata, if infos is not NULL).
+	// If deadline is not NULL, stops once it has passed while waiting for a frame. Returns the number of frames gotten
+	uint32_t getFrames(uint8_t* frames, uint32_t count, struct timeval* timestamps, FrameInfo* infos = NULL, const std::chrono::steady_clock::time_point* deadline = NULL);
+
+	// Zero-copy access to the raw Bayer frames in the driver's ring buffer. Notes:
+	// - acquireRawFrame blocks like getFrame, and returns NULL if a frame is already held
+	// - the returned pointer (width * height bytes) is valid until releaseRawFrame is called
+	// - while a frame is held, getFrame must not be called
+	const uint8_t* acquireRawFrame(struct timeval* timestamp, FrameInfo* info = NULL);
+	void releaseRawFrame();
+	uint32_t getQueueDepth() const { return frame_queue_depth; }
+
+	// Make the calls waiting for frames (getFrame, getFrames, acquireRawFrame, waitFrameBoundary) return without one, as do any made until the camera stops; used before stopping a camera that other threads may be reading
+	void interrupt();
+
+	// Choose between the oldest and the newest frame in the ring buffer; takes effect immediately, also while streaming
+	void setFramePolicy(EFramePolicy policy);
+	EFramePolicy getFramePolicy() const { return frame_policy; }
+
+	// Waiting for frames without blocking a thread:
+	// - getFramesAvailable returns the number of frames that getFrame can return without blocking
+	// - getFrameNotifyFd returns a file descriptor that becomes readable whenever a frame arrives (for select/poll or an event loop); it must be drained by reading it, and is closed with the camera. Returns -1 where unsupported (Windows)
+	uint32_t getFramesAvailable() const;
+	int getFrameNotifyFd();
+
+	// Convert a raw Bayer frame to the given output format, as getFrame does
+	static void decodeFrame(const uint8_t* bayer, uint32_t width, uint32_t height, uint8_t* frame, EOutputFormat outputFormat);
+
+	// Frames lost so far: completed frames overwritten because the ring buffer was full, and incomplete or corrupt frames discarded by the packet parser
+	uint64_t getFramesOverwritten() const;
+	uint64_t getFramesDiscarded() const;
+
+	// Capture-path counters, read without locking; cheap enough to poll continuously
+	void getCaptureStats(CaptureStats* stats) const;
 
 	uint32_t getWidth() const { return frame_width; }
 	uint32_t getHeight() const { return frame_height; }
@@ -219,8 +366,11 @@ public:
 		frame_rate = ov534_set_frame_rate(val, true);
 		return true;
 	}
-	uint32_t getRowBytes() const { return frame_width * getOutputBytesPerPixel(); }
+	uint32_t getOutputWidth() const { return (isHalfResolutionFormat() ? getFrameReduction().width / 2 : getFrameReduction().width) / reduction.binning; }
+	uint32_t getOutputHeight() const { return (isHalfResolutionFormat() ? getFrameReduction().height / 2 : getFrameReduction().height) / reduction.binning; }
+	uint32_t getRowBytes() const { return getOutputWidth() * getOutputBytesPerPixel(); }
 	uint32_t getOutputBytesPerPixel() const;
+	bool isHalfResolutionFormat() const;
 
 	//
 	static const std::vector<PS3EYERef>& getDevices( bool forceRefresh = false );
@@ -239,6 +389,27 @@ private:
 	int sccb_check_status();
 	void sccb_reg_write(uint8_t reg, uint8_t val);
 	uint8_t sccb_reg_read(uint16_t reg);
+	// value of the gain register (0x00) for a gain of 0-63
+	static uint8_t gainRegister(uint8_t val) {
+	    switch(val & 0x30){
+		case 0x00:
+		    val &=0x0F;
+		    break;
+		case 0x10:
+		    val &=0x0F;
+		    val |=0x30;
+		    break;
+		case 0x20:
+		    val &=0x0F;
+		    val |=0x70;
+		    break;
+		case 0x30:
+		    val &=0x0F;
+		    val |=0xF0;
+		    break;
+	    }
+	    return val;
+	}
 	void reg_w_array(const uint8_t (*data)[2], int len);
 	void sccb_w_array(const uint8_t (*data)[2], int len);
 
@@ -269,16 +440,28 @@ private:
 	uint32_t frame_height;
 	uint16_t frame_rate;
 	EOutputFormat frame_output_format;
+	uint32_t frame_queue_depth;
+	EFramePolicy frame_policy;
 
 	//usb stuff
 	libusb_device *device_;
+	libusb_device *open_device_;		// device_, or its counterpart in the context of a dedicated event thread
 	libusb_device_handle *handle_;
 	uint8_t *usb_buf;
+	USBConfig usb_config;
+	std::shared_ptr<class USBEventThread> events;
+
+	FrameReduction reduction;
 
 	std::shared_ptr<class URBDesc> urb;
+	std::shared_ptr<class Simulator> simulator;
+	int simulator_index;
 
+	void set_defaults();
+	void set_default_controls();
 	bool open_usb();
 	void close_usb();
+	void release_event_thread();
 
 };
 
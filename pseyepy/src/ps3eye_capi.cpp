@@ -30,63 +30,182 @@
 #include "ps3eye_capi.h"
 #include "ps3eye.h"
 
+#include <algorithm>
+#include <condition_variable>
+#include <deque>
+#include <functional>
 #include <list>
 #include <map>
+#include <memory>
+#include <mutex>
 #include <iostream>
+#include <thread>
 
 struct ps3eye_context_t {
     ps3eye_context_t()
-        : devices(ps3eye::PS3EYECam::getDevices(true)) // true for forceRefresh
+        : devices(ps3eye::PS3EYECam::getDevices()) // enumerated once per process; see ps3eye_rescan
         , opened_devices()
     {
     }
 
+    ps3eye_context_t(int count, const ps3eye::SimulationConfig &simulation)
+        : devices()
+        , opened_devices()
+    {
+        for (int i = 0; i < count; ++i) {
+            devices.push_back(std::make_shared<ps3eye::PS3EYECam>(simulation, i));
+        }
+    }
+
     ~ps3eye_context_t()
     {
     }
 
     // Global context
     std::vector<ps3eye::PS3EYECam::PS3EYERef> devices;
-    std::map<int, ps3eye_t *> opened_devices;
+    std::map<int, std::shared_ptr<ps3eye_t>> opened_devices;
+    std::mutex opened_mutex;    // for cameras opened and closed while others are looked up, e.g. by ps3eye_open_many
 };
 
 static ps3eye_context_t *
 ps3eye_context = NULL;
 
-struct timeval timestamp;
-
 struct ps3eye_t {
-    ps3eye_t(int id, ps3eye::PS3EYECam::PS3EYERef eye, int width, int height, int fps, ps3eye_format outputFormat)
+    ps3eye_t(int id, ps3eye::PS3EYECam::PS3EYERef eye)
         : eye(eye)
+        , id(id)
+        , stopping(false)
+        , submitted(0)
+        , completed(0)
     {
-        eye->init(width, height, (uint8_t)fps, (ps3eye::PS3EYECam::EOutputFormat)outputFormat);
         eye->start();
-        ps3eye_context->opened_devices[id] = this;
     }
 
     ~ps3eye_t()
     {
-        eye->stop();
-        ps3eye_context->opened_devices.erase(id);
+        // the device itself is released by ps3eye_close; this only outlives it for calls that looked the camera up before
+        {
+            std::lock_guard<std::mutex> lock(jobs_mutex);
+            stopping = true;
+        }
+        jobs_changed.notify_all();
+        if (worker.joinable()) {
+            worker.join();
+        }
+    }
+
+    // Run job on the worker thread of the camera, after those submitted before it.
+    // Returns the ticket to wait() on for it to complete.
+    uint64_t submit(std::function<void()> job)
+    {
+        std::lock_guard<std::mutex> lock(jobs_mutex);
+        if (!worker.joinable()) {
+            worker = std::thread(&ps3eye_t::work, this);
+        }
+        jobs.push_back(std::move(job));
+        jobs_changed.notify_all();
+        return ++submitted;
+    }
+
+    void wait(uint64_t ticket)
+    {
+        std::unique_lock<std::mutex> lock(jobs_mutex);
+        jobs_changed.wait(lock, [this, ticket]() { return completed >= ticket; });
     }
 
     // Per-device context
     ps3eye::PS3EYECam::PS3EYERef eye;
     int id;
+    std::mutex control;     // serializes parameter changes, some of which read-modify-write registers
+
+private:
+    void work()
+    {
+        std::unique_lock<std::mutex> lock(jobs_mutex);
+        while (true) {
+            jobs_changed.wait(lock, [this]() { return stopping || !jobs.empty(); });
+            if (jobs.empty()) {
+                return;
+            }
+            std::function<void()> job = std::move(jobs.front());
+            jobs.pop_front();
+            lock.unlock();
+            job();
+            lock.lock();
+            ++completed;
+            jobs_changed.notify_all();
+        }
+    }
+
+    // the calls waiting on this camera for the multi-camera functions, started on first use and kept while the
+    // camera is open, so that several cameras can be waited on at once without starting threads on every call
+    std::thread worker;
+    std::mutex jobs_mutex;
+    std::condition_variable jobs_changed;
+    std::deque<std::function<void()>> jobs;
+    bool stopping;
+    uint64_t submitted;
+    uint64_t completed;
 };
 
-ps3eye_t *
+// an open camera; held for the duration of a call, so that closing it meanwhile does not free it
+typedef std::shared_ptr<ps3eye_t> ps3eye_ref;
+
+ps3eye_ref
 id2eye(int id)
 {
-    if (ps3eye_context->opened_devices.count(id) != 1)
-    {
+    if (!ps3eye_context) {
         return NULL;
     }
 
-    else
-    {
-        ps3eye_t *eye = ps3eye_context->opened_devices.at(id);
-        return eye;
+    std::lock_guard<std::mutex> lock(ps3eye_context->opened_mutex);
+    auto it = ps3eye_context->opened_devices.find(id);
+    if (it == ps3eye_context->opened_devices.end()) {
+        return NULL;
+    }
+    return it->second;
+}
+
+// the cameras of ids, looked up all at once; NULL for those that are not open
+static std::vector<ps3eye_ref>
+ids2eyes(int count, const int *ids)
+{
+    std::vector<ps3eye_ref> eyes(std::max(count, 0));
+    if (!ps3eye_context) {
+        return eyes;
+    }
+
+    std::lock_guard<std::mutex> lock(ps3eye_context->opened_mutex);
+    for (int i = 0; i < count; ++i) {
+        auto it = ps3eye_context->opened_devices.find(ids[i]);
+        if (it != ps3eye_context->opened_devices.end()) {
+            eyes[i] = it->second;
+        }
+    }
+    return eyes;
+}
+
+// Call job(i, eyes[i]) for all the cameras at once: each on the worker thread of its camera, but for the first
+// (and those not open) which are handled by the caller. Returns once all have completed.
+static void
+for_each_camera(const std::vector<ps3eye_ref> &eyes, const std::function<void(int, ps3eye_t *)> &job)
+{
+    std::vector<uint64_t> tickets(eyes.size(), 0);
+    for (size_t i = 1; i < eyes.size(); ++i) {
+        if (eyes[i]) {
+            tickets[i] = eyes[i]->submit([&job, &eyes, i]() { job((int)i, eyes[i].get()); });
+        }
+    }
+    for (size_t i = 0; i < eyes.size(); ++i) {
+        if (i == 0 || !eyes[i]) {
+            job((int)i, eyes[i].get());
+        }
+    }
+
+    for (size_t i = 1; i < eyes.size(); ++i) {
+        if (eyes[i]) {
+            eyes[i]->wait(tickets[i]);
+        }
     }
 }
 
@@ -99,6 +218,24 @@ ps3eye_init()
     }
 }
 
+void
+ps3eye_init_simulated(int count, const ps3eye_sim_config *config)
+{
+    if (!ps3eye_context) {
+        ps3eye::SimulationConfig simulation;
+        if (config) {
+            simulation.loss = config->loss;
+            simulation.jitter = config->jitter;
+            simulation.frames = config->frames;
+            simulation.n_frames = config->frames ? (uint32_t)config->n_frames : 0;
+            simulation.width = (uint32_t)config->width;
+            simulation.height = (uint32_t)config->height;
+            simulation.seed = config->seed;
+        }
+        ps3eye_context = new ps3eye_context_t(count, simulation);
+    }
+}
+
 void
 ps3eye_uninit()
 {
@@ -112,6 +249,15 @@ ps3eye_uninit()
     }
 }
 
+int
+ps3eye_rescan()
+{
+    if (ps3eye_context) {
+        return -1;
+    }
+    return (int)ps3eye::PS3EYECam::getDevices(true).size();
+}
+
 int
 ps3eye_count_connected()
 {
@@ -124,7 +270,8 @@ ps3eye_count_connected()
 }
 
 bool
-ps3eye_open(int id, int width, int height, int fps, ps3eye_format outputFormat)
+ps3eye_open(int id, int width, int height, int fps, ps3eye_format outputFormat, int queue_depth,
+            const ps3eye_usb_config *usb_config, const ps3eye_reduction *reduction)
 {
     if (!ps3eye_context) {
         // Library not initialized
@@ -136,30 +283,98 @@ ps3eye_open(int id, int width, int height, int fps, ps3eye_format outputFormat)
         return false;
     }
 
-    ps3eye_t *newCam = new ps3eye_t(id, ps3eye_context->devices[id], width, height, fps, outputFormat); // is stored in opened_devices
+    {
+        std::lock_guard<std::mutex> lock(ps3eye_context->opened_mutex);
+        if (ps3eye_context->opened_devices.count(id)) {
+            // Already open
+            return false;
+        }
+    }
+
+    ps3eye::PS3EYECam::PS3EYERef eye = ps3eye_context->devices[id];
+
+    if (usb_config) {
+        ps3eye::USBConfig config;
+        config.num_transfers = (uint32_t)usb_config->num_transfers;
+        config.transfer_size = (uint32_t)usb_config->transfer_size;
+        config.event_thread = (ps3eye::USBConfig::EventThread)usb_config->event_thread;
+        config.cpu = usb_config->cpu;
+        if (usb_config->num_transfers < 1 || usb_config->transfer_size < 1 || !config.isValid()) {
+            return false;
+        }
+        eye->setUSBConfig(config);
+    }
+
+    if (!eye->init(width, height, (uint8_t)fps, (ps3eye::PS3EYECam::EOutputFormat)outputFormat, (uint32_t)queue_depth)) {
+        eye->close();
+        return false;
+    }
+
+    if (reduction) {
+        ps3eye::FrameReduction config;
+        config.x = (uint32_t)std::max(reduction->x, 0);
+        config.y = (uint32_t)std::max(reduction->y, 0);
+        config.width = (uint32_t)std::max(reduction->width, 0);
+        config.height = (uint32_t)std::max(reduction->height, 0);
+        config.binning = (uint32_t)std::max(reduction->binning, 0);
+        config.decimation = (uint32_t)std::max(reduction->decimation, 0);
+        if (!eye->setFrameReduction(config)) {
+            eye->close();
+            return false;
+        }
+    }
+
+    std::shared_ptr<ps3eye_t> opened = std::make_shared<ps3eye_t>(id, eye);
+    std::lock_guard<std::mutex> lock(ps3eye_context->opened_mutex);
+    ps3eye_context->opened_devices[id] = opened;
 
     return true;
 }
 
+int
+ps3eye_open_many(int count, const ps3eye_open_config *configs, int *opened)
+{
+    auto open = [configs, opened](int i) {
+        const ps3eye_open_config &c = configs[i];
+        opened[i] = ps3eye_open(c.id, c.width, c.height, c.fps, c.format, c.queue_depth, &c.usb_config, &c.reduction) ? 1 : 0;
+    };
+
+    // every camera but the first is opened in its own thread; the first is handled by the caller
+    std::vector<std::thread> workers;
+    for (int i = 1; i < count; ++i) {
+        workers.emplace_back(open, i);
+    }
+    if (count > 0) {
+        open(0);
+    }
+
+    int n_opened = 0;
+    for (int i = 0; i < count; ++i) {
+        if (i > 0) {
+            workers[i - 1].join();
+        }
+        n_opened += opened[i];
+    }
+    return n_opened;
+}
+
 int
 ps3eye_get_unique_identifier(int id, char *out_identifier, int max_identifier_length)
 {
     
-    ps3eye_t *eye_t = id2eye(id);
-
     if (!ps3eye_context) 
     {
         // No context available
         return -1;
     }
     
-    if (!eye_t) 
+    if (id < 0 || id >= ps3eye_count_connected()) 
     {
-        // Eye is not a valid handle
+        // No such device
         return -1;
     }
 
-    bool success = eye_t->eye->getUSBPortPath(out_identifier, max_identifier_length);
+    bool success = ps3eye_context->devices[id]->getUSBPortPath(out_identifier, max_identifier_length);
 
     return success ? 0 : -1;
 }
@@ -170,38 +385,322 @@ uint64_t timeval2int(struct timeval ts)
     return ts.tv_sec*(uint64_t)1000000+ts.tv_usec;
 }
 
+void fill_frame_info(ps3eye_frame_info *info, struct timeval timestamp, const ps3eye::FrameInfo &frame_info)
+{
+    info->timestamp = timeval2int(timestamp);
+    info->arrival = timeval2int(frame_info.arrival);
+    info->pts = frame_info.pts;
+    info->seq = frame_info.seq;
+}
+
 uint64_t
 ps3eye_grab_frame(int id, unsigned char* frame)
 {
-    ps3eye_t *eye = id2eye(id);
+    ps3eye_ref eye = id2eye(id);
 
-    if (!ps3eye_context) {
-        // No context available
+    if (!eye) {
+        // Eye is not a valid handle
         return 0;
     }
 
+    struct timeval timestamp = eye->eye->getFrame(frame);
+
+    return timeval2int(timestamp); // timestamp is in microseconds
+}
+
+static uint64_t
+grab_frame_info(ps3eye_t *eye, unsigned char* frame, ps3eye_frame_info *info)
+{
     if (!eye) {
         // Eye is not a valid handle
         return 0;
     }
 
-	timestamp = eye->eye->getFrame(frame);
+    ps3eye::FrameInfo frame_info;
+    struct timeval timestamp = eye->eye->getFrame(frame, &frame_info);
+    if (info) {
+        fill_frame_info(info, timestamp, frame_info);
+    }
 
-    return timeval2int(timestamp); // timestamp is in microseconds
+    return timeval2int(timestamp);
+}
+
+uint64_t
+ps3eye_grab_frame_info(int id, unsigned char* frame, ps3eye_frame_info *info)
+{
+    return grab_frame_info(id2eye(id).get(), frame, info);
+}
+
+static void
+grab_frames(const std::vector<ps3eye_ref> &eyes, unsigned char **frames, ps3eye_frame_info *infos)
+{
+    for_each_camera(eyes, [frames, infos](int i, ps3eye_t *eye) { grab_frame_info(eye, frames[i], &infos[i]); });
+}
+
+void
+ps3eye_grab_frames(int count, const int *ids, unsigned char **frames, ps3eye_frame_info *infos)
+{
+    grab_frames(ids2eyes(count, ids), frames, infos);
+}
+
+uint64_t
+ps3eye_try_grab_frame(int id, unsigned char* frame, ps3eye_frame_info *info)
+{
+    ps3eye_ref eye = id2eye(id);
+
+    if (!eye) {
+        return 0;
+    }
+
+    // a deadline that has already passed: a frame is taken only if one is waiting
+    std::chrono::steady_clock::time_point now = std::chrono::steady_clock::now();
+    struct timeval timestamp;
+    ps3eye::FrameInfo frame_info;
+    if (!eye->eye->getFrames(frame, 1, &timestamp, &frame_info, &now)) {
+        return 0;
+    }
+    if (info) {
+        fill_frame_info(info, timestamp, frame_info);
+    }
+
+    return timeval2int(timestamp);
+}
+
+static int
+grab_batch(ps3eye_t *eye, int count, unsigned char *frames, ps3eye_frame_info *infos, const std::chrono::steady_clock::time_point *deadline)
+{
+    if (!eye || count <= 0) {
+        return 0;
+    }
+
+    std::vector<struct timeval> timestamps(count);
+    std::vector<ps3eye::FrameInfo> frame_infos(count);
+    int grabbed = (int)eye->eye->getFrames(frames, count, timestamps.data(), frame_infos.data(), deadline);
+    for (int i = 0; i < grabbed; ++i) {
+        fill_frame_info(&infos[i], timestamps[i], frame_infos[i]);
+    }
+    return grabbed;
+}
+
+int
+ps3eye_grab_batch(int id, int count, unsigned char *frames, ps3eye_frame_info *infos, uint64_t timeout_us)
+{
+    std::chrono::steady_clock::time_point deadline = std::chrono::steady_clock::now() + std::chrono::microseconds(timeout_us);
+    return grab_batch(id2eye(id).get(), count, frames, infos, timeout_us ? &deadline : NULL);
+}
+
+void
+ps3eye_grab_batches(int cams, const int *ids, int count, unsigned char **frames, ps3eye_frame_info **infos,
+                    uint64_t timeout_us, int *grabbed)
+{
+    if (cams <= 0) {
+        return;
+    }
+
+    // one deadline for all, so that a timeout bounds the whole call
+    std::chrono::steady_clock::time_point deadline = std::chrono::steady_clock::now() + std::chrono::microseconds(timeout_us);
+    const std::chrono::steady_clock::time_point *until = timeout_us ? &deadline : NULL;
+
+    for_each_camera(ids2eyes(cams, ids), [=](int i, ps3eye_t *eye) { grabbed[i] = grab_batch(eye, count, frames[i], infos[i], until); });
+}
+
+int
+ps3eye_grab_synced(int count, const int *ids, unsigned char **frames, ps3eye_frame_info *infos,
+                   uint64_t tolerance, int max_rounds, uint64_t *skipped)
+{
+    if (count <= 0) {
+        return 0;
+    }
+
+    std::vector<ps3eye_ref> eyes = ids2eyes(count, ids);
+    grab_frames(eyes, frames, infos);
+
+    std::vector<int> lagging;
+    std::vector<ps3eye_ref> lag_eyes;
+    std::vector<unsigned char *> lag_frames;
+    std::vector<ps3eye_frame_info> lag_infos;
+    for (int round = 0; ; ++round) {
+        uint64_t newest = 0;
+        for (int i = 0; i < count; ++i) {
+            newest = std::max(newest, infos[i].arrival);
+        }
+
+        lagging.clear();
+        for (int i = 0; i < count; ++i) {
+            if (infos[i].arrival + tolerance < newest) {
+                lagging.push_back(i);
+            }
+        }
+        if (lagging.empty()) {
+            return 0;
+        }
+        if (round == max_rounds) {
+            return -1;
+        }
+
+        // replace the stale frames only; cameras already in the window keep theirs
+        lag_eyes.clear();
+        lag_frames.clear();
+        for (int i : lagging) {
+            lag_eyes.push_back(eyes[i]);
+            lag_frames.push_back(frames[i]);
+        }
+        lag_infos.resize(lagging.size());
+        grab_frames(lag_eyes, lag_frames.data(), lag_infos.data());
+        for (size_t j = 0; j < lagging.size(); ++j) {
+            infos[lagging[j]] = lag_infos[j];
+            if (skipped) {
+                skipped[lagging[j]]++;
+            }
+        }
+    }
+}
+
+uint64_t
+ps3eye_acquire_frame(int id, const unsigned char **frame, ps3eye_frame_info *info)
+{
+    ps3eye_ref eye = id2eye(id);
+
+    if (!eye) {
+        return 0;
+    }
+
+    struct timeval timestamp;
+    ps3eye::FrameInfo frame_info;
+    const uint8_t *slot = eye->eye->acquireRawFrame(&timestamp, &frame_info);
+    if (!slot) {
+        // a frame is already held
+        return 0;
+    }
+
+    *frame = slot;
+    if (info) {
+        fill_frame_info(info, timestamp, frame_info);
+    }
+    return timeval2int(timestamp);
+}
+
+int
+ps3eye_get_drop_counts(int id, uint64_t *overwritten, uint64_t *discarded)
+{
+    ps3eye_ref eye = id2eye(id);
+
+    if (!eye) {
+        return -1;
+    }
+
+    *overwritten = eye->eye->getFramesOverwritten();
+    *discarded = eye->eye->getFramesDiscarded();
+    return 0;
+}
+
+int
+ps3eye_get_stats(int id, ps3eye_capture_stats *stats)
+{
+    static_assert(sizeof(ps3eye_capture_stats) == sizeof(ps3eye::CaptureStats)
+                  && PS3EYE_INTERVAL_BINS == ps3eye::CaptureStats::INTERVAL_BINS
+                  && PS3EYE_INTERVAL_BIN_US == ps3eye::CaptureStats::INTERVAL_BIN_US,
+                  "ps3eye_capture_stats must mirror ps3eye::CaptureStats");
+
+    ps3eye_ref eye = id2eye(id);
+
+    if (!eye) {
+        return -1;
+    }
+
+    ps3eye::CaptureStats snapshot;
+    eye->eye->getCaptureStats(&snapshot);
+    memcpy(stats, &snapshot, sizeof(snapshot));
+    return 0;
+}
+
+int
+ps3eye_frames_available(int id)
+{
+    ps3eye_ref eye = id2eye(id);
+
+    if (!eye) {
+        return -1;
+    }
+
+    return (int)eye->eye->getFramesAvailable();
+}
+
+int
+ps3eye_get_notify_fd(int id)
+{
+    ps3eye_ref eye = id2eye(id);
+
+    if (!eye) {
+        return -1;
+    }
+
+    return eye->eye->getFrameNotifyFd();
+}
+
+void
+ps3eye_release_frame(int id)
+{
+    ps3eye_ref eye = id2eye(id);
+
+    if (!eye) {
+        return;
+    }
+
+    eye->eye->releaseRawFrame();
+}
+
+int
+ps3eye_debayer(const unsigned char *bayer, int width, int height, unsigned char *out, ps3eye_format format)
+{
+    // the interpolation needs a 3x3 neighbourhood, and the mosaic repeats every 2 pixels
+    if (width < 4 || height < 4 || width % 2 || height % 2) {
+        return -1;
+    }
+
+    ps3eye::PS3EYECam::decodeFrame(bayer, width, height, out, (ps3eye::PS3EYECam::EOutputFormat)format);
+    return 0;
+}
+
+void
+ps3eye_interrupt(int id)
+{
+    ps3eye_ref eye = id2eye(id);
+
+    if (!eye) {
+        return;
+    }
+
+    eye->eye->interrupt();
 }
 
 void
 ps3eye_close(int id)
 {
-    ps3eye_t *eye = id2eye(id);
-    delete eye;
+    if (!ps3eye_context) {
+        return;
+    }
+
+    ps3eye_ref eye;
+    {
+        std::lock_guard<std::mutex> lock(ps3eye_context->opened_mutex);
+        auto it = ps3eye_context->opened_devices.find(id);
+        if (it == ps3eye_context->opened_devices.end()) {
+            return;
+        }
+        eye = it->second;
+        ps3eye_context->opened_devices.erase(it);
+    }
+
+    // the device is released, as the enumerated cameras outlive the context
+    eye->eye->close();
 }
 
 int
 ps3eye_get_parameter(int id, ps3eye_parameter param)
 {
 
-    ps3eye_t *eye = id2eye(id);
+    ps3eye_ref eye = id2eye(id);
 
     if (!eye) {
         return -1;
@@ -240,16 +739,9 @@ ps3eye_get_parameter(int id, ps3eye_parameter param)
     }
 }
 
-int
-ps3eye_set_parameter(int id, ps3eye_parameter param, int value)
+static void
+set_parameter(ps3eye_t *eye, ps3eye_parameter param, int value)
 {
-
-    ps3eye_t *eye = id2eye(id);
-
-    if (!eye) {
-        return -1;
-    }
-
     switch (param) {
         case PS3EYE_AUTO_GAIN:
             eye->eye->setAutogain(value > 0);
@@ -296,7 +788,117 @@ ps3eye_set_parameter(int id, ps3eye_parameter param, int value)
         default:
             break;
     }
+}
 
+int
+ps3eye_set_frame_policy(int id, ps3eye_frame_policy policy)
+{
+    ps3eye_ref eye = id2eye(id);
+
+    if (!eye) {
+        return -1;
+    }
+
+    eye->eye->setFramePolicy(policy == PS3EYE_POLICY_LATEST ? ps3eye::PS3EYECam::EFramePolicy::Latest : ps3eye::PS3EYECam::EFramePolicy::Fifo);
     return 0;
 }
 
+int
+ps3eye_set_parameter(int id, ps3eye_parameter param, int value)
+{
+
+    ps3eye_ref eye = id2eye(id);
+
+    if (!eye) {
+        return -1;
+    }
+
+    std::lock_guard<std::mutex> lock(eye->control);
+    set_parameter(eye.get(), param, value);
+
+    return 0;
+}
+
+int
+ps3eye_set_parameters(int count, const ps3eye_parameter_update *updates, uint32_t frame_timeout_ms)
+{
+    // group the changes by camera, keeping their order
+    std::map<int, std::vector<const ps3eye_parameter_update *>> by_camera;
+    for (int i = 0; i < count; ++i) {
+        by_camera[updates[i].id].push_back(&updates[i]);
+    }
+
+    std::vector<int> ids;
+    std::vector<const std::vector<const ps3eye_parameter_update *> *> changes;
+    for (auto it = by_camera.begin(); it != by_camera.end(); ++it) {
+        ids.push_back(it->first);
+        changes.push_back(&it->second);
+    }
+    std::vector<ps3eye_ref> eyes = ids2eyes((int)ids.size(), ids.data());
+
+    int applied = 0;
+    for (size_t i = 0; i < eyes.size(); ++i) {
+        if (eyes[i]) {
+            applied += (int)changes[i]->size();
+        }
+    }
+
+    for_each_camera(eyes, [frame_timeout_ms, &changes](int i, ps3eye_t *eye) {
+        if (!eye) {
+            return;
+        }
+        if (frame_timeout_ms) {
+            eye->eye->waitFrameBoundary(frame_timeout_ms);
+        }
+        std::lock_guard<std::mutex> lock(eye->control);
+        for (const ps3eye_parameter_update *update : *changes[i]) {
+            set_parameter(eye, update->param, update->value);
+        }
+    });
+    return applied;
+}
+
+int
+ps3eye_check_parameter(int id, ps3eye_parameter param)
+{
+
+    ps3eye_ref eye = id2eye(id);
+
+    if (!eye) {
+        return -1;
+    }
+
+    std::lock_guard<std::mutex> lock(eye->control);
+    switch (param) {
+    case PS3EYE_AUTO_GAIN:
+        return eye->eye->checkAutogain();
+    case PS3EYE_GAIN:
+        return eye->eye->checkGain();
+    case PS3EYE_AUTO_WHITEBALANCE:
+        return eye->eye->checkAutoWhiteBalance();
+    case PS3EYE_AUTO_EXPOSURE:
+        return eye->eye->checkAutoExposure();
+    case PS3EYE_EXPOSURE:
+        return eye->eye->checkExposure();
+    case PS3EYE_SHARPNESS:
+        return eye->eye->checkSharpness();
+    case PS3EYE_CONTRAST:
+        return eye->eye->checkContrast();
+    case PS3EYE_BRIGHTNESS:
+        return eye->eye->checkBrightness();
+    case PS3EYE_HUE:
+        return eye->eye->checkHue();
+    case PS3EYE_REDBALANCE:
+        return eye->eye->checkRedBalance();
+    case PS3EYE_BLUEBALANCE:
+        return eye->eye->checkBlueBalance();
+    case PS3EYE_GREENBALANCE:
+        return eye->eye->checkGreenBalance();
+    case PS3EYE_HFLIP:
+    case PS3EYE_VFLIP:
+        return eye->eye->checkFlip();
+    default:
+        return -1;
+    }
+}
+
@@ -56,14 +56,92 @@ typedef enum{
     PS3EYE_VFLIP                // [false, true]
 } ps3eye_parameter;
 
+// one parameter change, for ps3eye_set_parameters
+typedef struct {
+    int id;
+    ps3eye_parameter param;
+    int value;
+} ps3eye_parameter_update;
+
 typedef enum{
 	PS3EYE_FORMAT_BAYER,        // Output in Bayer. Destination buffer must be width * height bytes
 	PS3EYE_FORMAT_BGR,          // Output in BGR. Destination buffer must be width * height * 3 bytes
 	PS3EYE_FORMAT_RGB,          // Output in RGB. Destination buffer must be width * height * 3 bytes
 	PS3EYE_FORMAT_GRAY,        // Output in Grey. Destination buffer must be width * height bytes
+	PS3EYE_FORMAT_RGB_HALF,    // Output in half-resolution RGB (one pixel per 2x2 Bayer cell). Destination buffer must be (width/2) * (height/2) * 3 bytes
+	PS3EYE_FORMAT_BGR_HALF,    // Output in half-resolution BGR (one pixel per 2x2 Bayer cell). Destination buffer must be (width/2) * (height/2) * 3 bytes
+	PS3EYE_FORMAT_GREEN,       // Output the interpolated green channel only. Destination buffer must be width * height bytes
 } ps3eye_format;
 
 
+typedef struct {
+    uint64_t timestamp;     // time at which the frame was handed to the caller, in microseconds
+    uint64_t arrival;       // time at which the last USB packet of the frame arrived, in microseconds
+    uint32_t pts;           // UVC presentation timestamp reported by the camera
+    uint64_t seq;           // per-camera frame sequence number; gaps indicate dropped frames
+} ps3eye_frame_info;
+
+#define PS3EYE_INTERVAL_BINS 256     // number of bins of the inter-arrival histogram
+#define PS3EYE_INTERVAL_BIN_US 250   // width of a histogram bin, in microseconds; the last bin also holds all longer intervals
+
+typedef struct {
+    uint64_t transfers;             // USB bulk transfers completed
+    uint64_t transfer_errors;       // USB bulk transfers that failed, or could not be resubmitted
+    uint64_t bytes;                 // bytes received, including payload headers
+    uint64_t bad_headers;           // payloads with an invalid UVC header (wrong length, or no PTS)
+    uint64_t payload_errors;        // payloads flagged with an error by the camera
+    uint64_t frames_completed;      // complete frames handed to the ring buffer
+    uint64_t frames_discarded;      // incomplete or corrupt frames dropped by the packet parser
+    uint64_t frames_overwritten;    // completed frames dropped because the ring buffer was full
+    uint64_t frames_skipped;        // completed frames passed over for a newer one, under PS3EYE_POLICY_LATEST
+    uint64_t dequeues;              // frames grabbed or acquired from the ring buffer
+    uint64_t dequeue_wait_us;       // total time spent by those calls waiting for a frame to arrive, in microseconds
+    uint64_t dequeue_wait_max_us;   // longest such wait, in microseconds
+    uint64_t intervals;             // number of intervals measured between the arrivals of consecutive completed frames
+    uint64_t interval_sum_us;       // sum of those intervals, in microseconds
+    uint64_t interval_sumsq_us;     // sum of their squares, in microseconds^2
+    uint64_t interval_hist[PS3EYE_INTERVAL_BINS]; // histogram of those intervals
+} ps3eye_capture_stats;
+
+typedef enum {
+    PS3EYE_POLICY_FIFO,         // grab the oldest frame in the ring buffer; when it is full, the newest frames are dropped
+    PS3EYE_POLICY_LATEST,       // grab the newest frame, skipping older ones; when the ring buffer is full, the oldest frames are dropped
+} ps3eye_frame_policy;
+
+typedef enum {
+    PS3EYE_EVENTS_SHARED,       // one thread handles the USB transfers of all cameras opened this way
+    PS3EYE_EVENTS_PER_BUS,      // one thread per USB bus, for the cameras opened this way on that bus
+    PS3EYE_EVENTS_PER_CAMERA,   // a thread for this camera alone
+} ps3eye_event_thread;
+
+typedef struct {
+    int num_transfers;                  // USB bulk transfers kept in flight, 1 to 64 (default 5)
+    int transfer_size;                  // bytes per transfer, a multiple of 2048 (default 65536)
+    ps3eye_event_thread event_thread;   // which thread handles the transfers (default PS3EYE_EVENTS_SHARED)
+    int cpu;                            // CPU to pin that thread to when it starts, or -1 (Linux and Windows only)
+} ps3eye_usb_config;
+
+// Reduction of the frames returned by ps3eye_grab_frame*, applied in the driver as they are decoded
+typedef struct {
+    int x;              // region of interest in sensor pixels (position and size, all even); width and height 0 for the whole frame
+    int y;
+    int width;
+    int height;
+    int binning;        // 1, 2 or 4: average each binning x binning block of output pixels (of the same colour, for PS3EYE_FORMAT_BAYER) into one
+    int decimation;     // keep only every decimation-th frame
+} ps3eye_reduction;
+
+typedef struct {
+    double loss;                    // probability that a USB payload is lost, making the parser discard its frame
+    double jitter;                  // standard deviation of the frame timing, in seconds
+    const unsigned char *frames;    // n_frames raw Bayer frames of width x height to replay in a loop (copied), or NULL for a synthetic pattern
+    int n_frames;
+    int width;                      // with replayed frames, cameras can only be opened at this resolution
+    int height;
+    unsigned int seed;              // seed of the random loss and jitter; camera i uses seed + i
+} ps3eye_sim_config;
+
+
 /**
  * Initialize and enumerate connected cameras.
  * Needs to be called once before all other API functions.
@@ -71,6 +149,19 @@ typedef enum{
 void
 ps3eye_init();
 
+/**
+ * Initialize with count simulated cameras instead of the connected ones,
+ * for use without hardware. A simulated camera generates the UVC bulk
+ * payloads of synthetic or replayed frames at the frame rate it is opened
+ * with, and feeds them through the same packet parser and frame queue as a
+ * real camera; its settings are kept in shadow registers.
+ * config may be NULL for lossless synthetic frames. The first 8 bytes of a
+ * synthetic frame hold its frame number (little-endian).
+ * Like ps3eye_init, does nothing if the library is already initialized.
+ **/
+void
+ps3eye_init_simulated(int count, const ps3eye_sim_config *config);
+
 /**
  * De-initialize the library and free resources.
  * If a pseye_t * object is still opened, nothing happens.
@@ -83,12 +174,43 @@ ps3eye_uninit();
  * The id is zero-based, and must be smaller than the count.
  * width and height should usually be 640x480 or 320x240
  * fps is the target frame rate, 60 usually works fine here
+ * queue_depth is the number of frames in the driver's ring buffer (minimum 2)
+ * usb_config sets up the USB transfers, or NULL for the defaults.
+ * reduction crops, bins and decimates the frames, or NULL for whole frames. The size of the
+ * frames returned is then (region of interest size / binning), halved again in the half-resolution formats.
+ * Returns false if the device is unavailable, or usb_config or reduction is invalid.
  **/
 bool
-ps3eye_open(int id, int width, int height, int fps, ps3eye_format outputFormat);
+ps3eye_open(int id, int width, int height, int fps, ps3eye_format outputFormat, int queue_depth,
+            const ps3eye_usb_config *usb_config, const ps3eye_reduction *reduction);
+
+// the arguments of ps3eye_open for one camera, for ps3eye_open_many
+typedef struct {
+    int id;
+    int width;
+    int height;
+    int fps;
+    ps3eye_format format;
+    int queue_depth;
+    ps3eye_usb_config usb_config;
+    ps3eye_reduction reduction;
+} ps3eye_open_config;
 
 /**
- * Get the string that uniquely identifies this camera
+ * Open several PSEye camera devices concurrently, one thread per camera,
+ * as ps3eye_open does; most of the time taken to open a camera is spent
+ * sending its register settings, one USB control transfer at a time.
+ * opened[i] is set to 1 if configs[i] was opened, and 0 if not.
+ * Returns the number of cameras opened.
+ **/
+int
+ps3eye_open_many(int count, const ps3eye_open_config *configs, int *opened);
+
+/**
+ * Get the string that uniquely identifies this camera: the USB port path
+ * it is plugged into (e.g. "b1_p2.3"), which is stable across processes
+ * for as long as the cameras are not moved to other ports.
+ * Works for any connected camera, whether opened or not.
  * Returns 0 on success, -1 on failure
  **/
 int
@@ -105,13 +227,158 @@ ps3eye_get_unique_identifier(int id, char *out_identifier, int max_identifier_le
 uint64_t
 ps3eye_grab_frame(int id, unsigned char* frame);
 
+/**
+ * Grab the next frame, like ps3eye_grab_frame, and fill in its capture-side
+ * metadata (arrival time, PTS and sequence number) if info is not NULL.
+ * Returns the same timestamp as ps3eye_grab_frame.
+ **/
+uint64_t
+ps3eye_grab_frame_info(int id, unsigned char* frame, ps3eye_frame_info *info);
+
+/**
+ * Grab a frame like ps3eye_grab_frame_info if one is available, without
+ * blocking. Returns its timestamp, or 0 (leaving frame and info untouched)
+ * if the camera has no new frame.
+ **/
+uint64_t
+ps3eye_try_grab_frame(int id, unsigned char* frame, ps3eye_frame_info *info);
+
+/**
+ * Grab the next frame from each of count cameras.
+ * The cameras are waited on (and their frames decoded) concurrently, so the
+ * call returns after roughly one frame interval rather than one per camera;
+ * each camera but the first is handled by a thread of its own, started on
+ * first use and kept until the camera is closed.
+ * frames and infos must each hold count entries.
+ **/
+void
+ps3eye_grab_frames(int count, const int *ids, unsigned char **frames, ps3eye_frame_info *infos);
+
+/**
+ * Grab count consecutive frames from one camera into frames, one frame after
+ * the other (count times the frame size), with their metadata in infos
+ * (count entries; the timestamp of each frame is that of its grab).
+ * If timeout_us is not 0, stops early when that many microseconds have
+ * passed while waiting for a frame.
+ * Returns the number of frames grabbed.
+ **/
+int
+ps3eye_grab_batch(int id, int count, unsigned char *frames, ps3eye_frame_info *infos, uint64_t timeout_us);
+
+/**
+ * Grab a batch of count frames from each of cams cameras, as
+ * ps3eye_grab_batch does, concurrently. frames, infos and grabbed must each
+ * hold cams entries; grabbed[i] receives the number of frames of camera i.
+ * The timeout applies to all cameras together.
+ **/
+void
+ps3eye_grab_batches(int cams, const int *ids, int count, unsigned char **frames, ps3eye_frame_info **infos,
+                    uint64_t timeout_us, int *grabbed);
+
+/**
+ * Grab one frame from each of count cameras such that all of them arrived
+ * within tolerance microseconds of the newest one.
+ * After an initial ps3eye_grab_frames, cameras whose frame is older than the
+ * tolerance allows are grabbed again (concurrently), discarding the stale
+ * frame, until the set matches or max_rounds extra grabs have been made.
+ * If skipped is not NULL, skipped[i] is incremented for every frame of
+ * camera i discarded this way.
+ * Returns 0 if the frames match, -1 if they still do not after max_rounds
+ * (frames and infos then hold the last frames grabbed).
+ **/
+int
+ps3eye_grab_synced(int count, const int *ids, unsigned char **frames, ps3eye_frame_info *infos,
+                   uint64_t tolerance, int max_rounds, uint64_t *skipped);
+
+/**
+ * Acquire the oldest frame in the driver's ring buffer, without copying it.
+ * Blocks until a frame is available. On success *frame points to the raw
+ * Bayer data (width * height bytes), info (if not NULL) holds its metadata,
+ * and the timestamp in microseconds is returned. The slot remains valid until ps3eye_release_frame() is called.
+ * Returns 0 if the camera is not open or a frame is already held.
+ **/
+uint64_t
+ps3eye_acquire_frame(int id, const unsigned char **frame, ps3eye_frame_info *info);
+
+/**
+ * Release the frame previously obtained with ps3eye_acquire_frame().
+ **/
+void
+ps3eye_release_frame(int id);
+
+/**
+ * Get the number of frames lost so far by a camera.
+ * overwritten counts completed frames dropped because the ring buffer was
+ * full; discarded counts incomplete or corrupt frames dropped by the packet
+ * parser. Returns 0 on success, -1 on failure.
+ **/
+int
+ps3eye_get_drop_counts(int id, uint64_t *overwritten, uint64_t *discarded);
+
+/**
+ * Get the counters kept by a camera's capture path since it was opened:
+ * USB traffic, packet errors, frames completed and lost, time spent waiting
+ * in ps3eye_grab_frame, and a histogram of frame inter-arrival times.
+ * The counters are read without locking, so this is cheap enough to poll
+ * continuously while streaming. Returns 0 on success, -1 on failure.
+ **/
+int
+ps3eye_get_stats(int id, ps3eye_capture_stats *stats);
+
+/**
+ * Number of frames that ps3eye_grab_frame can return without blocking,
+ * or -1 if the camera is not open.
+ **/
+int
+ps3eye_frames_available(int id);
+
+/**
+ * A file descriptor that becomes readable whenever a frame arrives, for
+ * waiting on frames with select/poll or an event loop instead of a thread.
+ * Readiness only means that frames may be available (check
+ * ps3eye_frames_available); the waiter must drain it by read()ing it.
+ * The fd belongs to the camera and is closed by ps3eye_close.
+ * Returns -1 if the camera is not open, or on Windows.
+ **/
+int
+ps3eye_get_notify_fd(int id);
+
+/**
+ * Convert a raw (GRBG Bayer) frame to the given output format, exactly as
+ * the driver would. Does not require the library to be initialized.
+ * out must be sized as described for ps3eye_format.
+ * Returns 0 on success, -1 if the dimensions are not supported.
+ **/
+int
+ps3eye_debayer(const unsigned char *bayer, int width, int height, unsigned char *out, ps3eye_format format);
+
+/**
+ * Make the calls waiting for frames from a camera in other threads (grab,
+ * acquire, and at-frame parameter changes) return at once without a frame,
+ * as do any made until the camera is closed; the grab functions then return
+ * a zero timestamp, or fewer frames than asked for. Call this before
+ * ps3eye_close() when other threads may still be reading the camera, and
+ * wait for their calls to return.
+ **/
+void
+ps3eye_interrupt(int id);
+
 /**
  * Close a PSEye camera device and free allocated resources.
+ * Grabs still waiting for a frame of the camera are woken and waited for first.
  * To really close the library, you should also call ps3eye_uninit().
  **/
 void
 ps3eye_close(int id);
 
+/**
+ * Choose which frame in the ring buffer the grab functions hand out; takes
+ * effect immediately, also while the camera is streaming.
+ * Returns -1 if the camera is not open, otherwise 0.
+ **/
+int
+ps3eye_set_frame_policy(int id, ps3eye_frame_policy policy);
+
 /**
  * Set a ps3eye_parameter to a value.
  * Returns -1 if there is an error, otherwise 0.
@@ -119,6 +386,23 @@ ps3eye_close(int id);
 int
 ps3eye_set_parameter(int id, ps3eye_parameter param, int value);
 
+/**
+ * Apply a batch of parameter changes, possibly to several cameras.
+ * The changes for each camera are made in the order given, while the cameras are handled concurrently, as by ps3eye_grab_frames.
+ * If frame_timeout_ms is not 0, each camera's changes are deferred until it completes its next frame (or the timeout expires),
+ * so that they fall between frames rather than during one.
+ * Returns the number of changes made; those for cameras that are not open are skipped.
+ **/
+int
+ps3eye_set_parameters(int count, const ps3eye_parameter_update *updates, uint32_t frame_timeout_ms);
+
+/**
+ * Read back the sensor registers holding a ps3eye_parameter, and compare them with the value last set.
+ * Returns 1 if they agree (or if an automatic mode currently owns the parameter), 0 if not, and -1 if there is an error.
+ **/
+int
+ps3eye_check_parameter(int id, ps3eye_parameter param);
+
 /**
 * Get a ps3eye_parameter value.
 * Returns -1 if there is an error, otherwise returns the parameter value int.
@@ -126,6 +410,16 @@ ps3eye_set_parameter(int id, ps3eye_parameter param, int value);
 int
 ps3eye_get_parameter(int id, ps3eye_parameter param);
 
+/**
+ * Enumerate the connected cameras again, e.g. after plugging one in.
+ * The cameras are otherwise enumerated only once per process, by the first
+ * ps3eye_init(), and the ids refer to that enumeration.
+ * Only possible while the library is not initialized.
+ * Returns the number of cameras found, or -1 if the library is initialized.
+ **/
+int
+ps3eye_rescan();
+
 /**
  * Return the number of PSEye cameras connected via USB.
  **/
@@ -1,15 +1,136 @@
 import tkinter as tk
 import threading
+import queue
 import time
 import numpy as np
 from PIL import Image, ImageTk
 
 from .cameras import Camera
 
+def downsample(img, factor):
+    """Shrink a frame by an integer factor, averaging each factor x factor block (rows and columns left over are cropped)
+
+    Parameters
+    ----------
+    img : np.ndarray
+        uint8 frame, (h, w) or (h, w, channels)
+    factor : int
+
+    Returns
+    -------
+    np.ndarray : uint8 frame of shape (h//factor, w//factor[, channels])
+    """
+    if factor <= 1:
+        return img
+    h, w = img.shape[0] // factor, img.shape[1] // factor
+    blocks = img[:h*factor, :w*factor].reshape((h, factor, w, factor) + img.shape[2:])
+    total = blocks.sum(axis=(1, 3), dtype=np.uint32)
+    return ((total + factor*factor//2) // (factor*factor)).astype(np.uint8)
+
+class Mailbox():
+    """Single-slot mailbox: put replaces any item not yet taken, so that a reader only ever sees the newest
+
+    Neither side blocks; take returns None if nothing new has been put since the last take.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._item = None
+        self.n_put = 0
+        self.n_replaced = 0
+
+    def put(self, item):
+        with self._lock:
+            if self._item is not None:
+                self.n_replaced += 1
+            self._item = item
+            self.n_put += 1
+
+    def take(self):
+        with self._lock:
+            item, self._item = self._item, None
+        return item
+
+class Preview(threading.Thread):
+    """Prepares previews of camera frames in a thread of its own, for display without burdening the UI thread or the acquisition
+
+    Grabs frames with grab_fxn as fast as they come (so a camera read directly is drained at its own frame rate, rather than throttled to the display's), and, at most rate times per second,
+    shrinks each camera's frame by an integer factor to fit in max_size (see downsample). The newest preview of each camera is left in its Mailbox, as a (frame, timestamp) tuple.
+    """
+    def __init__(self, grab_fxn, rate=45, max_size=(320,240)):
+        """
+        Parameters
+        ----------
+        grab_fxn : callable
+            returns (frames, timestamps), lists with one entry per camera, e.g. lambda: cam.read(squeeze=False); (None, None) ends the preview, queue.Empty is retried after a pause
+        rate : float
+            maximum number of previews per second
+        max_size : (width, height)
+            maximum size of the previews
+        """
+        super().__init__(daemon=True)
+        self.grab_fxn = grab_fxn
+        self.interval = 1/rate
+        self.max_size = max_size
+        self.mailboxes = []
+        self.n_grabbed = 0
+        self.started = threading.Event() # set once the first previews are in the mailboxes, or the grabs have ended
+        self.kill = threading.Event()
+        self.start()
+
+    def run(self):
+        last = -np.inf
+        try:
+            while not self.kill.is_set():
+                try:
+                    frames, ts = self.grab_fxn()
+                except queue.Empty:
+                    # e.g. a FrameRing that no frame reached in time, or a grab that does not block at all
+                    self.kill.wait(self.interval)
+                    continue
+                except Exception:
+                    # a camera closed while the preview was ending (see Camera.end) ends the grab too
+                    if self.kill.is_set():
+                        break
+                    raise
+                if frames is None:
+                    break
+                self.n_grabbed += 1
+
+                now = time.perf_counter()
+                if now - last < self.interval:
+                    continue
+                last = now
+
+                if not self.mailboxes:
+                    self.mailboxes = [Mailbox() for f in frames]
+                for mb,frame,t in zip(self.mailboxes, frames, ts):
+                    factor = int(np.ceil(max(frame.shape[1] / self.max_size[0], frame.shape[0] / self.max_size[1])))
+                    # a shrunk frame is a new array, whereas one that is not must be copied before the grab's buffer is reused
+                    mb.put((downsample(frame, factor) if factor > 1 else frame.copy(), t))
+                self.started.set()
+        finally:
+            self.started.set()
+
+    def end(self, timeout=2.0):
+        """Stop grabbing, and wait up to timeout seconds for the grab under way to return
+
+        Returns
+        -------
+        True if the thread has ended
+        """
+        self.kill.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+        return not self.is_alive()
+
 class Display(tk.Tk):
+    """Live view of one or more cameras, with sliders for the settings of a Camera
+
+    Frames are grabbed and shrunk by a Preview thread; the UI thread only paints the newest previews into images that are reused from one refresh to the next.
+    """
+
+    def __init__(self, grab_fxn=None, refresh_rate=45, onexit=[], max_size=(320,240)):
 
-    def __init__(self, grab_fxn=None, refresh_rate=45, onexit=[]):
-     
         tk.Tk.__init__(self, None)
         scrn_w = self.winfo_screenwidth()
         scrn_h = self.winfo_screenheight()
@@ -17,19 +138,20 @@ class Display(tk.Tk):
         self.protocol("WM_DELETE_WINDOW", self.end)
         self.onexit = onexit
         self.grid()
-        
+
         if isinstance(grab_fxn, Camera):
             self.cam = grab_fxn
             grab_fxn = lambda: self.cam.read(timestamp=True, squeeze=False)
         else:
             self.cam = None
-        
+
         self.grab_fxn = grab_fxn
         self.refresh_rate = refresh_rate
         self._refresh_interval = int(1000/self.refresh_rate)
 
-        self.cvs = None 
+        self.cvs = None
         self.recall = None
+        self.preview = Preview(self.grab_fxn, rate=self.refresh_rate, max_size=max_size)
 
         # run main loop
         self.title('Camera Display')
@@ -40,18 +162,21 @@ class Display(tk.Tk):
         return self.grab_fxn()
 
     def step(self):
-        
-        # first iteration:
-        if self.cvs is None:
-            self.cvs = [] # canvas, canvas_img, photo_img
 
-            imgs,ts = self.grab()
-            if imgs is None:
+        # first iteration, once the first previews are ready:
+        if self.cvs is None:
+            if not self.preview.started.is_set():
+                self.recall = self.after(self._refresh_interval, self.step)
+                return
+            if not self.preview.mailboxes:
                 self.end()
                 return
 
+            self.cvs = [] # canvas, canvas_img, photo_img
+            imgs = [mb.take()[0] for mb in self.preview.mailboxes]
+
             for i,img in enumerate(imgs):
-                
+
                 # canvas for this camera
                 canvas = ImgCanvas(self, img)
                 canvas.grid(column=i+1, row=0, sticky='EW')
@@ -70,11 +195,15 @@ class Display(tk.Tk):
                             label = tk.Label(self, text=pname)
                             label.grid(column=0, row=1+pidx)
 
-        # all iterations
-        imgs,ts = self.grab()
-        for im,cv in zip(imgs, self.cvs):
-            cv.set_img(im)
-        
+        # all iterations: cameras without a new preview keep the previous one
+        for mb,cv in zip(self.preview.mailboxes, self.cvs):
+            item = mb.take()
+            if item is not None:
+                cv.set_img(item[0])
+        if not self.preview.is_alive():
+            self.end()
+            return
+
         self.recall = self.after(self._refresh_interval, self.step)
 
     def set_param(self, idx, name, val):
@@ -84,19 +213,18 @@ class Display(tk.Tk):
     def end(self, *args):
         if self.recall is not None:
             self.after_cancel(self.recall)
+        # the preview must be done with the cameras before they may be closed, e.g. by onexit
+        self.preview.end()
         [oe() for oe in self.onexit]
         self.destroy()
 
 class ImgCanvas(tk.Canvas):
     def __init__(self, parent, img, **kwargs):
         """
-        img : np.ndarray
+        img : np.ndarray, a preview as made by Preview
         """
 
-        # TODO: un-hardcode this
         self.h,self.w = img.shape[:2]
-        if (self.h, self.w) == (480,640):
-            self.h,self.w = 240,320
 
         kwargs['width'] = kwargs.get('width', self.w)
         kwargs['height'] = kwargs.get('height', self.h)
@@ -104,22 +232,20 @@ class ImgCanvas(tk.Canvas):
 
         tk.Canvas.__init__(self,parent,**kwargs)
 
+        self.photo = None
         self.cvs_im = None
         self.set_img(img)
-        
+
     def set_img(self, img):
-        shape = img.shape[:2]
         pimg = Image.fromarray(img)
 
-        #TODO: un-hardcode this
-        if shape == (480,640):
-            shape = (240,320)
-            pimg = pimg.resize(shape[::-1], Image.ANTIALIAS)
-
-        self.photo = ImageTk.PhotoImage(image=pimg)
-        if self.cvs_im is None:
-            center = (shape[1]//2, shape[0]//2)
-            self.cvs_im = self.create_image(center[0], center[1], image=self.photo)
+        # the photo image is created once, and painted over in place afterwards
+        if self.photo is None or (self.photo.width(), self.photo.height()) != pimg.size or self.photo_mode != pimg.mode:
+            self.photo = ImageTk.PhotoImage(image=pimg)
+            self.photo_mode = pimg.mode
+            if self.cvs_im is None:
+                self.cvs_im = self.create_image(self.w//2, self.h//2, image=self.photo)
+            else:
+                self.itemconfig(self.cvs_im, image=self.photo)
         else:
-            self.itemconfig(self.cvs_im, image=self.photo)
-
+            self.photo.paste(pimg)
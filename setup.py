@@ -63,7 +63,7 @@ if sys.platform.startswith('win'):
     extra_link_args = []
 else:
     os.environ["CC"] = "g++"
-    extra_compile_args = ['-std=c++11']
+    extra_compile_args = ['-std=c++11', '-O3'] # -O3 lets the compiler vectorize the debayer loops
     extra_link_args = ['-std=c++11']
 
 extensions = [  Extension('pseyepy.cameras',
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""USB transfer stress test for pseyepy.
+
+Streams from all connected cameras (or --ids) under each combination of the USB
+transfer settings given, and reports per camera how many frames were lost and why,
+from the driver's counters (Camera.stats). Use it to choose num_transfers,
+transfer_size and event_thread for a rig: with many cameras on a single event
+thread, incomplete frames show up as 'discarded'.
+
+Needs cameras; not collected by pytest. Example:
+  python tests/stress_usb.py --seconds 20 --fps 125 --transfers 5 16 --threads shared bus camera
+"""
+import argparse
+import itertools
+import json
+import sys
+import time
+
+from pseyepy import Camera
+
+
+def run(args, num_transfers, transfer_size, event_thread):
+    cam = Camera(args.ids, fps=args.fps, resolution=args.resolution, colour=False,
+                 num_transfers=num_transfers, transfer_size=transfer_size,
+                 event_thread=event_thread, event_cpu=args.cpu)
+    try:
+        # let the cameras settle before measuring
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < 1:
+            cam.read()
+        before = cam.stats()
+
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < args.seconds:
+            cam.read()
+        after = cam.stats(since=before)
+    finally:
+        cam.end()
+
+    rows = []
+    for idx,st in enumerate(after):
+        frames = st['frames'] + st['discarded']
+        rows.append(dict(cam=idx, num_transfers=num_transfers, transfer_size=transfer_size, event_thread=event_thread,
+                         frames=st['frames'], discarded=st['discarded'], overwritten=st['overwritten'],
+                         discard_rate=st['discarded'] / frames if frames else float('nan'),
+                         bad_headers=st['bad_headers'], payload_errors=st['payload_errors'], transfer_errors=st['transfer_errors'],
+                         fps=st['fps'], interval_std_ms=1e3 * st['interval_std']))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ids', type=int, nargs='+', default=None, help='cameras to use (default: all)')
+    parser.add_argument('--fps', type=int, default=60)
+    parser.add_argument('--resolution', type=int, default=Camera.RES_LARGE, help='0: 320x240, 1: 640x480')
+    parser.add_argument('--seconds', type=float, default=10, help='measurement time per setting')
+    parser.add_argument('--transfers', type=int, nargs='+', default=[5], help='num_transfers values to try')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[65536], help='transfer_size values to try')
+    parser.add_argument('--threads', nargs='+', default=['shared'], choices=['shared', 'bus', 'camera'], help='event_thread values to try')
+    parser.add_argument('--cpu', type=int, default=None, help='CPU to pin the event thread/s to')
+    parser.add_argument('--json', default=None, help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    header = '{:>3} {:>9} {:>8} {:>7} {:>7} {:>9} {:>11} {:>9} {:>8} {:>7} {:>8}'
+    print(header.format('cam', 'transfers', 'size', 'thread', 'frames', 'discarded', 'overwritten', 'bad hdrs', 'discard%', 'fps', 'std(ms)'))
+    for n,size,thread in itertools.product(args.transfers, args.sizes, args.threads):
+        for row in run(args, n, size, thread):
+            results.append(row)
+            print('{:>3} {:>9} {:>8} {:>7} {:>7} {:>9} {:>11} {:>9} {:>8.3f} {:>7.2f} {:>8.3f}'.format(
+                  row['cam'], n, size, thread, row['frames'], row['discarded'], row['overwritten'], row['bad_headers'],
+                  100 * row['discard_rate'], row['fps'], row['interval_std_ms']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""Checks that pseyepy.demosaic reproduces the driver's Bayer decoding exactly.
+
+Needs no camera. Run with pytest, or directly:
+  python tests/test_demosaic.py
+"""
+import numpy as np
+
+from pseyepy import demosaic
+from pseyepy.cameras import debayer
+
+
+def reference(raw):
+    """Per-pixel bilinear demosaic of a single GRBG frame, written for clarity rather than speed"""
+    h, w = raw.shape
+    p = raw.astype(int)
+    out = np.zeros((h, w, 3), dtype=int)
+    avg2 = lambda a, b: (a + b + 1) >> 1
+    avg4 = lambda a, b, c, d: (a + b + c + d + 2) >> 2
+    for y in range(1, h-1):
+        for x in range(1, w-1):
+            m = p[y, x]
+            hz = avg2(p[y, x-1], p[y, x+1])
+            vt = avg2(p[y-1, x], p[y+1, x])
+            cross = avg4(p[y-1, x], p[y+1, x], p[y, x-1], p[y, x+1])
+            diag = avg4(p[y-1, x-1], p[y-1, x+1], p[y+1, x-1], p[y+1, x+1])
+            if y % 2 == 0 and x % 2 == 0:   # G, red neighbours left/right
+                out[y, x] = hz, m, vt
+            elif y % 2 == 0:                # R
+                out[y, x] = m, cross, diag
+            elif x % 2 == 0:                # B
+                out[y, x] = diag, cross, m
+            else:                           # G, red neighbours above/below
+                out[y, x] = vt, m, hz
+        out[y, 0] = out[y, 1]
+        out[y, w-1] = out[y, w-2]
+    out[0] = out[1]
+    out[h-1] = out[h-2]
+    return out.astype(np.uint8)
+
+
+def test_matches_reference():
+    raw = np.random.default_rng(0).integers(0, 256, (3, 12, 16), dtype=np.uint8)
+    rgb = demosaic(raw)
+    for i in range(len(raw)):
+        assert np.array_equal(rgb[i], reference(raw[i]))
+
+
+def test_matches_driver():
+    raw = np.random.default_rng(1).integers(0, 256, (4, 240, 320), dtype=np.uint8)
+    rgb = demosaic(raw)
+    bgr = demosaic(raw, bgr=True)
+    gray = demosaic(raw, gray=True)
+    for i in range(len(raw)):
+        assert np.array_equal(rgb[i], debayer(raw[i], 'rgb'))
+        assert np.array_equal(bgr[i], rgb[i][..., ::-1])
+        assert np.array_equal(gray[i], debayer(raw[i], 'gray'))
+
+
+def test_single_frame_and_out():
+    raw = np.random.default_rng(2).integers(0, 256, (480, 640), dtype=np.uint8)
+    out = np.empty((480, 640, 3), dtype=np.uint8)
+    assert demosaic(raw, out=out) is out
+    assert np.array_equal(out, debayer(raw))
+
+
+if __name__ == '__main__':
+    test_matches_reference()
+    test_matches_driver()
+    test_single_frame_and_out()
+    print('Demosaic tests passed')
@@ -0,0 +1,99 @@
+"""Checks pseyepy.asynchronous.FramePool, and reading frames into caller-owned memory with Camera.read(out=...) on simulated cameras.
+
+Needs no camera. Run with pytest, or directly:
+  python tests/test_framepool.py
+"""
+import queue
+
+import numpy as np
+
+from pseyepy import Camera
+from pseyepy.asynchronous import CamDump, FramePool
+
+
+def stamp(raw):
+    # frame number stamped into synthetic frames
+    return int.from_bytes(raw.ravel()[:8].tobytes(), 'little')
+
+
+def test_pool_recycles():
+    pool = FramePool([(4, 6), (4, 6, 3)], size=2)
+    a = pool.get()
+    b = pool.get()
+    assert a[1].shape == (4, 6, 3) and a[0] is not b[0]
+    try:
+        pool.get(timeout=0.01)
+        assert False, 'expected queue.Empty'
+    except queue.Empty:
+        pass
+    a.release()
+    assert pool.get()[0] is a[0]
+    # any array of a frame set identifies it
+    pool.release(b[1])
+    try:
+        pool.release(b)
+        assert False, 'expected a second release to be rejected'
+    except Exception:
+        pass
+    assert pool.stats() == dict(size=2, free=1, waits=1)
+
+
+def test_pool_grows():
+    pool = FramePool([(4, 6)], size=1, grow=True)
+    held = [pool.get() for _ in range(3)]
+    assert pool.stats()['size'] == 3 and pool.stats()['waits'] == 0
+
+
+def test_read_out():
+    cam = Camera([0, 1], fps=150, colour=['bayer', 'gray'], simulate=True)
+    try:
+        out = [np.empty(s, dtype=np.uint8) for s in cam.shape]
+        frames, ts, infos = cam.read(info=True, out=out)
+        assert frames[0] is out[0] and frames[1] is out[1]
+        assert stamp(out[0]) == infos[0]['seq']
+
+        frame = np.empty(cam.shape[0], dtype=np.uint8)
+        assert cam.read(0, timestamp=False, out=frame) is frame
+        for bad in [np.empty((10, 10), dtype=np.uint8), np.empty(cam.shape[0], dtype=np.uint16), out[:1]]:
+            try:
+                cam.read(out=bad)
+                assert False, 'expected out to be rejected'
+            except Exception:
+                pass
+
+        # frames read into a pool stay intact through later reads
+        pool = cam.frame_pool(size=4)
+        held = [cam.read(timestamp=False, info=True, out=pool) for _ in range(3)]
+        for frames, infos in held:
+            assert stamp(frames[0]) == infos[0]['seq']
+            frames.release()
+    finally:
+        cam.end()
+
+
+def test_camdump_pool():
+    # a plain queue receives frame sets from the pool, which the consumer releases: nothing is allocated while streaming
+    cam = Camera(0, fps=150, colour='bayer', simulate=True)
+    pool = cam.frame_pool(size=4)
+    que = queue.Queue()
+    cd = CamDump(cam, [que], pool=pool)
+    try:
+        last = -1
+        for _ in range(40):
+            frames, ts = que.get(timeout=2)
+            n = stamp(frames[0])
+            assert n > last
+            last = n
+            frames.release()
+    finally:
+        cd.end()
+        cam.end()
+    assert pool.stats()['size'] == 4
+
+
+if __name__ == '__main__':
+    test_pool_recycles()
+    test_pool_grows()
+    test_read_out()
+    test_camdump_pool()
+    print('FramePool tests passed')
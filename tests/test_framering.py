@@ -0,0 +1,87 @@
+"""Checks the overflow policies and slot handling of pseyepy.asynchronous.FrameRing.
+
+Needs no camera. Run with pytest, or directly:
+  python tests/test_framering.py
+"""
+import queue
+import threading
+
+import numpy as np
+
+from pseyepy.asynchronous import FrameRing
+
+
+def item(i):
+    return [np.full((4, 6), i, dtype=np.uint8), np.full((4, 6, 3), i, dtype=np.uint8)], [i, i + 0.5]
+
+
+def make(capacity, policy):
+    return FrameRing([(4, 6), (4, 6, 3)], capacity=capacity, policy=policy)
+
+
+def test_drop_oldest():
+    ring = make(3, 'drop_oldest')
+    for i in range(5):
+        assert ring.put(item(i))
+    assert ring.stats()['occupancy'] == 3
+    assert ring.stats()['dropped'] == 2
+    frames, ts = ring.get()
+    assert frames[0][0, 0] == 2 and frames[1][0, 0, 2] == 2
+    assert list(ts) == [2, 2.5]
+
+
+def test_drop_newest():
+    ring = make(2, 'drop_newest')
+    assert [ring.put(item(i)) for i in range(4)] == [True, True, False, False]
+    assert ring.get()[1][0] == 0
+    assert ring.get()[1][0] == 1
+    try:
+        ring.get(block=False)
+        assert False, 'expected queue.Empty'
+    except queue.Empty:
+        pass
+
+
+def test_block():
+    ring = make(2, 'block')
+    ring.put(item(0))
+    ring.put(item(1))
+    try:
+        ring.put(item(2), timeout=0.01)
+        assert False, 'expected queue.Full'
+    except queue.Full:
+        pass
+    ring.get()
+    ring.put(item(2), timeout=1)
+    assert ring.stats()['dropped'] == 0
+
+
+def test_held_slot_is_not_overwritten():
+    # the item returned by get stays intact while the producer keeps wrapping around
+    ring = make(2, 'drop_oldest')
+    ring.put(item(7))
+    frames, ts = ring.get()
+    for i in range(10):
+        ring.put(item(i))
+    assert (frames[0] == 7).all() and ts[0] == 7
+
+
+def test_producer_consumer():
+    ring = make(4, 'block')
+    n = 2000
+    producer = threading.Thread(target=lambda: [ring.put(item(i % 256)) for i in range(n)])
+    producer.start()
+    for i in range(n):
+        frames, ts = ring.get(timeout=5)
+        assert ts[0] == i % 256 and (frames[1] == i % 256).all()
+    producer.join()
+    assert ring.stats()['put'] == n
+
+
+if __name__ == '__main__':
+    test_drop_oldest()
+    test_drop_newest()
+    test_block()
+    test_held_slot_is_not_overwritten()
+    test_producer_consumer()
+    print('FrameRing tests passed')
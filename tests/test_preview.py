@@ -0,0 +1,91 @@
+"""Checks the preview pipeline of pseyepy.ui.Display (the Preview thread and its mailboxes) on simulated cameras, without opening a window.
+
+Needs no camera. Run with pytest, or directly:
+  python tests/test_preview.py
+"""
+import queue
+import threading
+import time
+
+import numpy as np
+
+from pseyepy import Camera
+from pseyepy.ui import Mailbox, Preview, downsample
+
+
+def test_downsample():
+    img = np.arange(6 * 8 * 3, dtype=np.uint8).reshape(6, 8, 3)
+    small = downsample(img, 2)
+    assert small.shape == (3, 4, 3)
+    assert small[1, 2, 0] == np.round(img[2:4, 4:6, 0].mean())
+    # leftover rows and columns are cropped
+    assert downsample(img[..., 0], 4).shape == (1, 2)
+
+
+def test_mailbox_keeps_newest():
+    mb = Mailbox()
+    assert mb.take() is None
+    for i in range(5):
+        mb.put(i)
+    assert mb.take() == 4 and mb.take() is None
+    assert mb.n_replaced == 4
+
+
+def test_preview_drains_camera():
+    # the preview reads the cameras at their frame rate, and makes previews at a lower one
+    cam = Camera([0, 1], resolution=[Camera.RES_LARGE, Camera.RES_SMALL], fps=60, colour=['rgb', 'gray'], simulate=True)
+    preview = Preview(lambda: cam.read(timestamp=True, squeeze=False), rate=10)
+    try:
+        assert preview.started.wait(5)
+        time.sleep(1)
+        frames = [mb.take()[0] for mb in preview.mailboxes]
+        assert frames[0].shape == (240, 320, 3) and frames[1].shape == (240, 320)
+        assert preview.n_grabbed > 40 and preview.mailboxes[0].n_put <= 13
+    finally:
+        preview.end()
+        preview.join()
+        cam.end()
+
+
+def test_end_before_camera():
+    # at 2 fps, the preview spends nearly all its time waiting in cam.read
+    cam = Camera(0, fps=2, colour='bayer', simulate=True)
+    errors = []
+    hook, threading.excepthook = threading.excepthook, errors.append
+    try:
+        preview = Preview(lambda: cam.read(timestamp=True, squeeze=False))
+        assert preview.started.wait(5)
+        assert preview.end() and not preview.is_alive()
+
+        # a camera closed under a preview that is still waiting for it ends it quietly
+        preview = Preview(lambda: cam.read(timestamp=True, squeeze=False))
+        time.sleep(0.1)
+        preview.kill.set()
+        cam.end()
+        preview.join(timeout=2)
+        assert not preview.is_alive() and errors == []
+    finally:
+        threading.excepthook = hook
+        cam.end()
+
+
+def test_empty_grabs_back_off():
+    calls = []
+
+    def grab():
+        calls.append(1)
+        raise queue.Empty
+
+    preview = Preview(grab, rate=20)
+    time.sleep(0.5)
+    preview.end()
+    assert len(calls) <= 15
+
+
+if __name__ == '__main__':
+    test_downsample()
+    test_mailbox_keeps_newest()
+    test_preview_drains_camera()
+    test_end_before_camera()
+    test_empty_grabs_back_off()
+    print('Preview tests passed')
@@ -0,0 +1,107 @@
+"""Tests the frame-processing kernels and the Processor of pseyepy.processing, and event-triggered recording with Stream on a simulated camera.
+
+Needs no camera. Run with pytest, or directly:
+  python tests/test_processing.py
+"""
+import os
+import queue
+import tempfile
+import time
+
+import numpy as np
+
+from pseyepy import Camera
+from pseyepy.asynchronous import FrameRing
+from pseyepy.io import RawReader, RawWriter, Stream
+from pseyepy.processing import BackgroundSubtraction, BlobCentroid, FrameDiff, Processor, luminance
+
+
+def scene(blob=None, shape=(48, 64)):
+    # a dark frame, with a bright 8x8 square at (x, y) if given
+    frame = np.full(shape, 20, dtype=np.uint8)
+    if blob is not None:
+        x, y = blob
+        frame[y:y + 8, x:x + 8] = 230
+    return frame
+
+
+def test_kernels():
+    rgb = np.random.default_rng(0).integers(0, 256, (6, 8, 3), dtype=np.uint8)
+    lum = luminance(rgb, 2)
+    ref = (rgb[::2, ::2].astype(int) * [1, 2, 1]).sum(axis=2) // 4
+    assert lum.dtype == np.uint8 and np.array_equal(lum, ref)
+
+    diff = FrameDiff()
+    assert diff(scene()) == dict(diff=0., motion=0.)
+    assert diff(scene())['motion'] == 0
+    assert diff(scene((10, 20)))['motion'] == 16 / (24 * 32)
+
+    # centroid of the square's pixels, in full-frame coordinates
+    found = BlobCentroid(step=1)(scene((10, 20)))
+    assert (found['x'], found['y'], found['area']) == (13.5, 23.5, 64)
+    found = BlobCentroid(step=2)(scene((10, 20)))
+    assert (found['x'], found['y'], found['area']) == (13, 23, 64)
+    assert np.isnan(BlobCentroid()(scene())['x'])
+
+    bg = BackgroundSubtraction(step=1)
+    for _ in range(5):
+        assert bg(scene())['foreground'] == 0
+    found = bg(scene((30, 4)))
+    assert (found['fg_x'], found['fg_y']) == (33.5, 7.5)
+
+
+def test_triggered_forwarding():
+    shape = (48, 64)
+    src = FrameRing([shape], capacity=128, policy='block', seq=True)
+    out = queue.Queue()
+    proc = Processor(src, [FrameDiff(), BlobCentroid()], outputs=[out], trigger=('motion', 0.01), pre_trigger=10, post_trigger=20)
+    try:
+        # the square shows in frames 40-44 only, so the scene changes at 40 and 45
+        for k in range(100):
+            src.put(([scene((10, 20) if 40 <= k < 45 else None, shape)], np.array([k / 60]), np.array([k])))
+    finally:
+        proc.end()
+
+    forwarded = []
+    while not out.empty():
+        frames, ts, seqs = out.get()
+        forwarded.append(int(seqs[0]))
+    assert forwarded == list(range(30, 66))
+    assert proc.events == [[40 / 60, 45 / 60]] and proc.stats()['events'] == 1
+
+    res = proc.results()
+    assert len(res) == 100 and list(res['seq']) == list(range(100))
+    assert np.all(np.isnan(res['x'][:40])) and np.all(res['x'][40:45] == 13)
+
+
+def test_stream_records_events_only():
+    # a replayed scene that changes at frames 20 and 21 of every 40
+    replay = np.zeros((40, 240, 320), dtype=np.uint8)
+    replay[20, 100:140, 100:140] = 255
+    cam = Camera(0, fps=60, colour='bayer', simulate=dict(frames=replay))
+    with tempfile.TemporaryDirectory() as d:
+        name = os.path.join(d, 'rec')
+        try:
+            stream = Stream(cam, file_name=name, writer_class=RawWriter, trigger=('motion', 0.01), pre_trigger=5, post_trigger=5, results_file=name + '_results.csv')
+            time.sleep(1.5)
+            stream.end()
+            stats = stream.stats()
+        finally:
+            cam.end()
+
+        with RawReader(name + '_0') as r:
+            assert 0 < len(r) < stats['process']['processed']
+            # frames 15-26 of each cycle: 5 before the first change, 5 after the second
+            assert set(r.seq % 40) <= set(range(15, 27))
+        assert stats['process']['events'] >= 1
+
+        results = np.genfromtxt(name + '_results.csv', delimiter=',', names=True)
+        assert len(results) == stats['process']['processed']
+        assert list(results.dtype.names) == ['timestamp', 'seq', 'cam', 'diff', 'motion']
+
+
+if __name__ == '__main__':
+    test_kernels()
+    test_triggered_forwarding()
+    test_stream_records_events_only()
+    print('Processing tests passed')
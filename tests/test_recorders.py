@@ -0,0 +1,68 @@
+"""Round-trips frames through the raw recorders in pseyepy.io (RawWriter, HDF5Writer) and RawReader.
+
+Needs no camera. Run with pytest, or directly:
+  python tests/test_recorders.py
+"""
+import os
+import tempfile
+
+import numpy as np
+
+from pseyepy.io import HDF5Writer, RawWriter, RawReader
+
+
+def frame(k, colour):
+    shape = (24, 32, 3) if colour else (24, 32)
+    return np.random.default_rng(k).integers(0, 256, shape, dtype=np.uint8)
+
+
+def round_trip(klass, colour, **kw):
+    with tempfile.TemporaryDirectory() as d:
+        name = os.path.join(d, 'rec')
+        # 70 frames: two full batches and a partial one, with a gap in the sequence numbers
+        seqs = [k if k < 40 else k + 3 for k in range(70)]
+        w = klass(name, shape=(32, 24), colour=colour, fps=60, batch_frames=32, **kw)
+        for k, sq in enumerate(seqs):
+            w.write(frame(k, colour), timestamp=k / 60, seq=sq)
+        w.end()
+
+        with RawReader(name) as r:
+            assert len(r) == 70 and r.fps == 60
+            assert r.shape == frame(0, colour).shape
+            for k in [0, 31, 32, 45, 69]:
+                assert np.array_equal(r[k], frame(k, colour))
+            assert np.array_equal(r[10:13], np.array([frame(k, colour) for k in range(10, 13)]))
+            assert np.allclose(r.timestamps, np.arange(70) / 60)
+            assert list(r.seq) == seqs
+
+
+def test_raw():
+    round_trip(RawWriter, colour=False)
+    round_trip(RawWriter, colour=True)
+
+
+def test_hdf5():
+    round_trip(HDF5Writer, colour=False)
+    round_trip(HDF5Writer, colour=True, compression='lzf')
+
+
+def test_raw_truncated():
+    # a recording cut short mid-frame is read up to its last complete frame
+    with tempfile.TemporaryDirectory() as d:
+        name = os.path.join(d, 'rec')
+        w = RawWriter(name, shape=(32, 24), batch_frames=4)
+        for k in range(8):
+            w.write(frame(k, False), timestamp=k)
+        w.end()
+        with open(name + '.raw', 'r+b') as f:
+            f.truncate(32 * 24 * 7 + 100)
+        with RawReader(name + '.raw') as r:
+            assert len(r) == 7
+            assert list(r.seq) == list(range(7))
+
+
+if __name__ == '__main__':
+    test_raw()
+    test_hdf5()
+    test_raw_truncated()
+    print('Recorder tests passed')
@@ -0,0 +1,81 @@
+"""Tests the in-driver frame reduction of pseyepy.Camera (roi, binning, decimation) on simulated cameras, against cropping and binning the whole decoded frame.
+
+Needs no camera. Run with pytest, or directly:
+  python tests/test_reduction.py
+"""
+import numpy as np
+
+from pseyepy import Camera
+from pseyepy.cameras import debayer
+
+
+def bin_frame(frame, b, bayer=False):
+    # rounded mean of each b x b block; of each colour's b x b block for a Bayer mosaic
+    if bayer:
+        out = np.empty((frame.shape[0] // b, frame.shape[1] // b), dtype=np.uint8)
+        for dy in (0, 1):
+            for dx in (0, 1):
+                out[dy::2, dx::2] = bin_frame(frame[dy::2, dx::2], b)
+        return out
+    h, w = frame.shape[:2]
+    total = frame.astype(np.uint32).reshape((h // b, b, w // b, b) + frame.shape[2:]).sum(axis=(1, 3))
+    return ((total + b * b // 2) // (b * b)).astype(np.uint8)
+
+
+def test_roi_and_binning():
+    rng = np.random.default_rng(0)
+    replay = rng.integers(0, 256, (3, 240, 320), dtype=np.uint8)
+    colours = ['rgb', 'gray', 'green', 'rgb_half', 'bayer']
+    # regions at the frame's edges, where the decoder interpolates differently
+    for roi in [(0, 0, 160, 120), (256, 192, 64, 48), (2, 4, 96, 64)]:
+        for binning in [1, 2, 4]:
+            cam = Camera(list(range(len(colours))), fps=60, colour=colours, simulate=dict(count=len(colours), frames=replay), roi=roi, binning=binning)
+            try:
+                x, y, w, h = roi
+                for _ in range(3):
+                    frames, ts, infos = cam.read(info=True)
+                    for frame, colour, info, shape in zip(frames, colours, infos, cam.shape):
+                        s = 2 if colour == 'rgb_half' else 1
+                        full = debayer(replay[info['seq'] % 3], colour)
+                        expected = bin_frame(full[y // s:(y + h) // s, x // s:(x + w) // s], binning, bayer=colour == 'bayer')
+                        assert frame.shape == expected.shape == shape
+                        assert (frame == expected).all(), (roi, binning, colour)
+            finally:
+                cam.end()
+
+
+def test_per_camera_roi():
+    cam = Camera([0, 1], fps=60, colour='gray', simulate=True, roi=[None, (32, 16, 64, 32)])
+    try:
+        assert cam.shape == [(240, 320), (32, 64)]
+        assert [f.shape for f in cam.read(timestamp=False)] == cam.shape
+    finally:
+        cam.end()
+
+
+def test_invalid_reduction():
+    for kwargs in [dict(roi=(1, 0, 64, 64)), dict(roi=(0, 0, 60, 64), binning=4), dict(roi=(300, 0, 64, 64)), dict(binning=3), dict(decimation=0)]:
+        try:
+            Camera(0, simulate=True, **kwargs).end()
+        except Exception:
+            pass
+        else:
+            raise AssertionError('expected {} to be rejected'.format(kwargs))
+
+
+def test_decimation():
+    cam = Camera(0, fps=150, colour='bayer', simulate=True, decimation=3)
+    try:
+        seqs = [cam.read(info=True)[2]['seq'] for _ in range(10)]
+        assert all([s % 3 == 0 for s in seqs])
+        assert np.all(np.diff(seqs) >= 3)
+    finally:
+        cam.end()
+
+
+if __name__ == '__main__':
+    test_roi_and_binning()
+    test_per_camera_roi()
+    test_invalid_reduction()
+    test_decimation()
+    print('Frame reduction tests passed')
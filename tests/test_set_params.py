@@ -0,0 +1,73 @@
+"""Tests Camera.set_params, the batched parameter changes, on simulated cameras.
+
+Needs no camera. Run with pytest, or directly:
+  python tests/test_set_params.py
+"""
+from pseyepy import Camera
+
+
+def test_set_params():
+    cam = Camera([0, 1], fps=60, simulate=True)
+    try:
+        future = cam.set_params({'gain': 20, 'exposure': [100, 120], 'vflip': True})
+        assert future.result() == []
+        assert cam.gain == [20, 20] and cam.exposure == [100, 120] and cam.vflip == [True, True]
+
+        # deferred to the next frame, in the background, and for one camera only
+        future = cam.set_params({'exposure': 5, 'hflip': True}, idx=1, at_frame=True, block=False)
+        assert future.result(timeout=2) == []
+        assert cam.exposure == [100, 5] and cam.hflip[1] == True
+
+        # calls made without blocking are applied in order
+        for val in range(30):
+            cam.set_params({'gain': val}, block=False)
+        cam.set_params({'exposure': 7}).result()
+        assert cam.gain == [29, 29]
+        assert cam.read(timestamp=False)[0].shape == (240, 320, 3)
+    finally:
+        cam.end()
+
+
+def test_set_params_validation():
+    cam = Camera(0, fps=60, simulate=True, gain=10)
+    try:
+        for params in [{'gain': 64}, {'gain': 1.5}, {'gain': [1, 2]}, {'not_a_param': 1}]:
+            try:
+                cam.set_params(params)
+            except Exception:
+                pass
+            else:
+                raise AssertionError('expected {} to be rejected'.format(params))
+        # nothing is changed by a batch that fails validation
+        try:
+            cam.set_params({'exposure': 3, 'gain': -1})
+        except Exception:
+            pass
+        assert cam.gain == [10] and cam.exposure != [3]
+    finally:
+        cam.end()
+
+
+def test_failed_values_are_not_recorded():
+    cam = Camera(0, fps=60, simulate=True, gain=10)
+    try:
+        # registers that never hold the value requested for gain
+        writes = []
+        write_params = cam._write_params
+        cam._write_params = lambda changed, timeout_ms: (writes.append(changed), write_params(changed, timeout_ms))
+        cam._check_params = lambda changed: [(i, name) for i,name,pconst,val in changed if name == 'gain']
+        assert cam.set_params({'gain': 20, 'exposure': 30}).result() == [(0, 'gain')]
+        assert cam.gain == [10] and cam.exposure == [30]
+
+        # so setting it again is retried rather than skipped
+        assert cam.set_params({'gain': 20, 'exposure': 30}).result() == [(0, 'gain')]
+        assert [[name for i,name,pconst,val in changed] for changed in writes] == [['gain', 'exposure'], ['gain']]
+    finally:
+        cam.end()
+
+
+if __name__ == '__main__':
+    test_set_params()
+    test_set_params_validation()
+    test_failed_values_are_not_recorded()
+    print('set_params tests passed')
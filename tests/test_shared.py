@@ -0,0 +1,120 @@
+"""Checks the shared-memory frame ring in pseyepy.shared, with a writer in another process.
+
+Needs no camera. Run with pytest, or directly:
+  python tests/test_shared.py
+"""
+import multiprocessing as mp
+import queue
+import time
+
+import numpy as np
+
+from pseyepy.shared import CaptureProcess, SharedFrameRing, SharedFrameReader
+
+SHAPES = [(6, 8), (6, 8, 3)]
+
+
+def frame_set(k):
+    return [np.full(s, k % 256, dtype=np.uint8) for s in SHAPES], [k, k + 0.5]
+
+
+def writer(ring_name, n, go):
+    ring = SharedFrameRing.attach(ring_name)
+    go.wait()
+    for k in range(n):
+        ring.publish(*frame_set(k))
+    ring.close()
+
+
+def test_cross_process():
+    ring = SharedFrameRing.create(SHAPES, capacity=8)
+    try:
+        reader = SharedFrameReader(ring.name)
+        assert reader.shapes == SHAPES
+
+        # frame sets published by another process are read here in order, intact, with any that were overwritten before being read counted as missed
+        go = mp.Event()
+        proc = mp.Process(target=writer, args=(ring.name, 200, go))
+        proc.start()
+        go.set()
+
+        seen = []
+        while len(seen) < 200 - reader.n_missed:
+            frames, ts, seq = reader.get(timeout=5, copy=True)
+            assert ts[0] == seq and (frames[0] == seq % 256).all() and (frames[1] == seq % 256).all()
+            seen.append(seq)
+        proc.join()
+        assert seen == sorted(seen)
+        assert len(seen) + reader.n_missed == 200
+        reader.close()
+    finally:
+        ring.close()
+
+
+def test_overrun_and_latest():
+    ring = SharedFrameRing.create(SHAPES, capacity=4)
+    reader = SharedFrameReader(ring.name)
+    for k in range(10):
+        ring.publish(*frame_set(k))
+
+    # the reader fell behind by more than the ring holds: skips to the oldest frame set not being overwritten
+    frames, ts, seq = reader.get(timeout=0)
+    assert seq == 7 and reader.n_missed == 7
+    assert reader.valid(seq)
+    frames, ts, seq = reader.get(latest=True, timeout=0)
+    assert seq == 9 and ts[1] == 9.5
+    try:
+        reader.get(timeout=0.01)
+        assert False, 'expected queue.Empty'
+    except queue.Empty:
+        pass
+
+    # views are invalidated once the writer wraps around to their slot
+    for k in range(10, 14):
+        ring.publish(*frame_set(k))
+    assert not reader.valid(9)
+
+    ring.close()
+    reader.get(timeout=0)  # published before closing, still readable
+    try:
+        while True:
+            reader.get(timeout=0)
+    except EOFError:
+        pass
+    reader.close()
+
+
+class StuckCapture(CaptureProcess):
+    # creates its ring, then hangs as if opening the camera never returned
+    last = None
+
+    def start(self):
+        StuckCapture.last = self
+        super().start()
+
+    def run(self):
+        ring = SharedFrameRing.create(SHAPES, name=self.shm_name)
+        time.sleep(60)
+
+
+def test_failed_start_cleans_up():
+    try:
+        StuckCapture(startup_timeout=0.5)
+        assert False, 'expected the start to time out'
+    except Exception as exc:
+        assert 'did not start' in str(exc)
+
+    proc = StuckCapture.last
+    assert not proc.is_alive()
+    try:
+        SharedFrameReader(proc.shm_name)
+        assert False, 'expected the ring to be freed'
+    except FileNotFoundError:
+        pass
+
+
+if __name__ == '__main__':
+    test_cross_process()
+    test_overrun_and_latest()
+    test_failed_start_cleans_up()
+    print('Shared ring tests passed')
@@ -0,0 +1,242 @@
+"""Runs pseyepy.Camera on simulated cameras, whose USB data goes through the driver's real packet parser and frame queue.
+
+Needs no camera. Run with pytest, or directly:
+  python tests/test_simulated.py
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+from pseyepy import Camera, cam_count, cam_identifiers
+from pseyepy.cameras import debayer
+
+
+def stamp(raw):
+    # frame number stamped into synthetic frames
+    return int.from_bytes(raw.ravel()[:8].tobytes(), 'little')
+
+
+def test_count():
+    assert cam_count(simulate=3) == 3
+    os.environ['PSEYEPY_SIMULATE'] = '2,loss=0.5'
+    try:
+        assert cam_count() == 2
+    finally:
+        del os.environ['PSEYEPY_SIMULATE']
+
+
+def test_synthetic_frames_in_order():
+    cam = Camera([0, 1], fps=150, colour='bayer', simulate=True, queue_depth=4)
+    try:
+        last = [-1, -1]
+        for _ in range(30):
+            frames, ts, infos = cam.read(info=True)
+            for i, (frame, info) in enumerate(zip(frames, infos)):
+                assert frame.shape == (240, 320)
+                assert stamp(frame) == info['seq'] > last[i]
+                last[i] = info['seq']
+        st = cam.stats(0)
+        assert st['frames'] >= 30 and st['discarded'] == 0 and st['bad_headers'] == 0
+        assert st['transfers'] > 0 and st['bytes'] >= st['frames'] * 320 * 240
+        assert 100 < st['fps'] < 200
+    finally:
+        cam.end()
+
+
+def test_loss_discards_frames():
+    cam = Camera(0, fps=150, colour='bayer', simulate=dict(loss=0.02, seed=1))
+    try:
+        for _ in range(30):
+            frame, ts, info = cam.read(info=True)
+            # frames are numbered at the source; lost ones leave gaps the driver does not see
+            assert stamp(frame) >= info['seq']
+        st = cam.stats(0)
+        assert st['discarded'] > 0 and st['bad_headers'] == 0
+    finally:
+        cam.end()
+
+
+def test_replay():
+    rng = np.random.default_rng(0)
+    replay = rng.integers(0, 256, (3, 240, 320), dtype=np.uint8)
+    cam = Camera([0, 1], fps=150, colour=['bayer', 'rgb'], simulate=dict(frames=replay))
+    try:
+        for _ in range(10):
+            (raw, rgb), ts, infos = cam.read(info=True)
+            assert (raw == replay[infos[0]['seq'] % 3]).all()
+            assert (rgb == debayer(replay[infos[1]['seq'] % 3], 'rgb')).all()
+    finally:
+        cam.end()
+
+
+def test_replay_resolution_mismatch():
+    try:
+        Camera(0, resolution=Camera.RES_LARGE, simulate=dict(frames=np.zeros((240, 320), dtype=np.uint8)))
+    except Exception as exc:
+        assert 'do not match' in str(exc)
+    else:
+        raise AssertionError('expected a resolution mismatch')
+
+
+def test_read_batch():
+    cam = Camera([0, 1], fps=150, colour=['bayer', 'rgb'], simulate=True, queue_depth=4)
+    try:
+        (raw, rgb), (ts, _), (info, _) = cam.read_batch(20, info=True)
+        assert raw.shape == (20, 240, 320) and rgb.shape == (20, 240, 320, 3)
+        assert [stamp(f) for f in raw] == list(info['seq'])
+        assert np.all(np.diff(info['seq']) > 0) and np.all(np.diff(ts) >= 0)
+
+        # stops early on the timeout, with only the frames read
+        out = np.zeros((100, 240, 320), dtype=np.uint8)
+        frames, ts = cam.read_batch(100, idx=0, timeout=0.1, out=out)
+        assert 0 < len(frames) < 100 and len(ts) == len(frames)
+        assert np.shares_memory(frames, out)
+    finally:
+        cam.end()
+
+
+def test_read_sync():
+    cam = Camera([0, 1], fps=150, colour='bayer', simulate=True)
+    try:
+        out = np.zeros((2, 240, 320), dtype=np.uint8)
+        frames, arrivals = cam.read_sync(out=out)
+        assert frames is out and len(arrivals) == 2
+        assert abs(arrivals[0] - arrivals[1]) <= 0.5 / 150
+
+        # the driver writes through a raw pointer, so it must not be handed memory it may not write
+        out.flags.writeable = False
+        before = out.copy()
+        for bad in [out, np.zeros((2, 240, 640), dtype=np.uint8)[:, :, ::2]]:
+            try:
+                cam.read_sync(out=bad)
+            except Exception as exc:
+                assert 'writeable, C-contiguous' in str(exc)
+            else:
+                raise AssertionError('expected out to be rejected')
+        assert np.array_equal(out, before)
+    finally:
+        cam.end()
+
+
+def test_latest_policy():
+    cam = Camera(0, fps=150, colour='bayer', simulate=True, queue_depth=6)
+    try:
+        time.sleep(0.1)
+        # fifo hands out the oldest frame waiting
+        _, info = cam.read(timestamp=False, info=True)
+        assert info['seq'] == 0 and cam.stats(0)['frames'] > 3
+
+        cam.set_policy('latest')
+        time.sleep(0.1)
+        frame, info = cam.read(timestamp=False, info=True)
+        assert stamp(frame) == info['seq'] >= cam.stats(0)['frames'] - 3
+        assert cam.drop_counts(0)['skipped'] > 0 and cam.policy == ['latest']
+
+        # nothing newer yet
+        assert cam.read(timestamp=False, block=False) is None
+        time.sleep(0.05)
+        assert cam.read(timestamp=False, block=False) is not None
+    finally:
+        cam.end()
+
+
+def test_end_wakes_blocked_reader():
+    # at 2 fps, a reader spends nearly all its time waiting in the driver
+    cam = Camera(0, fps=2, colour='bayer', simulate=True)
+    errors = []
+
+    def reader():
+        try:
+            while True:
+                cam.read()
+        except Exception as exc:
+            errors.append(str(exc))
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    time.sleep(0.7)
+    cam.end()
+    thread.join(timeout=2)
+    assert not thread.is_alive() and errors == ['Camera has been closed.']
+
+
+def test_read_refused_while_acquired():
+    cam = Camera(0, fps=150, colour='bayer', simulate=True, queue_depth=4)
+    try:
+        frame = cam.acquire(0)
+        # as if another thread had passed the check in read before the frame was acquired: the driver itself refuses
+        cam._held.clear()
+        for read in [lambda: cam.read(), lambda: cam.read_batch(2)]:
+            try:
+                read()
+            except Exception as exc:
+                assert 'acquired frame' in str(exc)
+            else:
+                raise AssertionError('expected the read to be refused')
+        seq = frame.info['seq']
+        frame.release()
+        # the held frame was not taken by the refused reads
+        assert cam.read(timestamp=False, info=True)[1]['seq'] == seq + 1
+    finally:
+        cam.end()
+
+
+def test_settings():
+    cam = Camera(0, fps=60, simulate=True, exposure=77, vflip=True)
+    try:
+        assert cam.exposure == [77] and cam.vflip == [True]
+        cam.gain = 12
+        assert cam.gain == [12]
+        assert cam.read(timestamp=False).shape == (240, 320, 3)
+    finally:
+        cam.end()
+
+
+def test_identifiers():
+    assert cam_identifiers(simulate=3) == ['sim0', 'sim1', 'sim2']
+    cam = Camera(['sim2', 0], simulate=3)
+    try:
+        assert cam.ids == [2, 0] and cam.identifiers == ['sim2', 'sim0']
+    finally:
+        cam.end()
+    # as many simulated cameras as the identifiers require
+    cam = Camera(['sim0', 'sim1'], simulate=True)
+    try:
+        assert cam.ids == [0, 1] and len(cam.read()[0]) == 2
+    finally:
+        cam.end()
+    cam = Camera('sim3', simulate=True)
+    try:
+        assert cam.ids == [3]
+    finally:
+        cam.end()
+
+
+def test_parallel_open():
+    # each camera waits 110 ms for its sensor to reset while opening, so 8 cameras opened one at a time would take over 0.88 s
+    t0 = time.perf_counter()
+    cam = Camera(list(range(8)), simulate=8)
+    try:
+        assert time.perf_counter() - t0 < 0.5
+        assert len(cam.read()[0]) == 8
+    finally:
+        cam.end()
+
+
+if __name__ == '__main__':
+    test_count()
+    test_synthetic_frames_in_order()
+    test_loss_discards_frames()
+    test_replay()
+    test_replay_resolution_mismatch()
+    test_read_batch()
+    test_read_sync()
+    test_latest_policy()
+    test_end_wakes_blocked_reader()
+    test_read_refused_while_acquired()
+    test_settings()
+    test_identifiers()
+    test_parallel_open()
+    print('Simulated camera tests passed')